@@ -10,6 +10,8 @@ from motor.motor_asyncio import AsyncIOMotorClient
 from dotenv import load_dotenv
 from pathlib import Path
 
+from customer_search import customer_search_fields
+
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
@@ -113,6 +115,9 @@ async def add_medical_products():
         }
     ]
     
+    for product in products:
+        product["is_low_stock"] = product["quantity"] <= product["min_quantity"]
+    
     result = await db.products.insert_many(products)
     print(f"✅ {len(result.inserted_ids)} adet medikal ürün eklendi")
     return products
@@ -177,6 +182,10 @@ async def add_customers():
         }
     ]
     
+    # API'nin yazdığı arama alanları; yoksa /customers/search bu müşterileri bulamaz
+    for customer in customers:
+        customer.update(customer_search_fields(customer["name"], customer["phone"]))
+    
     result = await db.customers.insert_many(customers)
     print(f"✅ {len(result.inserted_ids)} adet müşteri eklendi")
     return customers
@@ -0,0 +1,362 @@
+"""
+API sıcak yollarının yük testi / benchmark script'i
+FastAPI uygulamasını süreç içinde (httpx ASGI transport) yerel bir mongod'a karşı
+çalıştırır; POS barkod okutma, satış, dashboard, ürün listesi, müşteri araması ve
+raporlar için p50/p95/p99 gecikme ve saniyedeki istek sayısını ölçer.
+
+Kullanım:
+    python benchmark_api.py [--products 1000 10000 100000] [--sales 10000 1000000]
+                            [--requests 200] [--concurrency 10]
+                            [--output sonuc.json] [--baseline onceki.json] [--threshold 0.2]
+
+Her ürün x satış boyutu için DB_NAME + "_benchmark" veritabanı sıfırlanıp doldurulur.
+--baseline verilirse p95 değeri eşiğin üzerinde kötüleşen senaryolar listelenir ve
+script 1 ile çıkar; böylece CI'da gerilemeler yakalanabilir.
+"""
+import os
+import sys
+import math
+import time
+import json
+import uuid
+import random
+import asyncio
+import logging
+import argparse
+import platform
+import subprocess
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+from dotenv import load_dotenv
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+# server import edilmeden önce: ayrı veritabanı, yavaş sorgu kaydı kapalı
+os.environ['DB_NAME'] = os.environ['DB_NAME'] + "_benchmark"
+os.environ.setdefault('SLOW_QUERY_MS', '0')
+
+import httpx
+
+import server
+from server import app, db, customer_search_fields, is_low_stock
+
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+DEFAULT_PRODUCT_COUNTS = [1000, 10000, 100000]
+DEFAULT_SALE_COUNTS = [10000, 1000000]
+CUSTOMER_COUNT = 5000
+SEED_BATCH_SIZE = 10000
+WARMUP_REQUESTS = 10
+SALE_DAYS = 90
+
+BRANDS = ["Omron", "Braun", "Beurer", "Medline", "Accu-Chek", "Philips", "Microlife"]
+CATEGORIES = ["Medikal Cihaz", "Medikal Sarf", "Ortopedi", "Hasta Bakım"]
+FIRST_NAMES = ["Ayşe", "Mehmet", "Fatma", "Ali", "Zeynep", "Mustafa", "Elif", "Hüseyin", "Şule", "İsmail", "Çağla", "Ömer"]
+LAST_NAMES = ["Yılmaz", "Kaya", "Demir", "Şahin", "Çelik", "Yıldız", "Öztürk", "Aydın", "Arslan", "Doğan", "Kılıç", "Güneş"]
+
+def barcode_for(index: int) -> str:
+    return f"BENCH{index:08d}"
+
+async def insert_batched(collection, make_doc, count: int):
+    for start in range(0, count, SEED_BATCH_SIZE):
+        docs = [make_doc(i) for i in range(start, min(start + SEED_BATCH_SIZE, count))]
+        await collection.insert_many(docs, ordered=False)
+
+async def seed(product_count: int, sale_count: int) -> dict:
+    """Ürün, müşteri ve satış verisini doğrudan Mongo'ya yazar; senaryoların kullanacağı bağlamı döndürür"""
+    now = datetime.now(timezone.utc)
+    products = []
+
+    def make_product(i):
+        quantity = random.randint(0, 200) if i % 10 == 0 else 1_000_000  # Satış senaryosu stoğu tüketmesin
+        min_quantity = 10
+        product = {
+            "id": str(uuid.uuid4()),
+            "name": f"{random.choice(BRANDS)} Ürün {i}",
+            "barcode": barcode_for(i),
+            "quantity": quantity,
+            "min_quantity": min_quantity,
+            "is_low_stock": is_low_stock(quantity, min_quantity),
+            "brand": random.choice(BRANDS),
+            "category": random.choice(CATEGORIES),
+            "purchase_price": round(random.uniform(10, 500), 2),
+            "sale_price": round(random.uniform(20, 800), 2),
+            "description": "Benchmark ürünü",
+            "image_url": None,
+            "thumbnail_url": None,
+            "unit_type": "adet",
+            "package_quantity": None,
+            "created_at": now - timedelta(days=i % 365),
+            "updated_at": now
+        }
+        products.append(product)
+        return product
+
+    def make_customer(i):
+        name = f"{random.choice(FIRST_NAMES)} {random.choice(LAST_NAMES)}"
+        phone = f"05{random.randint(300000000, 599999999)}"
+        return {
+            "id": str(uuid.uuid4()),
+            "name": name,
+            "phone": phone,
+            "email": None,
+            "address": None,
+            "notes": None,
+            "total_spent": 0,
+            "deleted": False,
+            "created_at": now,
+            **customer_search_fields(name, phone)
+        }
+
+    def make_sale(i):
+        items = []
+        for product in random.sample(products, random.randint(1, 3)):
+            quantity = random.randint(1, 5)
+            items.append({
+                "product_id": product["id"],
+                "name": product["name"],
+                "quantity": quantity,
+                "price": product["sale_price"],
+                "total": round(product["sale_price"] * quantity, 2),
+                "purchase_price": product["purchase_price"],
+                "unit_type": "adet"
+            })
+        total = round(sum(item["total"] for item in items), 2)
+        return {
+            "id": str(uuid.uuid4()),
+            "items": items,
+            "total_amount": total,
+            "discount": 0,
+            "final_amount": total,
+            "payment_method": random.choice(["nakit", "kredi_karti"]),
+            "customer_id": None,
+            "cashier_id": "benchmark",
+            "created_at": now - timedelta(minutes=random.randint(0, 60 * 24 * SALE_DAYS))
+        }
+
+    await insert_batched(db.products, make_product, product_count)
+    await insert_batched(db.customers, make_customer, CUSTOMER_COUNT)
+    await insert_batched(db.sales, make_sale, sale_count)
+    return {"products": products, "now": now}
+
+# Senaryolar: (ad, istek oranı, istek fonksiyonu). Oran --requests ile çarpılır;
+# tüm kataloğu döndüren ağır uçlar daha az tekrarlanır.
+async def scan_barcode(http, ctx):
+    return await http.get(f"/api/products/barcode/{random.choice(ctx['products'])['barcode']}")
+
+async def checkout(http, ctx):
+    items = []
+    for product in random.sample(ctx["sellable"], random.randint(1, 3)):
+        items.append({
+            "product_id": product["id"],
+            "name": product["name"],
+            "quantity": 1,
+            "price": product["sale_price"],
+            "total": product["sale_price"]
+        })
+    total = round(sum(item["total"] for item in items), 2)
+    return await http.post("/api/sales", json={"items": items, "total_amount": total, "payment_method": "nakit"})
+
+async def dashboard(http, ctx):
+    return await http.get("/api/reports/dashboard")
+
+async def products_page(http, ctx):
+    return await http.get("/api/products", params={"limit": 50, "sort": random.choice(["name", "updated_at"])})
+
+async def products_search(http, ctx):
+    return await http.get("/api/products", params={"limit": 50, "q": f"Ürün {random.randint(1, 99)}"})
+
+async def products_full(http, ctx):
+    return await http.get("/api/products")
+
+async def low_stock(http, ctx):
+    return await http.get("/api/products/low-stock")
+
+async def customer_search(http, ctx):
+    if random.random() < 0.5:
+        q = random.choice(FIRST_NAMES)[:random.randint(2, 4)]
+    else:
+        q = f"05{random.randint(30, 59)}"
+    return await http.get("/api/customers/search", params={"q": q})
+
+def report_range(ctx) -> dict:
+    start = (ctx["now"] - timedelta(days=30)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return {"start_date": start.isoformat(), "end_date": ctx["now"].isoformat()}
+
+async def report_top_selling(http, ctx):
+    return await http.get("/api/reports/top-selling", params=report_range(ctx))
+
+async def report_top_profit(http, ctx):
+    return await http.get("/api/reports/top-profit", params=report_range(ctx))
+
+async def report_stock(http, ctx):
+    return await http.get("/api/reports/stock")
+
+SCENARIOS = [
+    ("barcode_scan", 1.0, scan_barcode),
+    ("checkout", 1.0, checkout),
+    ("dashboard", 0.5, dashboard),
+    ("products_page", 1.0, products_page),
+    ("products_search", 0.5, products_search),
+    ("products_full", 0.1, products_full),
+    ("low_stock", 0.5, low_stock),
+    ("customer_search", 1.0, customer_search),
+    ("report_top_selling", 0.25, report_top_selling),
+    ("report_top_profit", 0.25, report_top_profit),
+    ("report_stock", 0.1, report_stock),
+]
+
+def percentile(sorted_values, p: float) -> float:
+    """En yakın sıra (nearest-rank) yüzdeliği"""
+    index = max(0, math.ceil(p / 100 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+async def measure(http, ctx, request, count: int, concurrency: int) -> dict:
+    for _ in range(min(WARMUP_REQUESTS, count)):
+        await request(http, ctx)
+
+    latencies = []
+    errors = 0
+    remaining = iter(range(count))
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            started = time.perf_counter()
+            response = await request(http, ctx)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "count": count,
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 2),
+        "rps": round(count / wall, 1)
+    }
+
+async def reset_database():
+    """Veritabanını boşaltır ve startup hook'larını (admin, index, migration) yeniden çalıştırır.
+
+    Shutdown hook'u Mongo client'ını kapattığı için boyutlar arasında lifespan'den çıkılmaz.
+    """
+    await server.client.drop_database(db.name)
+    # Önceki boyuttan kalan süreç içi önbellekler yeni veriyle karışmasın
+    server.user_cache.clear()
+    server.barcode_cache.clear()
+    for handler in app.router.on_startup:
+        await handler()
+
+async def run_size(product_count: int, sale_count: int, args) -> dict:
+    await reset_database()
+
+    results = {}
+    started = time.perf_counter()
+    ctx = await seed(product_count, sale_count)
+    ctx["sellable"] = [p for p in ctx["products"] if p["quantity"] >= 1_000_000]
+    print(f"  veri hazır: {time.perf_counter() - started:.1f} sn")
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as http:
+        login = await http.post("/api/auth/login", json={"username": "admin", "password": "Admin123!"})
+        login.raise_for_status()
+        http.headers["Authorization"] = f"Bearer {login.json()['access_token']}"
+
+        # Raporlar rollup'tan okunsun
+        started = time.perf_counter()
+        (await http.post("/api/admin/rebuild-sales-daily")).raise_for_status()
+        print(f"  sales_daily rebuild: {time.perf_counter() - started:.1f} sn")
+
+        for name, weight, request in SCENARIOS:
+            if args.only and name not in args.only:
+                continue
+            count = max(WARMUP_REQUESTS, int(args.requests * weight))
+            stats = await measure(http, ctx, request, count, args.concurrency)
+            results[name] = stats
+            print(f"  {name:<20} {stats['p50_ms']:>9.1f} {stats['p95_ms']:>9.1f} {stats['p99_ms']:>9.1f} "
+                  f"{stats['rps']:>9.1f} {stats['errors']:>7}")
+    return results
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """p95'i baseline'a göre threshold oranından fazla kötüleşen (boyut, senaryo) çiftleri"""
+    regressions = []
+    for size, scenarios in results.items():
+        for name, stats in scenarios.items():
+            before = baseline.get(size, {}).get(name)
+            if not before or not before.get("p95_ms"):
+                continue
+            ratio = stats["p95_ms"] / before["p95_ms"]
+            if ratio > 1 + threshold:
+                regressions.append((size, name, before["p95_ms"], stats["p95_ms"], ratio))
+    return regressions
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR,
+                              capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+async def main():
+    parser = argparse.ArgumentParser(description="API sıcak yolları benchmark'ı")
+    parser.add_argument("--products", type=int, nargs="+", default=DEFAULT_PRODUCT_COUNTS)
+    parser.add_argument("--sales", type=int, nargs="+", default=DEFAULT_SALE_COUNTS)
+    parser.add_argument("--requests", type=int, default=200, help="Ağırlığı 1 olan senaryo başına istek sayısı")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--only", nargs="+", help="Sadece bu senaryolar")
+    parser.add_argument("--seed", type=int, default=42, help="Tekrarlanabilir veri için random seed")
+    parser.add_argument("--output", help="Sonuçların yazılacağı JSON dosyası")
+    parser.add_argument("--baseline", help="Karşılaştırılacak önceki sonuç JSON dosyası")
+    parser.add_argument("--threshold", type=float, default=0.2, help="İzin verilen p95 kötüleşme oranı")
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    results = {}
+    async with app.router.lifespan_context(app):
+        try:
+            for product_count in args.products:
+                for sale_count in args.sales:
+                    size = f"{product_count}p_{sale_count}s"
+                    print(f"\n{size}")
+                    print(f"  {'senaryo':<20} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'istek/sn':>9} {'hata':>7}")
+                    results[size] = await run_size(product_count, sale_count, args)
+        finally:
+            # Shutdown hook'u client'ı kapatır; temizlik ondan önce
+            await server.client.drop_database(db.name)
+
+    report = {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "seed": args.seed
+        },
+        "results": results
+    }
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2, ensure_ascii=False))
+        print(f"\nSonuçlar yazıldı: {args.output}")
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())["results"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\np95 gerilemeleri (eşik %{args.threshold * 100:.0f}):")
+            for size, name, before, after, ratio in regressions:
+                print(f"  {size} {name}: {before:.1f} ms -> {after:.1f} ms ({ratio:.2f}x)")
+            sys.exit(1)
+        print("\nBaseline'a göre gerileme yok")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,78 @@
+"""
+Büyük liste yanıtlarının serileştirme benchmark script'i
+response_model=List[...] yolunu (Pydantic doğrulama + jsonable_encoder + json)
+orjson ile doğrudan serileştirme yolu ile istek başına CPU süresi olarak karşılaştırır.
+
+Kullanım: python benchmark_serialization.py [satır_sayısı ...]
+Veritabanı gerektirmez; satırlar bellekte üretilir.
+"""
+import sys
+import time
+import uuid
+import random
+from datetime import datetime, timezone, timedelta
+from typing import List
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+from pydantic import TypeAdapter
+
+from server import Product
+
+DEFAULT_ROW_COUNTS = [1000, 10000]
+REPEAT = 5
+
+def make_products(count: int) -> List[dict]:
+    """Mongo'dan okunmuş gibi ürün dokümanları üretir"""
+    now = datetime.now(timezone.utc)
+    return [
+        {
+            "id": str(uuid.uuid4()),
+            "name": f"Ürün {i}",
+            "barcode": f"869{i:010d}",
+            "quantity": random.randint(0, 200),
+            "min_quantity": 10,
+            "brand": random.choice(["Omron", "Braun", "Beurer", "Medline"]),
+            "category": random.choice(["Medikal Cihaz", "Medikal Sarf"]),
+            "purchase_price": round(random.uniform(10, 500), 2),
+            "sale_price": round(random.uniform(20, 800), 2),
+            "description": "Otomatik dijital ölçüm cihazı",
+            "image_url": f"/api/images/{uuid.uuid4().hex}",
+            "thumbnail_url": f"/api/images/{uuid.uuid4().hex}?variant=thumb",
+            "unit_type": "adet",
+            "package_quantity": None,
+            "created_at": now - timedelta(days=i % 365),
+            "updated_at": now
+        }
+        for i in range(count)
+    ]
+
+product_list_adapter = TypeAdapter(List[Product])
+
+def validated_response(rows: List[dict]) -> bytes:
+    """FastAPI'nin response_model yolunun eşdeğeri"""
+    validated = product_list_adapter.validate_python(rows)
+    return JSONResponse(jsonable_encoder(validated)).body
+
+def trusted_response(rows: List[dict]) -> bytes:
+    return ORJSONResponse(rows).body
+
+def cpu_ms(func, rows: List[dict]) -> float:
+    """REPEAT çalıştırmanın en iyisi (ms, process CPU süresi)"""
+    best = float("inf")
+    for _ in range(REPEAT):
+        started = time.process_time()
+        func(rows)
+        best = min(best, time.process_time() - started)
+    return best * 1000
+
+def main():
+    row_counts = [int(arg) for arg in sys.argv[1:]] or DEFAULT_ROW_COUNTS
+    print(f"{'satır':>8} {'pydantic (ms)':>14} {'orjson (ms)':>12} {'hızlanma':>10}")
+    for row_count in row_counts:
+        rows = make_products(row_count)
+        validated_ms = cpu_ms(validated_response, rows)
+        trusted_ms = cpu_ms(trusted_response, rows)
+        print(f"{row_count:>8} {validated_ms:>14.1f} {trusted_ms:>12.1f} {validated_ms / trusted_ms:>9.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+En kârlı ürünler raporunun benchmark script'i
+Eski satır başına find_one (N+1) yaklaşımı ile satırlardaki maliyet üzerinden
+çalışan tek aggregation pipeline'ı farklı satış sayılarında karşılaştırır.
+
+Kullanım: python benchmark_top_profit.py [satış_sayısı ...]
+Veriler DB_NAME + "_benchmark" veritabanına yazılır ve her ölçümde sıfırlanır.
+"""
+import os
+import sys
+import time
+import uuid
+import random
+import asyncio
+from datetime import datetime, timezone, timedelta
+from motor.motor_asyncio import AsyncIOMotorClient
+from dotenv import load_dotenv
+from pathlib import Path
+
+from server import build_product_sales_pipeline
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+# MongoDB connection
+mongo_url = os.environ['MONGO_URL']
+client = AsyncIOMotorClient(mongo_url)
+db = client[os.environ['DB_NAME'] + "_benchmark"]
+
+PRODUCT_COUNT = 500
+ITEMS_PER_SALE = 3
+DEFAULT_SALE_COUNTS = [100, 1000, 5000]
+
+async def seed(sale_count: int):
+    """Benchmark veritabanını verilen satış sayısıyla doldurur"""
+    await db.products.drop()
+    await db.sales.drop()
+    await db.products.create_index("id", unique=True)
+    await db.sales.create_index("created_at")
+    
+    products = [
+        {
+            "id": str(uuid.uuid4()),
+            "name": f"Ürün {i}",
+            "barcode": f"BENCH{i:06d}",
+            "purchase_price": round(random.uniform(10, 500), 2),
+        }
+        for i in range(PRODUCT_COUNT)
+    ]
+    await db.products.insert_many(products)
+    
+    now = datetime.now(timezone.utc)
+    sales = []
+    for _ in range(sale_count):
+        items = []
+        for product in random.sample(products, ITEMS_PER_SALE):
+            quantity = random.randint(1, 5)
+            price = round(product["purchase_price"] * 1.3, 2)
+            items.append({
+                "product_id": product["id"],
+                "name": product["name"],
+                "quantity": quantity,
+                "price": price,
+                "total": price * quantity,
+                "purchase_price": product["purchase_price"]
+            })
+        sales.append({
+            "id": str(uuid.uuid4()),
+            "items": items,
+            "created_at": now - timedelta(minutes=random.randint(0, 60 * 24 * 30))
+        })
+    await db.sales.insert_many(sales)
+
+async def legacy_top_profit(start: datetime, end: datetime, limit: int):
+    """Eski uygulama: her satış satırı için ayrı find_one"""
+    sales = await db.sales.find({"created_at": {"$gte": start, "$lte": end}}, {"_id": 0}).to_list(10000)
+    product_profits = {}
+    for sale in sales:
+        for item in sale["items"]:
+            product = await db.products.find_one({"id": item["product_id"]}, {"_id": 0})
+            if product:
+                profit = (item["price"] - product["purchase_price"]) * item["quantity"]
+                entry = product_profits.setdefault(item["product_id"], {"total_profit": 0, "total_quantity": 0})
+                entry["total_profit"] += profit
+                entry["total_quantity"] += item["quantity"]
+    return sorted(product_profits.items(), key=lambda x: x[1]["total_profit"], reverse=True)[:limit]
+
+async def pipeline_top_profit(start: datetime, end: datetime, limit: int):
+    pipeline = build_product_sales_pipeline({"created_at": {"$gte": start, "$lte": end}}) + [
+        {"$sort": {"profit": -1}},
+        {"$limit": limit}
+    ]
+    return await db.sales.aggregate(pipeline).to_list(limit)
+
+async def timed(func, *args) -> float:
+    started = time.perf_counter()
+    await func(*args)
+    return (time.perf_counter() - started) * 1000
+
+async def main():
+    sale_counts = [int(arg) for arg in sys.argv[1:]] or DEFAULT_SALE_COUNTS
+    now = datetime.now(timezone.utc)
+    start = now - timedelta(days=31)
+    end = now
+    
+    print(f"{'satış':>10} {'N+1 (ms)':>12} {'pipeline (ms)':>14} {'hızlanma':>10}")
+    try:
+        for sale_count in sale_counts:
+            await seed(sale_count)
+            legacy_ms = await timed(legacy_top_profit, start, end, 10)
+            pipeline_ms = await timed(pipeline_top_profit, start, end, 10)
+            print(f"{sale_count:>10} {legacy_ms:>12.1f} {pipeline_ms:>14.1f} {legacy_ms / pipeline_ms:>9.1f}x")
+    finally:
+        await client.drop_database(db.name)
+        client.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,36 @@
+"""Müşteri aramasında kullanılan, yazma anında saklanan alanlar.
+
+Bağımlılıksız tutulur; hem API (server.py) hem de test verisi scripti
+(add_test_data.py) aynı alanları üretsin diye buradan import eder.
+"""
+import re
+from typing import List, Optional
+
+TURKISH_UPPER_TO_LOWER = str.maketrans({"I": "ı", "İ": "i"})
+# Aramada aksansız yazımlar da eşleşsin (Şahin ~ sahin, Işık ~ isik)
+TURKISH_ASCII_FOLD = str.maketrans({"ı": "i", "ş": "s", "ğ": "g", "ü": "u", "ö": "o", "ç": "c", "â": "a", "î": "i", "û": "u"})
+
+def fold_turkish(text: str) -> str:
+    """Türkçe kurallarıyla küçük harfe çevirip aksanları kaldırır"""
+    return text.translate(TURKISH_UPPER_TO_LOWER).lower().translate(TURKISH_ASCII_FOLD)
+
+def name_tokens(name: str) -> List[str]:
+    return re.findall(r"\w+", fold_turkish(name or ""))
+
+def normalize_phone(phone: str) -> str:
+    """Telefonu yalnızca rakamlara indirger; ülke kodu ve baştaki 0 atılır (05321234567 -> 5321234567)"""
+    digits = re.sub(r"\D", "", phone or "")
+    if digits.startswith("00"):
+        digits = digits[2:]  # 0090 ... = +90 ...
+    if digits.startswith("90") and len(digits) > 10:
+        digits = digits[2:]
+    return digits.lstrip("0")
+
+def customer_search_fields(name: Optional[str] = None, phone: Optional[str] = None) -> dict:
+    """Yazma anında saklanan, index'li arama alanları"""
+    fields = {}
+    if name is not None:
+        fields["name_tokens"] = name_tokens(name)
+    if phone is not None:
+        fields["phone_digits"] = normalize_phone(phone)
+    return fields
@@ -1,14 +1,29 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, UploadFile, File, Query
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, UploadFile, File, Query, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.responses import StreamingResponse, Response, ORJSONResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
+from pymongo import ASCENDING, DESCENDING, UpdateOne, monitoring
+from pymongo.errors import DuplicateKeyError, BulkWriteError, CollectionInvalid
+from bson import json_util
+import gridfs
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional
+from pydantic import BaseModel, Field, ConfigDict, ValidationError
+from typing import List, Optional, Union, Literal
 import uuid
+import re
+import json
+import csv
+import codecs
+import hashlib
+import hmac
+import time
+import threading
+import contextvars
+from collections import OrderedDict
 from datetime import datetime, timezone, timedelta
 from passlib.context import CryptContext
 import jwt
@@ -16,16 +31,155 @@ from emergentintegrations.llm.chat import LlmChat, UserMessage
 import aiohttp
 import asyncio
 import base64
-from io import BytesIO
-from PIL import Image
+import tempfile
+import shutil
+from itertools import islice
+from io import BytesIO, StringIO
+from PIL import Image, ImageOps, UnidentifiedImageError
+import openpyxl
+
+from customer_search import customer_search_fields, fold_turkish, name_tokens, normalize_phone
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Metrics: istek süreleri ve Mongo komutları, /api/metrics'te Prometheus metin formatında
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+MONGO_OPS_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 500, 1000, 5000)
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.total += 1
+        self.sum += value
+
+class RequestMongoOps:
+    """Bir isteğin tetiklediği Mongo komut sayısı (Motor executor thread'lerinden artırılır)"""
+
+    def __init__(self, scope: dict = None):
+        self.count = 0
+        self.scope = scope
+
+    @property
+    def route(self) -> Optional[str]:
+        route = (self.scope or {}).get("route")
+        return getattr(route, "path", None)
+
+# Motor komutları executor'da context kopyasıyla çalıştırdığı için listener isteğin sayacını görür
+request_mongo_ops = contextvars.ContextVar("request_mongo_ops", default=None)
+
+def prometheus_escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.request_latency = {}     # (method, route) -> Histogram
+        self.request_mongo_ops = {}   # (method, route) -> Histogram
+        self.responses = {}           # (method, route, status) -> count
+        self.mongo_commands = {}      # (command, collection) -> count
+        self.mongo_failures = {}      # command -> count
+        self.mongo_duration = {}      # command -> toplam saniye
+
+    def observe_request(self, method: str, route: str, status_code: int, seconds: float, mongo_ops: int):
+        key = (method, route)
+        with self.lock:
+            self.request_latency.setdefault(key, Histogram(LATENCY_BUCKETS)).observe(seconds)
+            self.request_mongo_ops.setdefault(key, Histogram(MONGO_OPS_BUCKETS)).observe(mongo_ops)
+            self.responses[(method, route, status_code)] = self.responses.get((method, route, status_code), 0) + 1
+
+    def observe_mongo_command(self, command: str, collection: str):
+        with self.lock:
+            self.mongo_commands[(command, collection)] = self.mongo_commands.get((command, collection), 0) + 1
+
+    def observe_mongo_result(self, command: str, seconds: float, failed: bool):
+        with self.lock:
+            self.mongo_duration[command] = self.mongo_duration.get(command, 0.0) + seconds
+            if failed:
+                self.mongo_failures[command] = self.mongo_failures.get(command, 0) + 1
+
+    def render(self) -> str:
+        """Prometheus text exposition formatı (0.0.4)"""
+        def labels(**values) -> str:
+            return "{" + ",".join(f'{k}="{prometheus_escape(v)}"' for k, v in values.items()) + "}"
+        
+        def histogram(name: str, help_text: str, series: dict) -> List[str]:
+            out = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+            for (method, route), h in sorted(series.items()):
+                cumulative = 0
+                for bound, count in zip(h.buckets, h.counts):
+                    cumulative += count
+                    out.append(f"{name}_bucket{labels(method=method, route=route, le=bound)} {cumulative}")
+                out.append(f"{name}_bucket{labels(method=method, route=route, le='+Inf')} {h.total}")
+                out.append(f"{name}_sum{labels(method=method, route=route)} {h.sum}")
+                out.append(f"{name}_count{labels(method=method, route=route)} {h.total}")
+            return out
+        
+        with self.lock:
+            lines = ["# HELP http_requests_in_flight İşlenmekte olan istek sayısı",
+                     "# TYPE http_requests_in_flight gauge",
+                     f"http_requests_in_flight {self.in_flight}"]
+            lines += histogram("http_request_duration_seconds", "Route bazında istek süresi", self.request_latency)
+            lines += histogram("http_request_mongo_commands", "İstek başına Mongo komut sayısı", self.request_mongo_ops)
+            lines += ["# HELP http_responses_total Route ve durum kodu bazında yanıt sayısı",
+                      "# TYPE http_responses_total counter"]
+            lines += [f"http_responses_total{labels(method=m, route=r, status=c)} {n}"
+                      for (m, r, c), n in sorted(self.responses.items())]
+            lines += ["# HELP mongo_commands_total Komut ve koleksiyon bazında Mongo komutları",
+                      "# TYPE mongo_commands_total counter"]
+            lines += [f"mongo_commands_total{labels(command=c, collection=coll)} {n}"
+                      for (c, coll), n in sorted(self.mongo_commands.items())]
+            lines += ["# HELP mongo_command_failures_total Başarısız Mongo komutları",
+                      "# TYPE mongo_command_failures_total counter"]
+            lines += [f"mongo_command_failures_total{labels(command=c)} {n}" for c, n in sorted(self.mongo_failures.items())]
+            lines += ["# HELP mongo_command_duration_seconds_total Mongo komutlarında geçen toplam süre",
+                      "# TYPE mongo_command_duration_seconds_total counter"]
+            lines += [f"mongo_command_duration_seconds_total{labels(command=c)} {v}" for c, v in sorted(self.mongo_duration.items())]
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Her Mongo komutunu sayar ve o anki isteğin sayacını artırır"""
+
+    # Kimlik doğrulama/bağlantı komutları sayılmaz
+    IGNORED_COMMANDS = {"hello", "ismaster", "isMaster", "ping", "saslStart", "saslContinue", "endSessions"}
+
+    def started(self, event):
+        if event.command_name in self.IGNORED_COMMANDS:
+            return
+        collection = event.command.get(event.command_name)
+        metrics.observe_mongo_command(event.command_name, collection if isinstance(collection, str) else "")
+        ops = request_mongo_ops.get()
+        if ops is not None:
+            ops.count += 1
+        slow_query_recorder.on_started(event, ops)
+
+    def succeeded(self, event):
+        if event.command_name not in self.IGNORED_COMMANDS:
+            metrics.observe_mongo_result(event.command_name, event.duration_micros / 1e6, failed=False)
+            slow_query_recorder.on_finished(event, failed=False)
+
+    def failed(self, event):
+        if event.command_name not in self.IGNORED_COMMANDS:
+            metrics.observe_mongo_result(event.command_name, event.duration_micros / 1e6, failed=True)
+            slow_query_recorder.on_finished(event, failed=True)
+
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, tz_aware=True, event_listeners=[MongoCommandListener()])
 db = client[os.environ['DB_NAME']]
+image_bucket = AsyncIOMotorGridFSBucket(db, bucket_name="product_images")
 
 # Security
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -34,6 +188,38 @@ JWT_SECRET = os.environ.get('JWT_SECRET')
 JWT_ALGORITHM = os.environ.get('JWT_ALGORITHM', 'HS256')
 JWT_EXPIRATION = int(os.environ.get('JWT_EXPIRATION_HOURS', 168))
 
+# Büyük listeleri Pydantic doğrulaması olmadan orjson ile döndür (isteğe bağlı)
+FAST_LIST_RESPONSES = os.environ.get('FAST_LIST_RESPONSES', 'false').lower() == 'true'
+
+# In-process caches
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 1000))
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL_SECONDS', 60))
+BARCODE_CACHE_SIZE = int(os.environ.get('BARCODE_CACHE_SIZE', 5000))
+BARCODE_CACHE_TTL = float(os.environ.get('BARCODE_CACHE_TTL_SECONDS', 30))
+PRODUCT_TOMBSTONE_TTL_DAYS = int(os.environ.get('PRODUCT_TOMBSTONE_TTL_DAYS', 30))
+SYNC_WATERMARK_LAG_SECONDS = float(os.environ.get('SYNC_WATERMARK_LAG_SECONDS', 5))
+# limit verilmeyen eski liste yolu için üst sınır; aşılırsa X-Next-Cursor ile devam edilir
+PRODUCT_LIST_MAX = int(os.environ.get('PRODUCT_LIST_MAX', 2000))
+
+# Dış servisler (adresler yerel stub sunucuyla test için değiştirilebilir)
+EXCHANGE_RATE_API_URL = os.environ.get('EXCHANGE_RATE_API_URL', 'https://api.exchangerate-api.com/v4/latest/TRY')
+METAL_PRICE_API_URL = os.environ.get('METAL_PRICE_API_URL', 'https://api.metalpriceapi.com/v1/latest?base=USD&currencies=XAU,XAG')
+SERPAPI_URL = os.environ.get('SERPAPI_URL', 'https://serpapi.com/search.json')
+HTTP_TIMEOUT = float(os.environ.get('HTTP_TIMEOUT_SECONDS', 5))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT_SECONDS', 2))
+HTTP_LIMIT_PER_HOST = int(os.environ.get('HTTP_LIMIT_PER_HOST', 10))
+HTTP_RETRIES = int(os.environ.get('HTTP_RETRIES', 2))
+HTTP_RETRY_BACKOFF = float(os.environ.get('HTTP_RETRY_BACKOFF_SECONDS', 0.2))
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get('CIRCUIT_FAILURE_THRESHOLD', 5))
+CIRCUIT_RESET_SECONDS = float(os.environ.get('CIRCUIT_RESET_SECONDS', 30))
+CURRENCY_CACHE_TTL = float(os.environ.get('CURRENCY_CACHE_TTL_SECONDS', 3600))
+PRICE_COMPARISON_TTL_HOURS = float(os.environ.get('PRICE_COMPARISON_TTL_HOURS', 24))
+
+# Yavaş sorgu kaydı (SLOW_QUERY_MS <= 0 kapatır)
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 100))
+SLOW_QUERY_EXPLAIN = os.environ.get('SLOW_QUERY_EXPLAIN', 'false').lower() == 'true'
+SLOW_QUERY_LOG_SIZE_MB = int(os.environ.get('SLOW_QUERY_LOG_SIZE_MB', 16))
+
 # Create the main app without a prefix
 app = FastAPI()
 
@@ -83,6 +269,7 @@ class Product(BaseModel):
     sale_price: float
     description: Optional[str] = None
     image_url: Optional[str] = None
+    thumbnail_url: Optional[str] = None
     unit_type: str = "adet"  # adet veya kutu
     package_quantity: Optional[int] = None  # Kutu içeriği adedi (sadece kutu için)
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
@@ -102,6 +289,18 @@ class ProductCreate(BaseModel):
     unit_type: str = "adet"
     package_quantity: Optional[int] = None
 
+class ProductPage(BaseModel):
+    items: List[Product]
+    next_cursor: Optional[str] = None
+    total: Optional[int] = None
+    watermark: Optional[datetime] = None  # Yüklenen satırlar bu noktadan itibaren /products/sync ile güncellenebilir
+
+class ProductSync(BaseModel):
+    items: List[Product]
+    deleted: List[str] = []
+    watermark: datetime
+    full: bool = False  # True ise istemci yerel kopyasını tamamen items ile değiştirmeli
+
 class ProductUpdate(BaseModel):
     name: Optional[str] = None
     barcode: Optional[str] = None
@@ -119,7 +318,7 @@ class ProductUpdate(BaseModel):
 class Sale(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    items: List[dict]  # [{product_id, name, quantity, price, total}]
+    items: List[dict]  # [{product_id, name, quantity, price, total, purchase_price, unit_type}]
     total_amount: float
     discount: float = 0
     final_amount: float
@@ -170,7 +369,171 @@ class CalendarEventCreate(BaseModel):
     date: datetime
     alarm: bool = False
 
+class BulkProductFields(BaseModel):
+    brand: Optional[str] = None
+    category: Optional[str] = None
+    min_quantity: Optional[int] = Field(None, ge=0)
+    unit_type: Optional[Literal["adet", "kutu"]] = None
+    package_quantity: Optional[int] = Field(None, ge=1)  # Sadece unit_type="kutu" ile birlikte
+    purchase_price: Optional[float] = Field(None, ge=0)
+    sale_price: Optional[float] = Field(None, ge=0)
+
+class PriceChange(BaseModel):
+    field: Literal["sale_price", "purchase_price"] = "sale_price"
+    percent: float = Field(..., gt=-100)  # 10 = %10 zam, -5 = %5 indirim
+    rounding: Literal["none", "cent", "whole", "x.90"] = "cent"
+
+class BulkProductUpdate(BaseModel):
+    # Filtre: verilen koşulların hepsine uyan ürünler
+    brand: Optional[str] = None
+    category: Optional[str] = None
+    barcodes: Optional[List[str]] = None
+    all_products: bool = False  # Filtresiz tüm katalog için açıkça istenmeli
+    # İşlem
+    set: Optional[BulkProductFields] = None
+    price_change: Optional[PriceChange] = None
+    preview: bool = False
+
+class DescriptionBatchRequest(BaseModel):
+    brand: Optional[str] = None
+    category: Optional[str] = None
+    only_empty: bool = True  # Sadece açıklaması boş ürünler
+    concurrency: int = Field(4, ge=1, le=10)
+
+class PriceRefreshRequest(BaseModel):
+    brand: Optional[str] = None
+    category: Optional[str] = None
+    only_stale: bool = True  # Süresi dolmamış sonuçları atla
+    concurrency: int = Field(4, ge=1, le=10)
+
+# In-process cache
+class TTLCache:
+    """Boyutu sınırlı, süreli (TTL) LRU önbellek; isabet/ıska sayaçlarını tutar.
+
+    Önbellek süreç içidir: birden fazla worker çalışıyorsa diğer worker'lardaki
+    kopyalar en geç TTL süresi sonunda yenilenir. Her geçersiz kılma generation'ı
+    artırır; okumadan önce alınan generation ile set edilen değer, arada bir
+    geçersiz kılma olduysa önbelleğe yazılmaz. on_evict(key, value) bir kayıt
+    hangi sebeple olursa olsun önbellekten çıktığında çağrılır.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, on_evict=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def _evicted(self, key, entry):
+        if self.on_evict is not None:
+            self.on_evict(key, entry[1])
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self._evicted(key, entry)
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, generation: Optional[int] = None) -> bool:
+        """Değeri yazar; generation eskiyse ya da önbellek kapalıysa yazmaz ve False döndürür"""
+        if self.maxsize <= 0 or (generation is not None and generation != self.generation):
+            return False
+        previous = self._data.pop(key, None)
+        if previous is not None:
+            self._evicted(key, previous)
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        while len(self._data) > self.maxsize:
+            self._evicted(*self._data.popitem(last=False))
+        return True
+
+    def invalidate(self, key):
+        self.invalidate_many([key])
+
+    def invalidate_many(self, keys):
+        self.generation += 1
+        for key in keys:
+            entry = self._data.pop(key, None)
+            if entry is not None:
+                self._evicted(key, entry)
+
+    def clear(self):
+        self.invalidate_many(list(self._data))
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+# Kimliği doğrulanmış kullanıcılar (user id -> User)
+user_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+
+# POS barkod okutmaları (barcode -> Product); ürün id'si ile geçersiz kılmak için id -> barcode.
+# id -> barcode eşlemesi yalnızca önbellekteki kayıtlar için tutulur.
+barcode_cache_keys = {}
+
+def forget_barcode_key(barcode, product):
+    if barcode_cache_keys.get(product.id) == barcode:
+        del barcode_cache_keys[product.id]
+
+barcode_cache = TTLCache(BARCODE_CACHE_SIZE, BARCODE_CACHE_TTL, on_evict=forget_barcode_key)
+
+def cache_product_by_barcode(product, generation: Optional[int] = None):
+    if barcode_cache.set(product.barcode, product, generation):
+        barcode_cache_keys[product.id] = product.barcode
+
+def invalidate_cached_products(product_ids=(), barcodes=()):
+    """Ürünleri id veya barkod ile barkod önbelleğinden düşürür.
+
+    Ürün önbellekte olmasa da generation artar; böylece o sırada sürmekte olan
+    bir barkod okuması eski stoğu önbelleğe yazamaz.
+    """
+    keys = list(barcodes)
+    for product_id in product_ids:
+        cached_barcode = barcode_cache_keys.get(product_id)
+        if cached_barcode is not None:
+            keys.append(cached_barcode)
+    barcode_cache.invalidate_many(keys)
+
 # Helper functions
+def model_projection(model) -> dict:
+    """Sadece modeldeki alanları döndüren Mongo projeksiyonu"""
+    return {"_id": 0, **{field: 1 for field in model.model_fields}}
+
+def trusted_response(content, model):
+    """Kendi koleksiyonlarımızdan, model projeksiyonuyla okunmuş veriyi döndürür.
+
+    content doküman listesi ya da dokümanları "items" altında tutan bir sözlüktür.
+    FAST_LIST_RESPONSES açıkken response_model doğrulaması atlanır ve veri
+    doğrudan orjson ile serileştirilir; eski dokümanlarda eksik alanlar yine de
+    modelin varsayılanlarıyla doldurulur. Kapalıyken normal FastAPI yolu kullanılır.
+    """
+    if not FAST_LIST_RESPONSES:
+        return content
+    docs = content["items"] if isinstance(content, dict) else content
+    defaults = [(name, field) for name, field in model.model_fields.items() if not field.is_required()]
+    for doc in docs:
+        for name, field in defaults:
+            if name not in doc:
+                doc[name] = field.get_default(call_default_factory=True)
+    return ORJSONResponse(content)
+
 def hash_password(password: str) -> str:
     return pwd_context.hash(password)
 
@@ -183,6 +546,26 @@ def create_access_token(data: dict) -> str:
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, JWT_SECRET, algorithm=JWT_ALGORITHM)
 
+async def run_bounded(items, concurrency: int, handle, should_stop=None):
+    """items'ı en fazla concurrency eşzamanlı handle(item) çağrısıyla işler.
+
+    should_stop() True dönerse yeni öğe alınmaz; süren çağrılar tamamlanır.
+    """
+    remaining = iter(items)
+    
+    async def worker():
+        for item in remaining:
+            if should_stop is not None and should_stop():
+                return
+            await handle(item)
+    
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+
+def parse_datetime_param(value: str) -> datetime:
+    """Sorgu parametresindeki ISO tarihi çözer; saat dilimi yoksa UTC kabul eder"""
+    parsed = datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     try:
         token = credentials.credentials
@@ -190,10 +573,16 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         user_id = payload.get("sub")
         if user_id is None:
             raise HTTPException(status_code=401, detail="Invalid token")
-        user = await db.users.find_one({"id": user_id}, {"_id": 0})
+        cached_user = user_cache.get(user_id)
+        if cached_user is not None:
+            return cached_user
+        generation = user_cache.generation
+        user = await db.users.find_one({"id": user_id}, {"_id": 0, "password": 0})
         if user is None:
             raise HTTPException(status_code=401, detail="User not found")
-        return User(**user)
+        user_obj = User(**user)
+        user_cache.set(user_id, user_obj, generation)
+        return user_obj
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
     except jwt.InvalidTokenError:
@@ -213,9 +602,9 @@ async def register(user_data: UserCreate):
     user = User(**user_dict)
     doc = user.model_dump()
     doc["password"] = hashed_password
-    doc["created_at"] = doc["created_at"].isoformat()
     
     await db.users.insert_one(doc)
+    user_cache.invalidate(user.id)
     return user
 
 @api_router.post("/auth/login", response_model=Token)
@@ -225,8 +614,6 @@ async def login(credentials: UserLogin):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
     user.pop("password")
-    if isinstance(user["created_at"], str):
-        user["created_at"] = datetime.fromisoformat(user["created_at"])
     
     user_obj = User(**user)
     token = create_access_token({"sub": user_obj.id})
@@ -235,9 +622,6 @@ async def login(credentials: UserLogin):
 @api_router.get("/users", response_model=List[User])
 async def get_users(current_user: User = Depends(get_current_user)):
     users = await db.users.find({}, {"_id": 0, "password": 0}).to_list(1000)
-    for u in users:
-        if isinstance(u["created_at"], str):
-            u["created_at"] = datetime.fromisoformat(u["created_at"])
     return users
 
 @api_router.put("/users/{user_id}", response_model=User)
@@ -276,11 +660,10 @@ async def update_user(user_id: str, update_data: UserUpdate, current_user: User
     # Update the user
     if update_dict:
         await db.users.update_one({"id": user_id}, {"$set": update_dict})
+        user_cache.invalidate(user_id)
     
     # Return updated user (without password)
     updated_user = await db.users.find_one({"id": user_id}, {"_id": 0, "password": 0})
-    if updated_user and "created_at" in updated_user and isinstance(updated_user["created_at"], str):
-        updated_user["created_at"] = datetime.fromisoformat(updated_user["created_at"])
     
     return User(**updated_user)
 
@@ -295,13 +678,129 @@ async def delete_user(user_id: str, current_user: User = Depends(get_current_use
         raise HTTPException(status_code=403, detail="Only administrators can delete users")
     
     result = await db.users.delete_one({"id": user_id})
+    user_cache.invalidate(user_id)
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
     return {"message": "User deleted successfully"}
 
 
 
+# Product images
+IMAGE_URL_PREFIX = "/api/images/"
+IMAGE_VARIANTS = {"full": 1280, "thumb": 256}  # varyant -> en uzun kenar (px)
+IMAGE_CACHE_SECONDS = 365 * 24 * 3600
+IMAGE_MAX_BYTES = int(os.environ.get('IMAGE_MAX_BYTES', 10 * 1024 * 1024))
+IMAGE_MAX_PIXELS = int(os.environ.get('IMAGE_MAX_PIXELS', 40_000_000))
+
+def render_image_variants(raw: bytes) -> dict:
+    """Görseli PIL ile açıp her varyant için yeniden boyutlandırılmış JPEG üretir"""
+    image = Image.open(BytesIO(raw))
+    # Boyut başlıktan okunur; küçük bir dosya açılınca devasa bir bitmap'e dönüşmesin
+    if image.width * image.height > IMAGE_MAX_PIXELS:
+        raise Image.DecompressionBombError(f"{image.width}x{image.height} piksel sınırı aşıyor")
+    image = ImageOps.exif_transpose(image)
+    image = image.convert("RGB")
+    variants = {}
+    for variant, max_side in IMAGE_VARIANTS.items():
+        resized = image.copy()
+        resized.thumbnail((max_side, max_side))
+        buffer = BytesIO()
+        resized.save(buffer, format="JPEG", quality=85, optimize=True)
+        variants[variant] = buffer.getvalue()
+    return variants
+
+def image_urls(image_id: str) -> dict:
+    return {
+        "image_url": f"{IMAGE_URL_PREFIX}{image_id}",
+        "thumbnail_url": f"{IMAGE_URL_PREFIX}{image_id}?variant=thumb"
+    }
+
+async def store_product_image(image_base64: str) -> str:
+    """Base64 görseli GridFS'e varyantlarıyla kaydeder ve içerik hash'ini döndürür.
+
+    Aynı görsel tekrar yüklenirse mevcut varyantlar kullanılır; yarım kalmış
+    bir yüklemenin eksik varyantları yeniden üretilir.
+    """
+    if "," in image_base64 and image_base64.startswith("data:"):
+        image_base64 = image_base64.split(",", 1)[1]
+    # Çözmeden önce: base64 her 4 karakterde 3 bayt taşır
+    if len(image_base64) * 3 // 4 > IMAGE_MAX_BYTES + 3:
+        raise HTTPException(status_code=413, detail="Görsel çok büyük")
+    try:
+        raw = base64.b64decode(image_base64)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Geçersiz görsel")
+    if len(raw) > IMAGE_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="Görsel çok büyük")
+    
+    image_id = hashlib.sha256(raw).hexdigest()
+    stored = await db["product_images.files"].distinct("metadata.variant", {"metadata.image_id": image_id})
+    missing = [variant for variant in IMAGE_VARIANTS if variant not in stored]
+    if not missing:
+        return image_id
+    
+    try:
+        # PIL işlemleri CPU yoğun; event loop'u bloklamasın
+        variants = await asyncio.to_thread(render_image_variants, raw)
+    except Image.DecompressionBombError:
+        raise HTTPException(status_code=413, detail="Görsel çözünürlüğü çok büyük")
+    except (UnidentifiedImageError, OSError, ValueError):
+        raise HTTPException(status_code=400, detail="Geçersiz görsel")
+    
+    for variant in missing:
+        await image_bucket.upload_from_stream(
+            f"{image_id}_{variant}",
+            variants[variant],
+            metadata={"image_id": image_id, "variant": variant, "content_type": "image/jpeg"}
+        )
+    return image_id
+
+async def resolve_product_image(value: Optional[str]) -> dict:
+    """Formdan gelen görsel değerini ürün dokümanına yazılacak alanlara çevirir"""
+    if not value:
+        return {"image_url": None, "thumbnail_url": None}
+    # Düzenleme formu mevcut görselin adresini geri gönderir
+    if value.startswith(IMAGE_URL_PREFIX):
+        return image_urls(value[len(IMAGE_URL_PREFIX):].split("?", 1)[0])
+    if value.startswith(("http://", "https://")):
+        return {"image_url": value, "thumbnail_url": value}
+    return image_urls(await store_product_image(value))
+
+@api_router.get("/images/{image_id}")
+async def get_image(
+    image_id: str,
+    request: Request,
+    variant: str = Query("full", pattern="^(full|thumb)$")
+):
+    """Ürün görselini döndürür; içerik adresli olduğu için uzun süre önbelleklenebilir"""
+    etag = f'"{image_id}-{variant}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={IMAGE_CACHE_SECONDS}, immutable"
+    }
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    
+    try:
+        grid_out = await image_bucket.open_download_stream_by_name(f"{image_id}_{variant}")
+    except gridfs.errors.NoFile:
+        raise HTTPException(status_code=404, detail="Görsel bulunamadı")
+    data = await grid_out.read()
+    content_type = (grid_out.metadata or {}).get("content_type", "image/jpeg")
+    return Response(content=data, media_type=content_type, headers=headers)
+
 # Product endpoints
+# Düşük stok bayrağı: iki alanı karşılaştıran $expr index kullanamadığı için
+# quantity/min_quantity değiştiren her yazma is_low_stock'u da günceller.
+LOW_STOCK_STAGE = {"$set": {"is_low_stock": {"$lte": ["$quantity", "$min_quantity"]}}}
+
+def is_low_stock(quantity: int, min_quantity: int) -> bool:
+    return quantity <= min_quantity
+
+def stock_update_pipeline(fields: dict) -> list:
+    """fields'i yazıp is_low_stock'u yeni değerlerden hesaplayan update pipeline'ı"""
+    return [{"$set": fields}, LOW_STOCK_STAGE]
+
 @api_router.post("/products", response_model=Product)
 async def create_product(product_data: ProductCreate, current_user: User = Depends(get_current_user)):
     existing = await db.products.find_one({"barcode": product_data.barcode})
@@ -313,54 +812,302 @@ async def create_product(product_data: ProductCreate, current_user: User = Depen
     
     product = Product(**product_dict)
     if image_base64:
-        product.image_url = image_base64
+        for field, value in (await resolve_product_image(image_base64)).items():
+            setattr(product, field, value)
     
     doc = product.model_dump()
-    doc["created_at"] = doc["created_at"].isoformat()
-    doc["updated_at"] = doc["updated_at"].isoformat()
+    doc["is_low_stock"] = is_low_stock(product.quantity, product.min_quantity)
     
     await db.products.insert_one(doc)
+    invalidate_cached_products(barcodes=[product.barcode])
     return product
 
+# AI ürün açıklamaları: aynı ad/marka/kategori için üretilen metin ai_descriptions'ta
+# içerik hash'iyle saklanır; aynı anda gelen aynı istekler tek model çağrısında birleşir.
+DESCRIPTION_MODEL = ("gemini", "gemini-2.0-flash")
+DESCRIPTION_SYSTEM_MESSAGE = "Sen bir medikal ürünler uzmanısın. Kısa, çekici ve detaylı Türkçe ürün açıklamaları yazıyorsun. Maksimum 2-3 cümle."
+description_inflight = {}
+description_batch_task = None
+
+async def llm_complete(prompt: str) -> str:
+    """Tek seferlik model çağrısı (LlmChat oturumu geçmiş tuttuğu için paylaşılmaz)"""
+    chat = LlmChat(
+        api_key=os.environ.get('EMERGENT_LLM_KEY'),
+        session_id=str(uuid.uuid4()),
+        system_message=DESCRIPTION_SYSTEM_MESSAGE
+    ).with_model(*DESCRIPTION_MODEL)
+    return await chat.send_message(UserMessage(text=prompt))
+
+def description_product_info(name: str, brand: str, category: str) -> str:
+    return f"Ürün Adı: {name}\nMarka: {brand}\nKategori: {category}"
+
+def description_cache_key(name: str, brand: str, category: str) -> str:
+    """Model, sistem mesajı ve büyük/küçük harf ve boşluk farkı gözetmeyen ürün bilgisinin hash'i"""
+    normalized = [" ".join((value or "").split()).casefold() for value in (name, brand, category)]
+    material = "\n".join([*DESCRIPTION_MODEL, DESCRIPTION_SYSTEM_MESSAGE, *normalized])
+    return hashlib.sha256(material.encode()).hexdigest()
+
+async def generate_and_store_description(key: str, product_info: str) -> str:
+    description = await llm_complete(f"{product_info}\n\nBu medikal ürün için profesyonel ve çekici bir açıklama yaz (max 2-3 cümle):")
+    if not description or not description.strip():
+        raise ValueError("Model boş açıklama döndürdü")
+    await db.ai_descriptions.replace_one(
+        {"_id": key},
+        {"description": description, "model": DESCRIPTION_MODEL[1], "created_at": datetime.now(timezone.utc)},
+        upsert=True
+    )
+    return description
+
+async def get_product_description(name: str, brand: str, category: str, regenerate: bool = False):
+    """(açıklama, önbellekten_mi) döndürür; model hatasında exception fırlatır"""
+    product_info = description_product_info(name, brand, category)
+    key = description_cache_key(name, brand, category)
+    if not regenerate:
+        cached = await db.ai_descriptions.find_one({"_id": key}, {"description": 1})
+        if cached:
+            return cached["description"], True
+    
+    task = description_inflight.get(key)
+    if task is None:
+        task = asyncio.create_task(generate_and_store_description(key, product_info))
+        description_inflight[key] = task
+        task.add_done_callback(lambda _: description_inflight.pop(key, None))
+    return await asyncio.shield(task), False
+
 @api_router.post("/products/generate-description")
-async def generate_description(data: dict, current_user: User = Depends(get_current_user)):
+async def generate_description(
+    data: dict,
+    regenerate: bool = Query(False, description="Önbelleği atlayıp yeni açıklama üret"),
+    current_user: User = Depends(get_current_user)
+):
     try:
-        product_info = f"Ürün Adı: {data.get('name', '')}\nMarka: {data.get('brand', '')}\nKategori: {data.get('category', '')}"
-        
-        chat = LlmChat(
-            api_key=os.environ.get('EMERGENT_LLM_KEY'),
-            session_id=str(uuid.uuid4()),
-            system_message="Sen bir medikal ürünler uzmanısın. Kısa, çekici ve detaylı Türkçe ürün açıklamaları yazıyorsun. Maksimum 2-3 cümle."
-        ).with_model("gemini", "gemini-2.0-flash")
-        
-        message = UserMessage(text=f"{product_info}\n\nBu medikal ürün için profesyonel ve çekici bir açıklama yaz (max 2-3 cümle):")
-        response = await chat.send_message(message)
-        
-        return {"description": response}
+        description, cached = await get_product_description(
+            data.get('name', ''), data.get('brand', ''), data.get('category', ''), regenerate
+        )
+        return {"description": description, "cached": cached}
     except Exception as e:
         logging.error(f"AI description error: {e}")
-        return {"description": f"{data.get('name', '')} - {data.get('category', '')} kategorisinde kaliteli bir üründür."}
-
-@api_router.get("/products", response_model=List[Product])
-async def get_products(current_user: User = Depends(get_current_user)):
-    products = await db.products.find({}, {"_id": 0}).to_list(1000)
-    for p in products:
-        if isinstance(p["created_at"], str):
-            p["created_at"] = datetime.fromisoformat(p["created_at"])
-        if "updated_at" in p and isinstance(p["updated_at"], str):
-            p["updated_at"] = datetime.fromisoformat(p["updated_at"])
-    return products
+        return {"description": f"{data.get('name', '')} - {data.get('category', '')} kategorisinde kaliteli bir üründür.", "cached": False}
+
+async def run_description_batch(run_id: str, request: DescriptionBatchRequest):
+    """Seçilen ürünlere en fazla request.concurrency eşzamanlı model çağrısıyla açıklama yazar"""
+    started = time.perf_counter()
+    query = {}
+    if request.brand:
+        query["brand"] = request.brand
+    if request.category:
+        query["category"] = request.category
+    if request.only_empty:
+        query["description"] = {"$in": [None, ""]}
+    products = await db.products.find(query, {"_id": 0, "id": 1, "name": 1, "brand": 1, "category": 1}).to_list(None)
+    
+    stats = {"total": len(products), "generated": 0, "cached": 0, "failed": 0}
+    await db.description_runs.update_one({"id": run_id}, {"$set": {"stats": stats}})
+    
+    async def describe(product):
+        try:
+            description, cached = await get_product_description(product["name"], product["brand"], product["category"])
+            await db.products.update_one(
+                {"id": product["id"]},
+                {"$set": {"description": description, "updated_at": datetime.now(timezone.utc)}}
+            )
+            invalidate_cached_products([product["id"]])
+            stats["cached" if cached else "generated"] += 1
+        except Exception as e:
+            logging.warning(f"AI description error for {product['id']}: {e}")
+            stats["failed"] += 1
+        await db.description_runs.update_one({"id": run_id}, {"$set": {"stats": stats}})
+    
+    try:
+        await run_bounded(products, request.concurrency, describe)
+        run_status = "completed"
+    except Exception as e:
+        logging.error(f"Description batch {run_id} failed: {e}")
+        run_status = "failed"
+    await db.description_runs.update_one({"id": run_id}, {"$set": {
+        "status": run_status,
+        "stats": stats,
+        "finished_at": datetime.now(timezone.utc),
+        "duration_seconds": round(time.perf_counter() - started, 1)
+    }})
+
+@api_router.post("/admin/descriptions/generate")
+async def start_description_batch(request: DescriptionBatchRequest, current_user: User = Depends(get_current_user)):
+    """Ürünlere (varsayılan: açıklaması boş olanlara) arka planda AI açıklaması yazar"""
+    global description_batch_task
+    if current_user.role != "yönetici":
+        raise HTTPException(status_code=403, detail="Sadece yöneticiler toplu açıklama üretebilir")
+    if description_batch_task is not None and not description_batch_task.done():
+        raise HTTPException(status_code=409, detail="Devam eden bir açıklama üretimi var")
+    
+    run = {
+        "id": str(uuid.uuid4()),
+        "status": "running",
+        "filters": request.model_dump(),
+        "stats": None,
+        "started_at": datetime.now(timezone.utc),
+        "started_by": current_user.username
+    }
+    await db.description_runs.insert_one(run)
+    description_batch_task = asyncio.create_task(run_description_batch(run["id"], request))
+    run.pop("_id", None)
+    return run
+
+@api_router.get("/admin/descriptions/generate/{run_id}")
+async def get_description_batch(run_id: str, current_user: User = Depends(get_current_user)):
+    """Toplu açıklama üretiminin durumunu ve ilerlemesini döndürür"""
+    if current_user.role != "yönetici":
+        raise HTTPException(status_code=403, detail="Sadece yöneticiler açıklama üretimlerini görebilir")
+    
+    run = await db.description_runs.find_one({"id": run_id}, {"_id": 0})
+    if not run:
+        raise HTTPException(status_code=404, detail="Çalıştırma bulunamadı")
+    return run
+
+def encode_cursor(sort_value, last_id: str) -> str:
+    """Son kaydın sıralama değerini ve id'sini opak bir cursor'a çevirir"""
+    raw = json_util.dumps([sort_value, last_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor: str):
+    """Cursor istemciden geldiği için yalnızca encode_cursor'ın üretebileceği tipler kabul edilir.
+
+    Extended JSON başka tipler de (ör. $regex) üretebilir; bunlar keyset eşitliğinde
+    skaler değer yerine sorgu operatörü gibi davranırdı.
+    """
+    try:
+        sort_value, last_id = json_util.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except Exception:
+        # bson.errors.InvalidId, IndexError gibi Extended JSON hataları dahil
+        raise HTTPException(status_code=400, detail="Geçersiz cursor")
+    if not isinstance(last_id, str) or not (sort_value is None or isinstance(sort_value, (str, datetime))):
+        raise HTTPException(status_code=400, detail="Geçersiz cursor")
+    return sort_value, last_id
+
+def keyset_condition(sort: str, last_value, last_id: str) -> dict:
+    """(sort, id) sırasında son kayıttan sonrakiler.
+
+    Alanı eksik/null olan kayıtlar artan sıralamada en başta gelir; $gt null ile
+    eşleşmediği için null'dan sonrası ayrıca ifade edilir.
+    """
+    if last_value is None:
+        return {"$or": [
+            {sort: {"$ne": None}},
+            {sort: None, "id": {"$gt": last_id}}
+        ]}
+    return {"$or": [
+        {sort: {"$gt": last_value}},
+        {sort: last_value, "id": {"$gt": last_id}}
+    ]}
+
+def sync_watermark(now: datetime) -> datetime:
+    """Sorgudan önce alınır ve SYNC_WATERMARK_LAG_SECONDS kadar geri çekilir;
+    böylece sorgu sırasında yazılan kayıtlar bir sonraki senkronda tekrar gelir."""
+    return now - timedelta(seconds=SYNC_WATERMARK_LAG_SECONDS)
+
+@api_router.get("/products/sync", response_model=ProductSync)
+async def sync_products(
+    since: str = Query(..., description="Önceki yanıtın watermark değeri"),
+    current_user: User = Depends(get_current_user)
+):
+    """since'ten sonra değişen ürünleri ve silinenlerin id'lerini döndürür.
+
+    Tombstone'lar silinmiş olabilecek kadar eski bir since için tam liste döner.
+    """
+    try:
+        since_dt = parse_datetime_param(since)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Geçersiz since değeri")
+    now = datetime.now(timezone.utc)
+    watermark = sync_watermark(now)
+    projection = model_projection(Product)
+    if since_dt < now - timedelta(days=PRODUCT_TOMBSTONE_TTL_DAYS):
+        products = await db.products.find({}, projection).sort([("updated_at", 1), ("id", 1)]).to_list(None)
+        return trusted_response({"items": products, "deleted": [], "watermark": watermark, "full": True}, Product)
+    
+    products, tombstones = await asyncio.gather(
+        db.products.find({"updated_at": {"$gte": since_dt}}, projection).sort([("updated_at", 1), ("id", 1)]).to_list(None),
+        db.product_tombstones.find({"deleted_at": {"$gte": since_dt}}, {"_id": 0, "id": 1}).to_list(None)
+    )
+    return trusted_response({
+        "items": products,
+        "deleted": [t["id"] for t in tombstones],
+        "watermark": watermark,
+        "full": False
+    }, Product)
+
+@api_router.get("/products", response_model=Union[List[Product], ProductPage])
+async def get_products(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=500, description="Sayfa boyutu; verilirse sayfalı yanıt döner"),
+    cursor: Optional[str] = Query(None, description="Önceki sayfanın next_cursor değeri"),
+    sort: str = Query("name", pattern="^(name|updated_at)$"),
+    brand: Optional[str] = Query(None, description="Marka filtresi"),
+    category: Optional[str] = Query(None, description="Kategori filtresi"),
+    low_stock: bool = Query(False, description="Sadece düşük stoklu ürünler"),
+    q: Optional[str] = Query(None, description="İsim veya barkod araması"),
+    barcode: Optional[str] = Query(None, description="Barkod öneki"),
+    include_total: bool = Query(False, description="Filtreye uyan toplam ürün sayısını da döndür"),
+    current_user: User = Depends(get_current_user)
+):
+    conditions = []
+    if brand:
+        conditions.append({"brand": brand})
+    if category:
+        conditions.append({"category": category})
+    if low_stock:
+        conditions.append({"is_low_stock": True})
+    if q:
+        pattern = re.escape(q)
+        conditions.append({"$or": [
+            {"name": {"$regex": pattern, "$options": "i"}},
+            {"barcode": {"$regex": f"^{pattern}"}}
+        ]})
+    if barcode:
+        conditions.append({"barcode": {"$regex": f"^{re.escape(barcode)}"}})
+    query = {"$and": conditions} if conditions else {}
+    
+    # Eski istemciler için sayfasız liste; PRODUCT_LIST_MAX'ta kesilir ve kesildiği
+    # X-Next-Cursor başlığıyla bildirilir (limit ile sayfalı istekte kullanılabilir)
+    if limit is None:
+        products = await db.products.find(query, model_projection(Product)).sort([(sort, 1), ("id", 1)]).to_list(PRODUCT_LIST_MAX + 1)
+        headers = {}
+        if len(products) > PRODUCT_LIST_MAX:
+            products = products[:PRODUCT_LIST_MAX]
+            headers["X-Next-Cursor"] = encode_cursor(products[-1].get(sort), products[-1]["id"])
+            logger.warning(f"GET /products limitsiz çağrıldı ve {PRODUCT_LIST_MAX} üründe kesildi")
+        result = trusted_response(products, Product)
+        # Response döndürülürse FastAPI enjekte edilen response'un başlıklarını eklemez
+        (result if isinstance(result, Response) else response).headers.update(headers)
+        return result
+    
+    watermark = sync_watermark(datetime.now(timezone.utc))
+    page_query = query
+    if cursor:
+        page_query = {"$and": conditions + [keyset_condition(sort, *decode_cursor(cursor))]}
+    
+    # Bir fazla kayıt çekerek sonraki sayfanın varlığını anlarız
+    products = await db.products.find(page_query, model_projection(Product)).sort([(sort, 1), ("id", 1)]).limit(limit + 1).to_list(limit + 1)
+    next_cursor = None
+    if len(products) > limit:
+        products = products[:limit]
+        next_cursor = encode_cursor(products[-1].get(sort), products[-1]["id"])
+    
+    total = await db.products.count_documents(query) if include_total else None
+    return trusted_response({"items": products, "next_cursor": next_cursor, "total": total, "watermark": watermark}, Product)
 
 @api_router.get("/products/barcode/{barcode}", response_model=Product)
 async def get_product_by_barcode(barcode: str, current_user: User = Depends(get_current_user)):
+    cached_product = barcode_cache.get(barcode)
+    if cached_product is not None:
+        return cached_product
+    generation = barcode_cache.generation
     product = await db.products.find_one({"barcode": barcode}, {"_id": 0})
     if not product:
         raise HTTPException(status_code=404, detail="Ürün bulunamadı")
-    if isinstance(product["created_at"], str):
-        product["created_at"] = datetime.fromisoformat(product["created_at"])
-    if "updated_at" in product and isinstance(product["updated_at"], str):
-        product["updated_at"] = datetime.fromisoformat(product["updated_at"])
-    return Product(**product)
+    product_obj = Product(**product)
+    cache_product_by_barcode(product_obj, generation)
+    return product_obj
 
 @api_router.put("/products/{product_id}", response_model=Product)
 async def update_product(product_id: str, product_data: ProductUpdate, current_user: User = Depends(get_current_user)):
@@ -369,44 +1116,508 @@ async def update_product(product_id: str, product_data: ProductUpdate, current_u
         raise HTTPException(status_code=400, detail="No data to update")
     
     if "image_base64" in update_dict:
-        update_dict["image_url"] = update_dict.pop("image_base64")
+        update_dict.update(await resolve_product_image(update_dict.pop("image_base64")))
     
-    update_dict["updated_at"] = datetime.now(timezone.utc).isoformat()
+    update_dict["updated_at"] = datetime.now(timezone.utc)
     
-    result = await db.products.update_one({"id": product_id}, {"$set": update_dict})
+    if "quantity" in update_dict or "min_quantity" in update_dict:
+        # Pipeline $set'inde "$" ile başlayan metinler alan yolu sayılmasın
+        update = stock_update_pipeline({k: {"$literal": v} for k, v in update_dict.items()})
+    else:
+        update = {"$set": update_dict}
+    result = await db.products.update_one({"id": product_id}, update)
+    invalidate_cached_products([product_id])
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Product not found")
     
     product = await db.products.find_one({"id": product_id}, {"_id": 0})
-    if isinstance(product["created_at"], str):
-        product["created_at"] = datetime.fromisoformat(product["created_at"])
-    if "updated_at" in product and isinstance(product["updated_at"], str):
-        product["updated_at"] = datetime.fromisoformat(product["updated_at"])
     return Product(**product)
 
 @api_router.delete("/products/{product_id}")
 async def delete_product(product_id: str, current_user: User = Depends(get_current_user)):
     result = await db.products.delete_one({"id": product_id})
+    invalidate_cached_products([product_id])
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Product not found")
+    # Delta sync istemcilerinin silmeyi görebilmesi için iz bırak
+    await db.product_tombstones.update_one(
+        {"id": product_id},
+        {"$set": {"deleted_at": datetime.now(timezone.utc)}},
+        upsert=True
+    )
+    await db.price_comparisons.delete_one({"product_id": product_id})
     return {"message": "Product deleted"}
 
 @api_router.get("/products/low-stock")
 async def get_low_stock_products(current_user: User = Depends(get_current_user)):
-    pipeline = [
-        {"$addFields": {"is_low_stock": {"$lte": ["$quantity", "$min_quantity"]}}},
-        {"$match": {"is_low_stock": True}},
-        {"$project": {"_id": 0}}
-    ]
-    products = await db.products.aggregate(pipeline).to_list(100)
-    for p in products:
-        if isinstance(p["created_at"], str):
-            p["created_at"] = datetime.fromisoformat(p["created_at"])
-        if "updated_at" in p and isinstance(p["updated_at"], str):
-            p["updated_at"] = datetime.fromisoformat(p["updated_at"])
+    products = await db.products.find({"is_low_stock": True}, {"_id": 0}).to_list(100)
     return products
 
+# Toplu fiyat/özellik güncelleme: tek update_many, aggregation pipeline ile
+BULK_UPDATE_PREVIEW_LIMIT = 20
+
+def rounded_price(expression, rounding: str):
+    if rounding == "cent":
+        return {"$round": [expression, 2]}
+    if rounding == "whole":
+        return {"$round": [expression, 0]}
+    if rounding == "x.90":
+        # Kuruşa yuvarlanmış fiyata eşit ya da büyük en küçük ,90 ile biten değer.
+        # Hesap tam sayı kuruşla yapılır; 18.900000000000002 gibi double artıkları 19.90'a taşmaz.
+        cents = {"$round": [{"$multiply": [{"$round": [expression, 2]}, 100]}, 0]}
+        whole = {"$ceil": {"$divide": [{"$add": [cents, 10]}, 100]}}
+        return {"$divide": [{"$subtract": [{"$multiply": [whole, 100]}, 10]}, 100]}
+    return expression
+
+def bulk_update_stage(request: BulkProductUpdate, now: datetime) -> dict:
+    fields = request.set.model_dump(exclude_none=True) if request.set else {}
+    if fields.get("unit_type") == "adet":
+        fields["package_quantity"] = None  # Adet ile satılan üründe paket içeriği anlamsız
+    # Pipeline $set'inde "$" ile başlayan metinler alan yolu sayılmasın
+    stage = {field: {"$literal": value} for field, value in fields.items()}
+    if request.price_change:
+        change = request.price_change
+        multiplier = 1 + change.percent / 100
+        stage[change.field] = rounded_price({"$multiply": [f"${change.field}", multiplier]}, change.rounding)
+    stage["updated_at"] = now
+    return {"$set": stage}
+
+@api_router.post("/products/bulk-update")
+async def bulk_update_products(request: BulkProductUpdate, current_user: User = Depends(get_current_user)):
+    """Filtreye uyan ürünlere alan atama ve/veya yüzde fiyat değişikliğini tek sorguda uygular.
+
+    preview=true ise hiçbir şey yazılmaz; eşleşen sayı ve ilk ürünlerin yeni değerleri döner.
+    """
+    if current_user.role != "yönetici":
+        raise HTTPException(status_code=403, detail="Sadece yöneticiler toplu güncelleme yapabilir")
+    
+    query = {}
+    if request.brand:
+        query["brand"] = request.brand
+    if request.category:
+        query["category"] = request.category
+    if request.barcodes:
+        query["barcode"] = {"$in": request.barcodes}
+    if not query and not request.all_products:
+        raise HTTPException(status_code=400, detail="En az bir filtre (brand, category, barcodes) ya da all_products gerekli")
+    
+    set_fields = request.set.model_dump(exclude_none=True) if request.set else {}
+    if not set_fields and not request.price_change:
+        raise HTTPException(status_code=400, detail="No data to update")
+    # Filtre adet ve kutu ürünleri karışık eşleyebilir; paket içeriği yalnızca kutuya geçişle birlikte yazılır
+    if "package_quantity" in set_fields and set_fields.get("unit_type") != "kutu":
+        raise HTTPException(status_code=400, detail="package_quantity sadece unit_type=kutu ile birlikte verilebilir")
+    if request.price_change and request.price_change.field in set_fields:
+        raise HTTPException(status_code=400, detail=f"{request.price_change.field} hem set hem price_change içinde verilemez")
+    
+    stage = bulk_update_stage(request, datetime.now(timezone.utc))
+    
+    if request.preview:
+        shown = ["id", "name", "barcode", *[f for f in stage["$set"] if f != "updated_at"]]
+        matched, sample = await asyncio.gather(
+            db.products.count_documents(query),
+            db.products.aggregate([
+                {"$match": query},
+                {"$sort": {"name": 1, "id": 1}},
+                {"$limit": BULK_UPDATE_PREVIEW_LIMIT},
+                {"$project": {"_id": 0, **{f: 1 for f in shown}, "before": {f: f"${f}" for f in shown[3:]}}},
+                stage,
+                {"$project": {"_id": 0, "updated_at": 0}}
+            ]).to_list(BULK_UPDATE_PREVIEW_LIMIT)
+        )
+        return {"matched": matched, "preview": sample}
+    
+    result = await db.products.update_many(query, [stage, LOW_STOCK_STAGE])
+    # Hangi barkodların değiştiği bilinmediği için barkod önbelleği tamamen boşaltılır
+    barcode_cache.clear()
+    return {"matched": result.matched_count, "modified": result.modified_count}
+
+# Toplu ürün içe aktarma (CSV/XLSX): satırlar parça parça okunur, ProductCreate ile
+# doğrulanır ve barkoda göre bulk_write upsert edilir. İlerleme import_runs'ta tutulur.
+IMPORT_CHUNK_SIZE = int(os.environ.get('IMPORT_CHUNK_SIZE', 1000))
+IMPORT_MAX_ERRORS = 1000
+IMPORT_COLUMN_ALIASES = {
+    "ürün adı": "name", "ürün": "name", "ad": "name",
+    "barkod": "barcode",
+    "miktar": "quantity", "stok": "quantity", "adet": "quantity",
+    "min stok": "min_quantity", "minimum stok": "min_quantity",
+    "marka": "brand",
+    "kategori": "category",
+    "alış fiyatı": "purchase_price",
+    "satış fiyatı": "sale_price",
+    "açıklama": "description",
+    "birim": "unit_type", "birim tipi": "unit_type",
+    "paket adedi": "package_quantity", "kutu içeriği": "package_quantity",
+}
+IMPORT_FIELDS = set(ProductCreate.model_fields) - {"image_base64"}
+IMPORT_DECIMAL_FIELDS = {"purchase_price", "sale_price"}
+import_tasks = set()
+
+def import_column(header) -> Optional[str]:
+    key = " ".join(str(header or "").split()).casefold()
+    key = IMPORT_COLUMN_ALIASES.get(key, key)
+    return key if key in IMPORT_FIELDS else None
+
+def csv_encoding(path: str) -> str:
+    """UTF-8 değilse Türkçe Excel'in "CSV" olarak kaydettiği cp1254 varsayılır.
+
+    Hata ortada çıkıp önceki parçalar yazılmış olmasın diye dosya baştan taranır.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    with open(path, "rb") as f:
+        try:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                decoder.decode(block)
+            decoder.decode(b"", final=True)
+        except UnicodeDecodeError:
+            return "cp1254"
+    return "utf-8-sig"
+
+def read_import_rows(path: str, file_format: str):
+    """Dosyadaki satırları (satır no, {alan: değer}) olarak tek tek üretir; bilinmeyen sütunlar atlanır"""
+    if file_format == "xlsx":
+        workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+        try:
+            rows = workbook.worksheets[0].iter_rows(values_only=True)
+            columns = [import_column(h) for h in next(rows, [])]
+            for line_no, values in enumerate(rows, start=2):
+                yield line_no, {c: v for c, v in zip(columns, values) if c}
+        finally:
+            workbook.close()
+        return
+    
+    with open(path, newline="", encoding=csv_encoding(path)) as f:
+        sample = f.read(4096)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+        except csv.Error:
+            dialect = csv.excel
+        rows = csv.reader(f, dialect)
+        columns = [import_column(h) for h in next(rows, [])]
+        for line_no, values in enumerate(rows, start=2):
+            yield line_no, {c: v for c, v in zip(columns, values) if c}
+
+def parse_import_row(row: dict) -> ProductCreate:
+    """Boş hücreleri atar, ondalık virgülü noktaya çevirir ve satırı doğrular"""
+    cleaned = {}
+    for field, value in row.items():
+        if isinstance(value, str):
+            value = value.strip()
+            if field in IMPORT_DECIMAL_FIELDS and value.rfind(",") > value.rfind("."):
+                value = value.replace(".", "").replace(",", ".")  # 1.234,50 -> 1234.50
+        if value is None or value == "":
+            continue
+        if field == "barcode" and isinstance(value, (int, float)):
+            value = str(int(value))  # Excel barkodu sayı olarak saklar
+        cleaned[field] = value
+    return ProductCreate(**cleaned)
+
+def product_import_operation(product: ProductCreate, now: datetime) -> UpdateOne:
+    """Barkoda göre upsert; dosyada olmayan alanlar mevcut üründe korunur"""
+    fields = product.model_dump(exclude_unset=True, exclude={"image_base64"})
+    fields["updated_at"] = now
+    fields["is_low_stock"] = is_low_stock(product.quantity, product.min_quantity)
+    defaults = Product(**product.model_dump(exclude={"image_base64"})).model_dump()
+    defaults["created_at"] = now
+    on_insert = {k: v for k, v in defaults.items() if k not in fields}
+    return UpdateOne({"barcode": product.barcode}, {"$set": fields, "$setOnInsert": on_insert}, upsert=True)
+
+async def run_product_import(run_id: str, path: str, file_format: str, dry_run: bool):
+    started = time.perf_counter()
+    stats = {"rows": 0, "valid": 0, "invalid": 0, "inserted": 0, "updated": 0}
+    errors = []
+    seen_barcodes = set()
+    
+    def add_error(line_no, barcode, messages):
+        stats["invalid"] += 1
+        if len(errors) < IMPORT_MAX_ERRORS:
+            errors.append({"row": line_no, "barcode": barcode, "errors": messages})
+    
+    rows = read_import_rows(path, file_format)
+    run_status = "completed"
+    try:
+        while True:
+            chunk = await asyncio.to_thread(lambda: list(islice(rows, IMPORT_CHUNK_SIZE)))
+            if not chunk:
+                break
+            
+            products = []
+            product_lines = []
+            for line_no, row in chunk:
+                stats["rows"] += 1
+                try:
+                    product = parse_import_row(row)
+                except ValidationError as e:
+                    add_error(line_no, row.get("barcode"), [
+                        f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" for err in e.errors()
+                    ])
+                    continue
+                if product.barcode in seen_barcodes:
+                    add_error(line_no, product.barcode, ["Barkod dosyada birden fazla kez geçiyor"])
+                    continue
+                seen_barcodes.add(product.barcode)
+                products.append(product)
+                product_lines.append(line_no)
+            stats["valid"] += len(products)
+            
+            if products and dry_run:
+                existing = await db.products.count_documents({"barcode": {"$in": [p.barcode for p in products]}})
+                stats["updated"] += existing
+                stats["inserted"] += len(products) - existing
+            elif products:
+                now = datetime.now(timezone.utc)
+                try:
+                    result = await db.products.bulk_write(
+                        [product_import_operation(p, now) for p in products], ordered=False
+                    )
+                    details = result.bulk_api_result
+                except BulkWriteError as e:
+                    details = e.details
+                    for write_error in details.get("writeErrors", []):
+                        index = write_error["index"]
+                        stats["valid"] -= 1
+                        add_error(product_lines[index], products[index].barcode, [write_error.get("errmsg", "Yazma hatası")])
+                stats["inserted"] += details.get("nUpserted", 0)
+                stats["updated"] += details.get("nMatched", 0)
+                invalidate_cached_products(barcodes=[p.barcode for p in products])
+            
+            await db.import_runs.update_one({"id": run_id}, {"$set": {"stats": stats, "errors": errors}})
+    except Exception as e:
+        logging.error(f"Product import {run_id} failed: {e}")
+        run_status = "failed"
+        errors.append({"row": None, "barcode": None, "errors": [f"Dosya okunamadı: {e}"]})
+    finally:
+        rows.close()
+        os.unlink(path)
+    
+    await db.import_runs.update_one({"id": run_id}, {"$set": {
+        "status": run_status,
+        "stats": stats,
+        "errors": errors,
+        "finished_at": datetime.now(timezone.utc),
+        "duration_seconds": round(time.perf_counter() - started, 1)
+    }})
+
+@api_router.post("/products/import")
+async def import_products(
+    file: UploadFile = File(...),
+    dry_run: bool = Query(False, description="Sadece doğrula ve eklenecek/güncellenecek sayısını raporla"),
+    current_user: User = Depends(get_current_user)
+):
+    """CSV veya XLSX ürün listesini arka planda içe aktarır; ilerleme GET /products/import/{id} ile izlenir"""
+    if current_user.role != "yönetici":
+        raise HTTPException(status_code=403, detail="Sadece yöneticiler toplu ürün aktarabilir")
+    
+    file_format = Path(file.filename or "").suffix.lower().lstrip(".")
+    if file_format not in ("csv", "xlsx"):
+        raise HTTPException(status_code=400, detail="Sadece .csv ve .xlsx dosyaları desteklenir")
+    
+    # Yükleme istek bitince kapanır; arka plan işi için geçici dosyaya kopyalanır
+    with tempfile.NamedTemporaryFile(suffix=f".{file_format}", delete=False) as tmp:
+        await asyncio.to_thread(shutil.copyfileobj, file.file, tmp)
+    
+    run = {
+        "id": str(uuid.uuid4()),
+        "status": "running",
+        "filename": file.filename,
+        "dry_run": dry_run,
+        "stats": None,
+        "errors": [],
+        "started_at": datetime.now(timezone.utc),
+        "started_by": current_user.username
+    }
+    await db.import_runs.insert_one(run)
+    task = asyncio.create_task(run_product_import(run["id"], tmp.name, file_format, dry_run))
+    import_tasks.add(task)
+    task.add_done_callback(import_tasks.discard)
+    run.pop("_id", None)
+    return run
+
+@api_router.get("/products/import/{run_id}")
+async def get_product_import(run_id: str, current_user: User = Depends(get_current_user)):
+    """İçe aktarmanın durumunu, sayaçlarını ve satır hatalarını döndürür"""
+    if current_user.role != "yönetici":
+        raise HTTPException(status_code=403, detail="Sadece yöneticiler içe aktarmaları görebilir")
+    
+    run = await db.import_runs.find_one({"id": run_id}, {"_id": 0})
+    if not run:
+        raise HTTPException(status_code=404, detail="İçe aktarma bulunamadı")
+    return run
+
 # Sales endpoints
+async def snapshot_sale_item_costs(items: List[dict]) -> int:
+    """Satış satırlarına ürünün güncel alış fiyatını ve birim tipini yazar.
+
+    Ürünler tek bir $in sorgusuyla çekilir; bulunamayan ürünlerin satırlarına
+    dokunulmaz. Güncellenen satır sayısını döndürür.
+    """
+    product_ids = list({item.get("product_id") for item in items if item.get("product_id")})
+    if not product_ids:
+        return 0
+    
+    products = await db.products.find(
+        {"id": {"$in": product_ids}},
+        {"_id": 0, "id": 1, "purchase_price": 1, "unit_type": 1}
+    ).to_list(None)
+    products_by_id = {p["id"]: p for p in products}
+    
+    updated = 0
+    for item in items:
+        product = products_by_id.get(item.get("product_id"))
+        if product:
+            item["purchase_price"] = product["purchase_price"]
+            item["unit_type"] = product.get("unit_type", "adet")
+            updated += 1
+    return updated
+
+class StockShortageError(Exception):
+    """Satıştaki en az bir ürün için stok yetersiz"""
+    def __init__(self, shortages: List[dict]):
+        super().__init__("Yetersiz stok")
+        self.shortages = shortages
+
+# Replica set / sharded cluster değilse çok dokümanlı transaction kullanılamaz
+transactions_supported: Optional[bool] = None
+
+async def supports_transactions() -> bool:
+    global transactions_supported
+    if transactions_supported is None:
+        try:
+            hello = await client.admin.command("hello")
+            transactions_supported = "setName" in hello or hello.get("msg") == "isdbgrid"
+        except Exception as e:
+            logger.warning(f"Transaction desteği belirlenemedi: {e}")
+            transactions_supported = False
+    return transactions_supported
+
+async def find_stock_shortages(quantities: dict, items: List[dict]) -> List[dict]:
+    """İstenen miktarı karşılayamayan ürünleri döndürür"""
+    products = await db.products.find(
+        {"id": {"$in": list(quantities)}},
+        {"_id": 0, "id": 1, "quantity": 1}
+    ).to_list(None)
+    available = {p["id"]: p["quantity"] for p in products}
+    names = {item["product_id"]: item.get("name") for item in items}
+    return [
+        {
+            "product_id": product_id,
+            "name": names.get(product_id),
+            "requested": requested,
+            "available": available.get(product_id, 0)
+        }
+        for product_id, requested in quantities.items()
+        if available.get(product_id, 0) < requested
+    ]
+
+async def decrement_stock(quantities: dict, items: List[dict], session=None):
+    """Stokları yalnızca yeterli miktar varsa düşer; eksik varsa StockShortageError fırlatır.
+
+    Transaction içinde tek bir bulk_write yapılır ve hata transaction'ı geri alır.
+    Transaction yoksa koşullu güncellemeler eşzamanlı gönderilir; eksik çıkarsa ya da
+    bir güncelleme hata verirse onaylanan düşümler geri eklenir.
+    """
+    product_ids = list(quantities)
+    now = datetime.now(timezone.utc)
+    if session is not None:
+        operations = [
+            UpdateOne({"id": product_id, "quantity": {"$gte": quantities[product_id]}},
+                      stock_update_pipeline({"quantity": {"$subtract": ["$quantity", quantities[product_id]]}, "updated_at": now}))
+            for product_id in product_ids
+        ]
+        result = await db.products.bulk_write(operations, ordered=False, session=session)
+        if result.matched_count != len(operations):
+            # Session dışında okunur: transaction'ın kendi düşümleri yeterli satırları eksik göstermesin
+            raise StockShortageError(await find_stock_shortages(quantities, items))
+        return
+    
+    results = await asyncio.gather(*[
+        db.products.update_one(
+            {"id": product_id, "quantity": {"$gte": quantities[product_id]}},
+            stock_update_pipeline({"quantity": {"$subtract": ["$quantity", quantities[product_id]]}, "updated_at": now})
+        )
+        for product_id in product_ids
+    ], return_exceptions=True)
+    # Hata veren güncellemenin uygulanıp uygulanmadığı bilinmez; yalnızca onaylanan düşümler geri eklenir
+    applied = {
+        product_id: quantities[product_id]
+        for product_id, r in zip(product_ids, results)
+        if not isinstance(r, BaseException) and r.matched_count == 1
+    }
+    errors = [r for r in results if isinstance(r, BaseException)]
+    failed = {product_id for product_id, r in zip(product_ids, results) if not isinstance(r, BaseException) and r.matched_count == 0}
+    if errors or failed:
+        await restore_stock(applied)
+    if errors:
+        raise errors[0]
+    if failed:
+        shortages = await find_stock_shortages({pid: quantities[pid] for pid in failed}, items)
+        raise StockShortageError(shortages)
+
+async def restore_stock(quantities: dict):
+    """Transaction olmadan düşülmüş stokları geri ekler"""
+    if not quantities:
+        return
+    now = datetime.now(timezone.utc)
+    await db.products.bulk_write([
+        UpdateOne({"id": product_id}, stock_update_pipeline({"quantity": {"$add": ["$quantity", quantity]}, "updated_at": now}))
+        for product_id, quantity in quantities.items()
+    ], ordered=False)
+
+# Sales daily rollup: gün x ürün satırları ve ürünü olmayan (product_id=None) gün toplamı satırı.
+# Ürün satırlarında revenue satır toplamlarıdır; gün toplamı satırında satışların final_amount toplamıdır.
+def sale_day_key(created_at: datetime) -> str:
+    return created_at.astimezone(timezone.utc).date().isoformat()
+
+def sales_daily_operations(sale: Sale) -> List[UpdateOne]:
+    day = sale_day_key(sale.created_at)
+    operations = [
+        UpdateOne(
+            {"date": day, "product_id": None},
+            {"$inc": {"sale_count": 1, "revenue": sale.final_amount}},
+            upsert=True
+        )
+    ]
+    for item in sale.items:
+        quantity = item["quantity"]
+        revenue = item["total"]
+        increments = {"quantity": quantity, "revenue": revenue, "sale_count": 1}
+        # Maliyeti bilinmeyen satırlar kâra katılmaz; cost alanı yalnızca maliyetli satırlarda oluşur
+        if item.get("purchase_price") is not None:
+            cost = item["purchase_price"] * quantity
+            increments["cost"] = cost
+            increments["profit"] = revenue - cost
+        operations.append(UpdateOne(
+            {"date": day, "product_id": item["product_id"]},
+            {"$inc": increments, "$set": {"product_name": item.get("name")}},
+            upsert=True
+        ))
+    return operations
+
+async def update_sales_daily(sale: Sale):
+    """Kaydedilmiş satışı rollup'a ekler.
+
+    Transaction dışında çalışır: her satış aynı gün toplamı satırına yazdığından
+    transaction içinde eşzamanlı kasalar WriteConflict alıp satışı baştan tekrarlardı.
+    Hata satışı geri almaz; rollup rebuild ile düzelir.
+    """
+    try:
+        await db.sales_daily.bulk_write(sales_daily_operations(sale), ordered=False)
+    except Exception as e:
+        logger.error(f"sales_daily güncellenemedi, rebuild gerekli: {e}")
+
+def sale_item_total(item: dict) -> float:
+    """Satır toplamını doğrular; gönderilmemişse fiyat x miktardan hesaplar"""
+    total = item.get("total")
+    if total is None:
+        price = item.get("price")
+        if isinstance(price, bool) or not isinstance(price, (int, float)):
+            raise HTTPException(status_code=400, detail="Satış satırında fiyat veya toplam eksik")
+        return round(price * item["quantity"], 2)
+    if isinstance(total, bool) or not isinstance(total, (int, float)) or total < 0:
+        raise HTTPException(status_code=400, detail="Geçersiz satış satırı toplamı")
+    return total
+
 @api_router.post("/sales", response_model=Sale)
 async def create_sale(sale_data: SaleCreate, current_user: User = Depends(get_current_user)):
     sale_dict = sale_data.model_dump()
@@ -414,24 +1625,67 @@ async def create_sale(sale_data: SaleCreate, current_user: User = Depends(get_cu
     sale_dict["cashier_id"] = current_user.id
     
     sale = Sale(**sale_dict)
-    doc = sale.model_dump()
-    doc["created_at"] = doc["created_at"].isoformat()
     
-    # Update product quantities
+    # Aynı ürün sepette birden fazla satırda olabilir
+    quantities = {}
     for item in sale.items:
-        await db.products.update_one(
-            {"id": item["product_id"]},
-            {"$inc": {"quantity": -item["quantity"]}}
-        )
+        if not isinstance(item.get("quantity"), int) or item["quantity"] <= 0:
+            raise HTTPException(status_code=400, detail="Geçersiz satış miktarı")
+        quantities[item["product_id"]] = quantities.get(item["product_id"], 0) + item["quantity"]
+        # Raporlar, rollup ve rebuild satır cirosunu yalnızca saklanan total alanından okur
+        item["total"] = sale_item_total(item)
     
-    # Update customer total spent
-    if sale.customer_id:
-        await db.customers.update_one(
-            {"id": sale.customer_id},
-            {"$inc": {"total_spent": sale.final_amount}}
-        )
+    # Satış anındaki maliyeti satırlara sabitle; kâr raporları ürünlere join yapmaz
+    await snapshot_sale_item_costs(sale.items)
+    
+    doc = sale.model_dump()
+    
+    async def write_sale(session=None):
+        # Update product quantities
+        await decrement_stock(quantities, sale.items, session=session)
+        
+        customer_charged = False
+        try:
+            # Update customer total spent
+            if sale.customer_id:
+                await db.customers.update_one(
+                    {"id": sale.customer_id},
+                    {"$inc": {"total_spent": sale.final_amount}},
+                    session=session
+                )
+                customer_charged = True
+            
+            await db.sales.insert_one(doc, session=session)
+        except Exception:
+            # Transaction kendisi geri alır; yoksa düşülen stok ve müşteri toplamı telafi edilir
+            if session is None:
+                try:
+                    await restore_stock(quantities)
+                    if customer_charged:
+                        await db.customers.update_one(
+                            {"id": sale.customer_id},
+                            {"$inc": {"total_spent": -sale.final_amount}}
+                        )
+                except Exception as e:
+                    logger.error(f"Başarısız satışın stok/müşteri düşümü geri alınamadı: {e}")
+            raise
     
-    await db.sales.insert_one(doc)
+    try:
+        if await supports_transactions():
+            async with await client.start_session() as session:
+                await session.with_transaction(write_sale)
+        else:
+            await write_sale()
+    except StockShortageError as e:
+        raise HTTPException(
+            status_code=409,
+            detail={"message": "Yetersiz stok", "items": e.shortages}
+        )
+    finally:
+        # Başarısız satışta da stok transaction'sız düşülüp geri eklenmiş olabilir;
+        # arada okunan ürün önbelleğe eksik stokla yazılmasın
+        invalidate_cached_products(quantities)
+    await update_sales_daily(sale)
     return sale
 
 @api_router.get("/sales", response_model=List[Sale])
@@ -443,50 +1697,42 @@ async def get_sales(
     query = {}
     if start_date and end_date:
         query["created_at"] = {
-            "$gte": datetime.fromisoformat(start_date).isoformat(),
-            "$lte": datetime.fromisoformat(end_date).isoformat()
+            "$gte": parse_datetime_param(start_date),
+            "$lte": parse_datetime_param(end_date)
         }
     
-    sales = await db.sales.find(query, {"_id": 0}).sort("created_at", -1).to_list(1000)
-    for s in sales:
-        if isinstance(s["created_at"], str):
-            s["created_at"] = datetime.fromisoformat(s["created_at"])
-    return sales
+    sales = await db.sales.find(query, model_projection(Sale)).sort("created_at", -1).to_list(1000)
+    return trusted_response(sales, Sale)
 
 # Customer endpoints
+CUSTOMER_SEARCH_LIMIT = 100
+
 @api_router.post("/customers", response_model=Customer)
 async def create_customer(customer_data: CustomerCreate, current_user: User = Depends(get_current_user)):
     customer = Customer(**customer_data.model_dump())
     doc = customer.model_dump()
-    doc["created_at"] = doc["created_at"].isoformat()
+    doc.update(customer_search_fields(customer.name, customer.phone))
     
     await db.customers.insert_one(doc)
     return customer
 
 @api_router.get("/customers", response_model=List[Customer])
 async def get_customers(current_user: User = Depends(get_current_user)):
-    customers = await db.customers.find({"deleted": {"$ne": True}}, {"_id": 0}).to_list(1000)
-    for c in customers:
-        if isinstance(c["created_at"], str):
-            c["created_at"] = datetime.fromisoformat(c["created_at"])
-    return customers
+    customers = await db.customers.find({"deleted": {"$ne": True}}, model_projection(Customer)).to_list(1000)
+    return trusted_response(customers, Customer)
 
 @api_router.get("/customers/{customer_id}/purchases")
 async def get_customer_purchases(customer_id: str, current_user: User = Depends(get_current_user)):
     sales = await db.sales.find({"customer_id": customer_id}, {"_id": 0}).sort("created_at", -1).to_list(100)
-    for s in sales:
-        if isinstance(s["created_at"], str):
-            s["created_at"] = datetime.fromisoformat(s["created_at"])
     return sales
 
 @api_router.put("/customers/{customer_id}")
 async def update_customer(customer_id: str, customer_data: dict, current_user: User = Depends(get_current_user)):
+    customer_data.update(customer_search_fields(customer_data.get("name"), customer_data.get("phone")))
     result = await db.customers.update_one({"id": customer_id}, {"$set": customer_data})
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Customer not found")
-    customer = await db.customers.find_one({"id": customer_id}, {"_id": 0})
-    if isinstance(customer["created_at"], str):
-        customer["created_at"] = datetime.fromisoformat(customer["created_at"])
+    customer = await db.customers.find_one({"id": customer_id}, model_projection(Customer))
     return customer
 
 @api_router.delete("/customers/{customer_id}")
@@ -509,54 +1755,165 @@ async def search_customers(
     q: str = Query(..., description="Arama terimi (isim veya telefon)"),
     current_user: User = Depends(get_current_user)
 ):
-    """Müşterileri isim veya telefon numarasına göre arar"""
-    search_query = {
-        "$and": [
-            {"$or": [{"deleted": {"$exists": False}}, {"deleted": False}]},
-            {
-                "$or": [
-                    {"name": {"$regex": q, "$options": "i"}},
-                    {"phone": {"$regex": q, "$options": "i"}}
-                ]
-            }
-        ]
-    }
+    """Müşterileri isim veya telefon numarasına göre arar.
+
+    İsimdeki her kelime saklanan name_tokens üzerinde önek olarak, rakamlar
+    phone_digits üzerinde önek olarak aranır; ikisi de index kullanır.
+    """
+    tokens = name_tokens(q)
+    digits = normalize_phone(q) if re.search(r"\d", q) else ""
+    
+    clauses = []
+    if tokens:
+        clauses.append({"$and": [{"name_tokens": {"$regex": f"^{re.escape(t)}"}} for t in tokens]})
+    if len(digits) >= 3:
+        clauses.append({"phone_digits": {"$regex": f"^{digits}"}})
+    if not clauses:
+        return []
+    
+    # Önek adayları sırasız ve sınırlı geldiği için tam eşleşmeler ayrıca çekilir;
+    # aksi halde yaygın bir önekte en iyi sonuç aday listesinin dışında kalabilir
+    exact_clauses = []
+    if tokens:
+        exact_clauses.append({"name_tokens": {"$all": tokens}})
+    if len(digits) >= 3:
+        exact_clauses.append({"phone_digits": digits})
+    
+    projection = {**model_projection(Customer), "name_tokens": 1, "phone_digits": 1}
+    exact_matches, prefix_matches = await asyncio.gather(
+        db.customers.find({"deleted": {"$ne": True}, "$or": exact_clauses}, projection).to_list(CUSTOMER_SEARCH_LIMIT),
+        db.customers.find({"deleted": {"$ne": True}, "$or": clauses}, projection).to_list(CUSTOMER_SEARCH_LIMIT * 2)
+    )
+    customers = list({c["id"]: c for c in exact_matches + prefix_matches}.values())
+    
+    def rank(customer: dict):
+        stored_tokens = customer.get("name_tokens", [])
+        exact_words = sum(1 for t in tokens if t in stored_tokens)
+        starts_with_query = bool(tokens) and bool(stored_tokens) and stored_tokens[0].startswith(tokens[0])
+        exact_phone = bool(digits) and customer.get("phone_digits") == digits
+        return (-exact_phone, -exact_words, -starts_with_query, fold_turkish(customer.get("name", "")))
     
-    customers = await db.customers.find(search_query, {"_id": 0}).to_list(100)
-    return customers
+    customers.sort(key=rank)
+    for customer in customers:
+        customer.pop("name_tokens", None)
+        customer.pop("phone_digits", None)
+    return customers[:CUSTOMER_SEARCH_LIMIT]
 
 # Reports endpoints
-@api_router.get("/reports/top-selling")
-async def get_top_selling(
-    start_date: str,
-    end_date: str,
-    limit: int = 10,
-    current_user: User = Depends(get_current_user)
-):
-    pipeline = [
-        {
-            "$match": {
-                "created_at": {
-                    "$gte": datetime.fromisoformat(start_date).isoformat(),
-                    "$lte": datetime.fromisoformat(end_date).isoformat()
-                }
-            }
-        },
+# Maliyeti olan satış satırları için maliyet ve kâr ifadeleri
+ITEM_HAS_COST = {"$gt": ["$items.purchase_price", None]}
+ITEM_COST = {"$multiply": ["$items.purchase_price", "$items.quantity"]}
+
+def build_product_sales_pipeline(match: dict) -> List[dict]:
+    """Ham satışlardan ürün bazında miktar, ciro, maliyet ve kâr toplayan pipeline"""
+    return [
+        {"$match": match},
         {"$unwind": "$items"},
         {
             "$group": {
                 "_id": "$items.product_id",
                 "product_name": {"$first": "$items.name"},
-                "total_quantity": {"$sum": "$items.quantity"},
-                "total_revenue": {"$sum": "$items.total"}
+                "quantity": {"$sum": "$items.quantity"},
+                "revenue": {"$sum": "$items.total"},
+                "cost": {"$sum": {"$cond": [ITEM_HAS_COST, ITEM_COST, 0]}},
+                "profit": {"$sum": {"$cond": [ITEM_HAS_COST, {"$subtract": ["$items.total", ITEM_COST]}, 0]}},
+                "costed": {"$max": ITEM_HAS_COST}
             }
-        },
-        {"$sort": {"total_quantity": -1}},
-        {"$limit": limit}
+        }
     ]
+
+async def sales_rollup_ready() -> bool:
+    """sales_daily en az bir kez rebuild edildiyse geçmiş günler için güvenilirdir"""
+    return await db.rollup_state.find_one({"_id": "sales_daily"}) is not None
+
+def split_report_range(start_date: str, end_date: str):
+    """Rapor aralığını rollup'tan okunacak tam günlere ve ham satışlardan okunacak kenarlara böler.
+
+    (tam_günler, ham_sorgu) döndürür; tam gün yoksa tam_günler None olur.
+    Bugün henüz tamamlanmadığı için her zaman ham satışlardan okunur.
+    """
+    start = parse_datetime_param(start_date).astimezone(timezone.utc)
+    end = parse_datetime_param(end_date).astimezone(timezone.utc)
+    whole_range = {"created_at": {"$gte": start, "$lte": end}}
+    
+    start_is_midnight = start == start.replace(hour=0, minute=0, second=0, microsecond=0)
+    end_is_day_end = end == end.replace(hour=23, minute=59, second=59, microsecond=999999)
+    first_day = start.date() if start_is_midnight else start.date() + timedelta(days=1)
+    last_day = end.date() if end_is_day_end else end.date() - timedelta(days=1)
+    last_day = min(last_day, datetime.now(timezone.utc).date() - timedelta(days=1))
+    if first_day > last_day:
+        return None, whole_range
+    
+    first_midnight = datetime(first_day.year, first_day.month, first_day.day, tzinfo=timezone.utc)
+    after_last_midnight = first_midnight + timedelta(days=(last_day - first_day).days + 1)
+    raw_match = {"$or": [
+        {"created_at": {"$gte": start, "$lt": first_midnight}},
+        {"created_at": {"$gte": after_last_midnight, "$lte": end}}
+    ]}
+    return (first_day.isoformat(), last_day.isoformat()), raw_match
+
+async def product_sales_summary(start_date: str, end_date: str) -> dict:
+    """Aralıktaki ürün bazlı satış özetini rollup ve ham satışları birleştirerek hesaplar"""
+    if await sales_rollup_ready():
+        full_days, raw_match = split_report_range(start_date, end_date)
+    else:
+        full_days = None
+        raw_match = {"created_at": {
+            "$gte": parse_datetime_param(start_date),
+            "$lte": parse_datetime_param(end_date)
+        }}
     
-    results = await db.sales.aggregate(pipeline).to_list(limit)
-    return results
+    queries = [db.sales.aggregate(build_product_sales_pipeline(raw_match)).to_list(None)]
+    if full_days:
+        queries.append(db.sales_daily.aggregate([
+            {"$match": {"date": {"$gte": full_days[0], "$lte": full_days[1]}, "product_id": {"$ne": None}}},
+            {
+                "$group": {
+                    "_id": "$product_id",
+                    "product_name": {"$last": "$product_name"},
+                    "quantity": {"$sum": "$quantity"},
+                    "revenue": {"$sum": "$revenue"},
+                    "cost": {"$sum": "$cost"},
+                    "profit": {"$sum": "$profit"},
+                    "costed": {"$max": {"$gt": ["$cost", None]}}
+                }
+            }
+        ]).to_list(None))
+    
+    summary = {}
+    for rows in await asyncio.gather(*queries):
+        for row in rows:
+            entry = summary.setdefault(row["_id"], {
+                "product_name": row["product_name"],
+                "total_quantity": 0,
+                "total_revenue": 0,
+                "total_profit": 0,
+                "costed": False
+            })
+            entry["total_quantity"] += row["quantity"]
+            entry["total_revenue"] += row["revenue"]
+            entry["total_profit"] += row["profit"]
+            entry["costed"] = entry["costed"] or row["costed"]
+    return summary
+
+@api_router.get("/reports/top-selling")
+async def get_top_selling(
+    start_date: str,
+    end_date: str,
+    limit: int = 10,
+    current_user: User = Depends(get_current_user)
+):
+    summary = await product_sales_summary(start_date, end_date)
+    top = sorted(summary.items(), key=lambda x: x[1]["total_quantity"], reverse=True)[:limit]
+    return [
+        {
+            "_id": product_id,
+            "product_name": entry["product_name"],
+            "total_quantity": entry["total_quantity"],
+            "total_revenue": entry["total_revenue"]
+        }
+        for product_id, entry in top
+    ]
 
 @api_router.get("/reports/top-profit")
 async def get_top_profit(
@@ -565,31 +1922,19 @@ async def get_top_profit(
     limit: int = 10,
     current_user: User = Depends(get_current_user)
 ):
-    sales = await db.sales.find({
-        "created_at": {
-            "$gte": datetime.fromisoformat(start_date).isoformat(),
-            "$lte": datetime.fromisoformat(end_date).isoformat()
+    summary = await product_sales_summary(start_date, end_date)
+    # Hiç maliyeti olmayan satırlar (ürünü silinmiş eski satışlar) rapora girmez
+    costed = [(k, v) for k, v in summary.items() if v["costed"]]
+    top = sorted(costed, key=lambda x: x[1]["total_profit"], reverse=True)[:limit]
+    return [
+        {
+            "product_id": product_id,
+            "product_name": entry["product_name"],
+            "total_profit": entry["total_profit"],
+            "total_quantity": entry["total_quantity"]
         }
-    }, {"_id": 0}).to_list(10000)
-    
-    product_profits = {}
-    for sale in sales:
-        for item in sale["items"]:
-            product = await db.products.find_one({"id": item["product_id"]}, {"_id": 0})
-            if product:
-                profit = (item["price"] - product["purchase_price"]) * item["quantity"]
-                if item["product_id"] in product_profits:
-                    product_profits[item["product_id"]]["total_profit"] += profit
-                    product_profits[item["product_id"]]["total_quantity"] += item["quantity"]
-                else:
-                    product_profits[item["product_id"]] = {
-                        "product_name": item["name"],
-                        "total_profit": profit,
-                        "total_quantity": item["quantity"]
-                    }
-    
-    sorted_profits = sorted(product_profits.items(), key=lambda x: x[1]["total_profit"], reverse=True)[:limit]
-    return [{"product_id": k, **v} for k, v in sorted_profits]
+        for product_id, entry in top
+    ]
 
 @api_router.get("/products/filters")
 async def get_product_filters(current_user: User = Depends(get_current_user)):
@@ -602,10 +1947,83 @@ async def get_product_filters(current_user: User = Depends(get_current_user)):
         "categories": sorted([c for c in categories if c])  # Boş olmayan kategoriler
     }
 
+STOCK_REPORT_FIELDS = [
+    "name", "barcode", "brand", "category", "quantity", "unit_type",
+    "min_quantity", "purchase_price", "sale_price", "stock_value", "status"
+]
+STOCK_REPORT_PROJECTION = {
+    "_id": 0, "name": 1, "barcode": 1, "brand": 1, "category": 1, "quantity": 1,
+    "unit_type": 1, "min_quantity": 1, "purchase_price": 1, "sale_price": 1
+}
+STOCK_EXPORT_BATCH_SIZE = 500
+
+def build_stock_report_row(product: dict) -> dict:
+    """Stok raporundaki tek bir ürün satırını hazırlar"""
+    return {
+        "name": product["name"],
+        "barcode": product["barcode"],
+        "brand": product["brand"],
+        "category": product["category"],
+        "quantity": product["quantity"],
+        "unit_type": product.get("unit_type", "adet"),
+        "min_quantity": product["min_quantity"],
+        "purchase_price": product["purchase_price"],
+        "sale_price": product["sale_price"],
+        "stock_value": product["quantity"] * product["purchase_price"],
+        "status": "Düşük Stok" if product["quantity"] <= product["min_quantity"] else "Normal"
+    }
+
+async def stream_stock_report(query: dict, export_format: str, filters_applied: dict):
+    """Ürünleri cursor üzerinden partiler halinde okuyup CSV/NDJSON satırları üretir.
+
+    Özet, satırlar yazılırken artımlı olarak hesaplanır ve en sona eklenir.
+    """
+    total_products = 0
+    total_items = 0
+    total_value = 0
+    buffer = StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=STOCK_REPORT_FIELDS) if export_format == "csv" else None
+    if writer:
+        writer.writeheader()
+    
+    cursor = db.products.find(query, STOCK_REPORT_PROJECTION).sort("name", 1).batch_size(STOCK_EXPORT_BATCH_SIZE)
+    async for product in cursor:
+        row = build_stock_report_row(product)
+        total_products += 1
+        total_items += row["quantity"]
+        total_value += row["stock_value"]
+        
+        if writer:
+            writer.writerow(row)
+        else:
+            buffer.write(json.dumps(row, ensure_ascii=False) + "\n")
+        
+        if total_products % STOCK_EXPORT_BATCH_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    
+    summary = {
+        "total_products": total_products,
+        "total_items": total_items,
+        "total_value": round(total_value, 2),
+        "filters_applied": filters_applied
+    }
+    if writer:
+        buffer.write("\n")
+        summary_writer = csv.writer(buffer)
+        summary_writer.writerow(["total_products", total_products])
+        summary_writer.writerow(["total_items", total_items])
+        summary_writer.writerow(["total_value", summary["total_value"]])
+    else:
+        buffer.write(json.dumps({"summary": summary}, ensure_ascii=False) + "\n")
+    yield buffer.getvalue()
+
 @api_router.get("/reports/stock")
 async def get_stock_report(
     brand: Optional[str] = Query(None, description="Marka filtresi"),
     category: Optional[str] = Query(None, description="Kategori filtresi"),
+    format: str = Query("json", pattern="^(json|csv|ndjson)$", description="Çıktı formatı"),
     current_user: User = Depends(get_current_user)
 ):
     """Stok raporunu filtrelerle birlikte döndürür"""
@@ -617,7 +2035,25 @@ async def get_stock_report(
     if category:
         query["category"] = {"$regex": category, "$options": "i"}
     
-    products = await db.products.find(query, {"_id": 0}).sort("name", 1).to_list(10000)
+    filters_applied = {
+        "brand": brand,
+        "category": category
+    }
+    
+    # Büyük depolar için akışlı dışa aktarım: bellek kullanımı sabit kalır
+    if format == "csv":
+        return StreamingResponse(
+            stream_stock_report(query, format, filters_applied),
+            media_type="text/csv; charset=utf-8",
+            headers={"Content-Disposition": 'attachment; filename="stok_raporu.csv"'}
+        )
+    if format == "ndjson":
+        return StreamingResponse(
+            stream_stock_report(query, format, filters_applied),
+            media_type="application/x-ndjson"
+        )
+    
+    products = await db.products.find(query, STOCK_REPORT_PROJECTION).sort("name", 1).to_list(10000)
     
     # Stok raporunu hazırla
     report_data = []
@@ -625,23 +2061,10 @@ async def get_stock_report(
     total_items = 0
     
     for product in products:
-        item_value = product["quantity"] * product["purchase_price"]
-        total_value += item_value
-        total_items += product["quantity"]
-        
-        report_data.append({
-            "name": product["name"],
-            "barcode": product["barcode"],
-            "brand": product["brand"],
-            "category": product["category"],
-            "quantity": product["quantity"],
-            "unit_type": product.get("unit_type", "adet"),
-            "min_quantity": product["min_quantity"],
-            "purchase_price": product["purchase_price"],
-            "sale_price": product["sale_price"],
-            "stock_value": item_value,
-            "status": "Düşük Stok" if product["quantity"] <= product["min_quantity"] else "Normal"
-        })
+        row = build_stock_report_row(product)
+        total_value += row["stock_value"]
+        total_items += row["quantity"]
+        report_data.append(row)
     
     return {
         "products": report_data,
@@ -649,119 +2072,487 @@ async def get_stock_report(
             "total_products": len(report_data),
             "total_items": total_items,
             "total_value": round(total_value, 2),
-            "filters_applied": {
-                "brand": brand,
-                "category": category
-            }
+            "filters_applied": filters_applied
         }
     }
 
 @api_router.get("/reports/dashboard")
 async def get_dashboard_stats(current_user: User = Depends(get_current_user)):
-    total_products = await db.products.count_documents({})
-    low_stock = await db.products.count_documents({"$expr": {"$lte": ["$quantity", "$min_quantity"]}})
-    
     today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
     week_ago = today - timedelta(days=7)
     
-    today_sales = await db.sales.find({
-        "created_at": {"$gte": today.isoformat()}
-    }, {"_id": 0}).to_list(1000)
+    window_totals = {"$group": {"_id": None, "count": {"$sum": 1}, "revenue": {"$sum": "$final_amount"}}}
+    queries = [
+        db.products.count_documents({}),
+        db.products.count_documents({"is_low_stock": True})
+    ]
+    if await sales_rollup_ready():
+        # Geçmiş 7 tam gün rollup'taki gün toplamlarından, bugün ham satışlardan
+        queries.append(db.sales.aggregate([
+            {"$match": {"created_at": {"$gte": today}}},
+            {"$facet": {"today": [window_totals]}}
+        ]).to_list(1))
+        queries.append(db.sales_daily.aggregate([
+            {"$match": {"product_id": None, "date": {"$gte": week_ago.date().isoformat(), "$lt": today.date().isoformat()}}},
+            {"$group": {"_id": None, "count": {"$sum": "$sale_count"}, "revenue": {"$sum": "$revenue"}}}
+        ]).to_list(1))
+    else:
+        # Bugün ve son 7 gün tek bir aggregation ile hesaplanır
+        queries.append(db.sales.aggregate([
+            {"$match": {"created_at": {"$gte": week_ago}}},
+            {
+                "$facet": {
+                    "today": [{"$match": {"created_at": {"$gte": today}}}, window_totals],
+                    "week": [window_totals]
+                }
+            }
+        ]).to_list(1))
     
-    week_sales = await db.sales.find({
-        "created_at": {"$gte": week_ago.isoformat()}
-    }, {"_id": 0}).to_list(1000)
+    total_products, low_stock, sales_stats, *rollup_stats = await asyncio.gather(*queries)
     
-    today_revenue = sum(s["final_amount"] for s in today_sales)
-    week_revenue = sum(s["final_amount"] for s in week_sales)
+    facets = sales_stats[0] if sales_stats else {}
+    today_stats = (facets.get("today") or [{}])[0]
+    if rollup_stats:
+        past_days = (rollup_stats[0] or [{}])[0]
+        week_stats = {
+            "count": past_days.get("count", 0) + today_stats.get("count", 0),
+            "revenue": past_days.get("revenue", 0) + today_stats.get("revenue", 0)
+        }
+    else:
+        week_stats = (facets.get("week") or [{}])[0]
     
     return {
         "total_products": total_products,
         "low_stock_count": low_stock,
-        "today_sales_count": len(today_sales),
-        "today_revenue": today_revenue,
-        "week_sales_count": len(week_sales),
-        "week_revenue": week_revenue
+        "today_sales_count": today_stats.get("count", 0),
+        "today_revenue": today_stats.get("revenue", 0),
+        "week_sales_count": week_stats.get("count", 0),
+        "week_revenue": week_stats.get("revenue", 0)
+    }
+
+# Outbound HTTP: uygulama ömrü boyunca tek bir aiohttp oturumu
+class UpstreamError(Exception):
+    """Dış servisten kullanılabilir yanıt alınamadı (hata, zaman aşımı veya açık devre)"""
+
+    def __init__(self, upstream: str, reason: str):
+        super().__init__(f"{upstream}: {reason}")
+        self.upstream = upstream
+        self.reason = reason
+
+class CircuitBreaker:
+    """Art arda failure_threshold hatada devreyi açar ve istekleri hemen reddeder.
+
+    reset_timeout sonunda tek bir deneme isteğine izin verilir (half-open);
+    başarılı olursa devre kapanır, olmazsa yeniden açılır.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.trial_in_flight:
+            self.trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.trial_in_flight = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+    def end_trial(self):
+        """Deneme isteği sonuç kaydetmeden bittiyse (iptal, beklenmeyen hata) sıradaki isteğe izin ver"""
+        self.trial_in_flight = False
+
+class UpstreamMetrics:
+    def __init__(self):
+        self.requests = 0
+        self.successes = 0
+        self.failures = 0
+        self.retries = 0
+        self.short_circuited = 0
+        self.total_latency = 0.0
+        self.last_error = None
+
+    def snapshot(self) -> dict:
+        return {
+            "requests": self.requests,
+            "successes": self.successes,
+            "failures": self.failures,
+            "retries": self.retries,
+            "short_circuited": self.short_circuited,
+            "avg_latency_ms": round(self.total_latency / self.successes * 1000, 1) if self.successes else None,
+            "last_error": self.last_error
+        }
+
+class HttpClient:
+    """Bağlantı havuzlu, zaman aşımlı, yeniden denemeli ve devre kesicili JSON istemcisi.
+
+    Her upstream (ör. "serpapi") için ayrı devre kesici ve metrik tutulur.
+    Yalnızca ağ hataları, zaman aşımları, 429 ve 5xx yanıtları yeniden denenir.
+    """
+
+    def __init__(self):
+        self.session = None
+        self.breakers = {}
+        self.metrics = {}
+
+    async def start(self):
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit_per_host=HTTP_LIMIT_PER_HOST, ttl_dns_cache=300),
+                timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+            )
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def _upstream(self, name: str):
+        if name not in self.breakers:
+            self.breakers[name] = CircuitBreaker(CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_SECONDS)
+            self.metrics[name] = UpstreamMetrics()
+        return self.breakers[name], self.metrics[name]
+
+    async def get_json(self, upstream: str, url: str, params: dict = None,
+                       timeout: float = None, retries: int = None):
+        breaker, metrics = self._upstream(upstream)
+        is_trial = breaker.state == "half_open"
+        if not breaker.allow():
+            metrics.short_circuited += 1
+            raise UpstreamError(upstream, "devre açık")
+        try:
+            return await self._request(upstream, breaker, metrics, url, params, timeout, retries)
+        finally:
+            if is_trial:
+                breaker.end_trial()
+
+    async def _request(self, upstream: str, breaker: CircuitBreaker, metrics: UpstreamMetrics,
+                       url: str, params: dict, timeout: float, retries: int):
+        await self.start()
+        
+        retries = HTTP_RETRIES if retries is None else retries
+        request_timeout = aiohttp.ClientTimeout(total=timeout) if timeout else None
+        for attempt in range(retries + 1):
+            if attempt:
+                metrics.retries += 1
+                await asyncio.sleep(HTTP_RETRY_BACKOFF * 2 ** (attempt - 1))
+            metrics.requests += 1
+            started = time.perf_counter()
+            try:
+                async with self.session.get(url, params=params, timeout=request_timeout) as resp:
+                    if resp.status == 429 or resp.status >= 500:
+                        error = f"HTTP {resp.status}"
+                        continue
+                    if resp.status != 200:
+                        # 4xx istek/anahtar hatasıdır: upstream ayakta, tekrar denemek anlamsız
+                        metrics.failures += 1
+                        metrics.last_error = f"HTTP {resp.status}"
+                        breaker.record_success()
+                        raise UpstreamError(upstream, f"HTTP {resp.status}")
+                    data = await resp.json(content_type=None)
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                error = f"{type(e).__name__}: {e}"
+                continue
+            metrics.successes += 1
+            metrics.total_latency += time.perf_counter() - started
+            breaker.record_success()
+            return data
+        
+        metrics.failures += 1
+        metrics.last_error = error
+        breaker.record_failure()
+        raise UpstreamError(upstream, error)
+
+    def circuit_state(self, upstream: str) -> str:
+        return self._upstream(upstream)[0].state
+
+    def stats(self) -> dict:
+        return {
+            name: {**metrics.snapshot(), "circuit": self.breakers[name].state}
+            for name, metrics in self.metrics.items()
+        }
+
+http_client = HttpClient()
+
+# Currency endpoint: stale-while-revalidate önbellek.
+# Son iyi değer hemen döner; süresi geçmişse arka planda tek bir yenileme başlar.
+# Aynı anda gelen ıskalar tek upstream çağrısında birleşir, değer Mongo'da saklanır.
+CURRENCY_FALLBACK = {
+    "usd_try": 35.50,
+    "eur_try": 38.20,
+    "gold_try": 3250.00,
+    "silver_try": 38.50
+}
+currency_cache = {"data": None, "fetched_at": None}
+currency_refresh_task = None
+
+def inverse_rate(rates: dict, code: str) -> Optional[float]:
+    """1 / kur; kur yoksa, sayı değilse ya da pozitif değilse None"""
+    rate = rates.get(code)
+    if isinstance(rate, bool) or not isinstance(rate, (int, float)) or rate <= 0:
+        return None
+    return 1 / rate
+
+async def fetch_currency_rates() -> dict:
+    """Döviz ve maden fiyatlarını dış servislerden çeker; döviz servisi yoksa UpstreamError"""
+    # Get USD/EUR to TRY
+    data = await http_client.get_json("exchangerate", EXCHANGE_RATE_API_URL)
+    rates = data.get("rates") if isinstance(data, dict) else None
+    if not isinstance(rates, dict):
+        raise UpstreamError("exchangerate", "beklenmeyen yanıt")
+    
+    usd_try = round(inverse_rate(rates, "USD") or 35.50, 2)
+    eur_try = round(inverse_rate(rates, "EUR") or 38.20, 2)
+    
+    # Get Gold and Silver prices in TRY (per gram)
+    gold_try = 5400.00  # Updated fallback
+    silver_try = 62.50  # Updated fallback
+    
+    try:
+        # Try metalpriceapi.com - base USD to get XAU/XAG in USD, then convert to TRY
+        metal_data = await http_client.get_json("metalprice", METAL_PRICE_API_URL)
+        if isinstance(metal_data, dict) and metal_data.get("success") and isinstance(metal_data.get("rates"), dict):
+            rates_metal = metal_data["rates"]
+            # rates_metal["XAU"] = how many XAU per 1 USD (e.g., 0.000385 XAU per USD)
+            # We need USD per XAU (per troy ounce), so: 1 / rates_metal["XAU"]
+            # Then convert to TRY per gram: (USD_per_ounce * usd_try) / 31.1035
+            
+            usd_per_ounce_gold = inverse_rate(rates_metal, "XAU")  # USD per troy ounce
+            if usd_per_ounce_gold:
+                gold_try = round((usd_per_ounce_gold * usd_try) / 31.1035, 2)  # TRY per gram
+            
+            usd_per_ounce_silver = inverse_rate(rates_metal, "XAG")  # USD per troy ounce
+            if usd_per_ounce_silver:
+                silver_try = round((usd_per_ounce_silver * usd_try) / 31.1035, 2)  # TRY per gram
+    except UpstreamError as metal_error:
+        logging.warning(f"Metal price API error: {metal_error}, using fallback")
+    
+    return {
+        "usd_try": usd_try,
+        "eur_try": eur_try,
+        "gold_try": gold_try,
+        "silver_try": silver_try
     }
 
-# Currency endpoint
-currency_cache = {"data": None, "timestamp": None}
+async def load_persisted_currency_rates():
+    """Mongo'daki son değeri, bellektekinden yeniyse önbelleğe alır"""
+    stored = await db.currency_rates.find_one({"_id": "latest"})
+    if stored and (currency_cache["fetched_at"] is None or stored["fetched_at"] > currency_cache["fetched_at"]):
+        currency_cache.update(data=stored["data"], fetched_at=stored["fetched_at"])
+
+async def refresh_currency_rates():
+    """Kurları yeniler ve Mongo'ya yazar.
+
+    Başka bir worker daha yeni bir değer kaydetmişse upstream'e gidilmez.
+    """
+    await load_persisted_currency_rates()
+    if currency_cache["data"] is not None and currency_cache_age() < CURRENCY_CACHE_TTL:
+        return
+    
+    data = await fetch_currency_rates()
+    fetched_at = datetime.now(timezone.utc)
+    currency_cache.update(data=data, fetched_at=fetched_at)
+    await db.currency_rates.replace_one(
+        {"_id": "latest"},
+        {"data": data, "fetched_at": fetched_at},
+        upsert=True
+    )
+
+def currency_cache_age() -> float:
+    return (datetime.now(timezone.utc) - currency_cache["fetched_at"]).total_seconds()
+
+def start_currency_refresh() -> asyncio.Task:
+    """Süren bir yenileme varsa onu, yoksa yeni bir yenileme görevini döndürür"""
+    global currency_refresh_task
+    if currency_refresh_task is None or currency_refresh_task.done():
+        currency_refresh_task = asyncio.create_task(refresh_currency_rates())
+        currency_refresh_task.add_done_callback(log_currency_refresh_error)
+    return currency_refresh_task
+
+def log_currency_refresh_error(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        logging.error(f"Currency API error: {task.exception()}")
 
 @api_router.get("/currency")
 async def get_currency_rates():
-    global currency_cache
+    if currency_cache["data"] is None:
+        try:
+            await asyncio.shield(start_currency_refresh())
+        except Exception:
+            pass  # Hata done callback'inde loglanır; aşağıda fallback döner
     
-    # Cache for 1 hour
-    if currency_cache["data"] and currency_cache["timestamp"]:
-        if (datetime.now(timezone.utc) - currency_cache["timestamp"]).seconds < 3600:
-            return currency_cache["data"]
+    if currency_cache["data"] is None:
+        # Fallback data
+        return {**CURRENCY_FALLBACK, "timestamp": datetime.now(timezone.utc).isoformat(),
+                "age_seconds": None, "stale": True}
     
-    try:
-        async with aiohttp.ClientSession() as session:
-            # Get USD/EUR to TRY
-            async with session.get("https://api.exchangerate-api.com/v4/latest/TRY") as resp:
-                if resp.status == 200:
-                    data = await resp.json()
-                    rates = data.get("rates", {})
-                    
-                    usd_try = round(1 / rates.get("USD", 0.03), 2) if rates.get("USD") else 35.50
-                    eur_try = round(1 / rates.get("EUR", 0.028), 2) if rates.get("EUR") else 38.20
-                else:
-                    usd_try = 35.50
-                    eur_try = 38.20
+    age = currency_cache_age()
+    stale = age >= CURRENCY_CACHE_TTL
+    if stale:
+        start_currency_refresh()
+    return {
+        **currency_cache["data"],
+        "timestamp": currency_cache["fetched_at"].isoformat(),
+        "age_seconds": round(age),
+        "stale": stale
+    }
+
+# Product price comparison endpoint (SerpAPI Google Shopping)
+# Sonuçlar ürün başına price_comparisons koleksiyonunda PRICE_COMPARISON_TTL_HOURS boyunca saklanır.
+MANUAL_PRICE_SITES = [
+    {'site': 'Hepsiburada', 'base_url': 'https://www.hepsiburada.com/ara?q='},
+    {'site': 'Trendyol', 'base_url': 'https://www.trendyol.com/sr?q='},
+    {'site': 'N11', 'base_url': 'https://www.n11.com/arama?q='},
+    {'site': 'Amazon TR', 'base_url': 'https://www.amazon.com.tr/s?k='},
+    {'site': 'GittiGidiyor', 'base_url': 'https://www.gittigidiyor.com/arama/?k='},
+    {'site': 'Çiçeksepeti', 'base_url': 'https://www.ciceksepeti.com/ara?q='},
+    {'site': 'Akakçe', 'base_url': 'https://www.akakce.com/arama/?q='},
+    {'site': 'Cimri', 'base_url': 'https://www.cimri.com/arama?q='},
+    {'site': 'Epttavm', 'base_url': 'https://www.epttavm.com/arama?q='},
+    {'site': 'Google Shopping', 'base_url': 'https://www.google.com/search?tbm=shop&q='}
+]
+
+def price_search_query(product: dict) -> str:
+    return f"{product['brand']} {product['name']}"
+
+async def fetch_serpapi_prices(search_query: str, serpapi_key: str) -> List[dict]:
+    """SerpAPI Google Shopping'den en ucuz 10 sonucu döndürür; servis yoksa UpstreamError"""
+    params = {
+        'engine': 'google_shopping',
+        'q': search_query,
+        'api_key': serpapi_key,
+        'gl': 'tr',  # Turkey
+        'hl': 'tr',  # Turkish language
+        'num': 20    # Get more results to filter
+    }
+    # Sorgular kotaya sayıldığı için yalnızca bir kez yeniden denenir
+    data = await http_client.get_json("serpapi", SERPAPI_URL, params=params, timeout=10, retries=1)
+    
+    shopping_results = (data.get('shopping_results') or []) if isinstance(data, dict) else None
+    if not isinstance(shopping_results, list):
+        raise UpstreamError("serpapi", "beklenmeyen yanıt")
+    
+    results = []
+    
+    for item in shopping_results[:20]:  # Process up to 20 items
+        try:
+            # Extract price - handle different price formats
+            price_str = item.get('price', '0')
+            # Remove currency symbols and commas
+            price_str = price_str.replace('₺', '').replace('TL', '').replace('.', '').replace(',', '.').strip()
+            price = float(price_str)
             
-            # Get Gold and Silver prices in TRY (per gram)
-            gold_try = 5400.00  # Updated fallback
-            silver_try = 62.50  # Updated fallback
+            # Extract source/site name
+            source = item.get('source', 'Bilinmeyen')
             
-            try:
-                # Try metalpriceapi.com - base USD to get XAU/XAG in USD, then convert to TRY
-                async with session.get("https://api.metalpriceapi.com/v1/latest?base=USD&currencies=XAU,XAG") as metal_resp:
-                    if metal_resp.status == 200:
-                        metal_data = await metal_resp.json()
-                        if metal_data.get("success"):
-                            rates_metal = metal_data.get("rates", {})
-                            # rates_metal["XAU"] = how many XAU per 1 USD (e.g., 0.000385 XAU per USD)
-                            # We need USD per XAU (per troy ounce), so: 1 / rates_metal["XAU"]
-                            # Then convert to TRY per gram: (USD_per_ounce * usd_try) / 31.1035
-                            
-                            if rates_metal.get("XAU"):
-                                usd_per_ounce_gold = 1 / rates_metal["XAU"]  # USD per troy ounce
-                                gold_try = round((usd_per_ounce_gold * usd_try) / 31.1035, 2)  # TRY per gram
-                            
-                            if rates_metal.get("XAG"):
-                                usd_per_ounce_silver = 1 / rates_metal["XAG"]  # USD per troy ounce
-                                silver_try = round((usd_per_ounce_silver * usd_try) / 31.1035, 2)  # TRY per gram
-            except Exception as metal_error:
-                logging.warning(f"Metal price API error: {metal_error}, using fallback")
+            # Get product link
+            link = item.get('link', '#')
             
-            result = {
-                "usd_try": usd_try,
-                "eur_try": eur_try,
-                "gold_try": gold_try,
-                "silver_try": silver_try,
-                "timestamp": datetime.now(timezone.utc).isoformat()
-            }
+            # Check if in stock
+            delivery = item.get('delivery', '')
+            available = 'stok' not in delivery.lower() or 'mevcut' in delivery.lower()
             
-            currency_cache["data"] = result
-            currency_cache["timestamp"] = datetime.now(timezone.utc)
-            return result
-    except Exception as e:
-        logging.error(f"Currency API error: {e}")
+            results.append({
+                'site': source,
+                'price': round(price, 2),
+                'url': link,
+                'available': available,
+                'title': item.get('title', '')
+            })
+        except (ValueError, TypeError, AttributeError) as e:
+            logging.warning(f"Price parsing error: {e}")
+            continue
+    
+    # Sort by price
+    results.sort(key=lambda x: x['price'])
     
-    # Fallback data
+    # Get top 10 lowest prices
+    return results[:10]
+
+def price_comparison_response(product: dict, price_results: List[dict], **extra) -> dict:
     return {
-        "usd_try": 35.50,
-        "eur_try": 38.20,
-        "gold_try": 3250.00,
-        "silver_try": 38.50,
-        "timestamp": datetime.now(timezone.utc).isoformat()
+        'product_id': product['id'],
+        'product_name': product['name'],
+        'brand': product['brand'],
+        'category': product['category'],
+        'current_price': product['sale_price'],
+        'barcode': product.get('barcode', ''),
+        'price_results': price_results,
+        'result_count': len(price_results),
+        **extra
     }
 
-# Product price comparison endpoint (SerpAPI Google Shopping)
+def manual_price_comparison(product: dict) -> dict:
+    """SerpAPI sonuç vermezse büyük sitelerde arama linkleri"""
+    search_term = f"{product['brand']}+{product['name']}".replace(' ', '+')
+    fallback_results = [
+        {
+            'site': site_info['site'],
+            'price': product['sale_price'],
+            'url': site_info['base_url'] + search_term,
+            'available': True,
+            'title': f"{product['name']} - Manuel arama"
+        }
+        for site_info in MANUAL_PRICE_SITES
+    ]
+    return price_comparison_response(
+        product, fallback_results[:10],
+        source='Manuel Arama (SerpAPI mevcut değil)',
+        info='Gerçek fiyatlar için siteleri ziyaret edin'
+    )
+
+async def refresh_price_comparison(product: dict, serpapi_key: str) -> Optional[dict]:
+    """Ürünün fiyatlarını SerpAPI'den çekip saklar; sonuç yoksa None döner"""
+    search_query = price_search_query(product)
+    price_results = await fetch_serpapi_prices(search_query, serpapi_key)
+    if not price_results:
+        return None
+    entry = {
+        "product_id": product["id"],
+        "search_query": search_query,
+        "price_results": price_results,
+        "fetched_at": datetime.now(timezone.utc)
+    }
+    await db.price_comparisons.replace_one({"product_id": product["id"]}, entry, upsert=True)
+    return entry
+
+def cached_price_comparison(product: dict, entry: dict) -> dict:
+    age = (datetime.now(timezone.utc) - entry["fetched_at"]).total_seconds()
+    return price_comparison_response(
+        product, entry["price_results"],
+        source='SerpAPI Google Shopping',
+        fetched_at=entry["fetched_at"].isoformat(),
+        age_seconds=round(age),
+        stale=age >= PRICE_COMPARISON_TTL_HOURS * 3600
+    )
+
 @api_router.get("/products/{product_id}/price-comparison")
 async def get_product_price_comparison(
     product_id: str,
+    refresh: bool = Query(False, description="Önbelleği atlayıp SerpAPI'den yeniden çek"),
     current_user: User = Depends(get_current_user)
 ):
     """
@@ -773,133 +2564,135 @@ async def get_product_price_comparison(
     if not product:
         raise HTTPException(status_code=404, detail="Ürün bulunamadı")
     
+    # Ürün adı/markası değiştiyse eski sonuç geçersizdir
+    cached = await db.price_comparisons.find_one(
+        {"product_id": product_id, "search_query": price_search_query(product)}, {"_id": 0}
+    )
+    if cached and not refresh:
+        response = cached_price_comparison(product, cached)
+        if not response["stale"]:
+            return response
+    
     serpapi_key = os.environ.get('SERPAPI_KEY')
     if not serpapi_key:
+        # Anahtar yokken de eski sonuç gösterilebilir
+        if cached:
+            return cached_price_comparison(product, cached)
         raise HTTPException(status_code=500, detail="SerpAPI key bulunamadı")
     
     try:
-        # Prepare search query for Turkish market
-        search_query = f"{product['brand']} {product['name']}"
-        
-        # Call SerpAPI Google Shopping
-        async with aiohttp.ClientSession() as session:
-            params = {
-                'engine': 'google_shopping',
-                'q': search_query,
-                'api_key': serpapi_key,
-                'gl': 'tr',  # Turkey
-                'hl': 'tr',  # Turkish language
-                'num': 20    # Get more results to filter
-            }
-            
-            serpapi_url = 'https://serpapi.com/search.json'
-            
-            try:
-                async with session.get(serpapi_url, params=params, timeout=10) as resp:
-                    if resp.status == 200:
-                        data = await resp.json()
-                        
-                        results = []
-                        shopping_results = data.get('shopping_results', [])
-                        
-                        for item in shopping_results[:20]:  # Process up to 20 items
-                            try:
-                                # Extract price - handle different price formats
-                                price_str = item.get('price', '0')
-                                # Remove currency symbols and commas
-                                price_str = price_str.replace('₺', '').replace('TL', '').replace('.', '').replace(',', '.').strip()
-                                price = float(price_str)
-                                
-                                # Extract source/site name
-                                source = item.get('source', 'Bilinmeyen')
-                                
-                                # Get product link
-                                link = item.get('link', '#')
-                                
-                                # Check if in stock
-                                delivery = item.get('delivery', '')
-                                available = 'stok' not in delivery.lower() or 'mevcut' in delivery.lower()
-                                
-                                results.append({
-                                    'site': source,
-                                    'price': round(price, 2),
-                                    'url': link,
-                                    'available': available,
-                                    'title': item.get('title', '')
-                                })
-                            except (ValueError, TypeError) as e:
-                                logging.warning(f"Price parsing error: {e}")
-                                continue
-                        
-                        # Sort by price
-                        results.sort(key=lambda x: x['price'])
-                        
-                        # Get top 10 lowest prices
-                        top_results = results[:10]
-                        
-                        if len(top_results) > 0:
-                            return {
-                                'product_id': product['id'],
-                                'product_name': product['name'],
-                                'brand': product['brand'],
-                                'category': product['category'],
-                                'current_price': product['sale_price'],
-                                'barcode': product.get('barcode', ''),
-                                'price_results': top_results,
-                                'result_count': len(top_results),
-                                'source': 'SerpAPI Google Shopping'
-                            }
-                    else:
-                        logging.error(f"SerpAPI error: Status {resp.status}")
-                        
-            except asyncio.TimeoutError:
-                logging.error("SerpAPI timeout")
-            except Exception as e:
-                logging.error(f"SerpAPI request error: {e}")
-        
-        # Fallback: If SerpAPI fails, provide search links to major sites
-        major_sites = [
-            {'site': 'Hepsiburada', 'base_url': 'https://www.hepsiburada.com/ara?q='},
-            {'site': 'Trendyol', 'base_url': 'https://www.trendyol.com/sr?q='},
-            {'site': 'N11', 'base_url': 'https://www.n11.com/arama?q='},
-            {'site': 'Amazon TR', 'base_url': 'https://www.amazon.com.tr/s?k='},
-            {'site': 'GittiGidiyor', 'base_url': 'https://www.gittigidiyor.com/arama/?k='},
-            {'site': 'Çiçeksepeti', 'base_url': 'https://www.ciceksepeti.com/ara?q='},
-            {'site': 'Akakçe', 'base_url': 'https://www.akakce.com/arama/?q='},
-            {'site': 'Cimri', 'base_url': 'https://www.cimri.com/arama?q='},
-            {'site': 'Epttavm', 'base_url': 'https://www.epttavm.com/arama?q='},
-            {'site': 'Google Shopping', 'base_url': 'https://www.google.com/search?tbm=shop&q='}
-        ]
+        try:
+            entry = await refresh_price_comparison(product, serpapi_key)
+        except UpstreamError as e:
+            logging.error(f"SerpAPI request error: {e}")
+            entry = None
         
-        search_term = f"{product['brand']}+{product['name']}".replace(' ', '+')
-        fallback_results = []
-        
-        for site_info in major_sites:
-            fallback_results.append({
-                'site': site_info['site'],
-                'price': product['sale_price'],
-                'url': site_info['base_url'] + search_term,
-                'available': True,
-                'title': f"{product['name']} - Manuel arama"
-            })
-        
-        return {
-            'product_id': product['id'],
-            'product_name': product['name'],
-            'brand': product['brand'],
-            'category': product['category'],
-            'current_price': product['sale_price'],
-            'barcode': product.get('barcode', ''),
-            'price_results': fallback_results[:10],
-            'result_count': len(fallback_results[:10]),
-            'source': 'Manuel Arama (SerpAPI mevcut değil)',
-            'info': 'Gerçek fiyatlar için siteleri ziyaret edin'
-        }
+        if entry:
+            return cached_price_comparison(product, entry)
+        # SerpAPI şu an sonuç vermiyorsa eski sonuç manuel linklerden iyidir
+        if cached:
+            return cached_price_comparison(product, cached)
+        return manual_price_comparison(product)
             
     except Exception as e:
         logging.error(f"Price comparison error: {e}")
         raise HTTPException(status_code=500, detail=f"Fiyat karşılaştırması hatası: {str(e)}")
 
+# Katalog fiyat yenileme: tek seferde bir çalıştırma, ilerleme price_refresh_runs'ta
+price_refresh_task = None
+
+async def run_price_refresh(run_id: str, request: PriceRefreshRequest, serpapi_key: str):
+    """Seçilen ürünlerin fiyatlarını en fazla request.concurrency eşzamanlı istekle yeniler.
+
+    SerpAPI devresi açılırsa kalan ürünler denenmez ve çalıştırma "aborted" olur.
+    """
+    started = time.perf_counter()
+    query = {}
+    if request.brand:
+        query["brand"] = request.brand
+    if request.category:
+        query["category"] = request.category
+    products = await db.products.find(
+        query, {"_id": 0, "id": 1, "name": 1, "brand": 1, "category": 1, "sale_price": 1, "barcode": 1}
+    ).to_list(None)
+    
+    fresh = set()
+    if request.only_stale:
+        cutoff = datetime.now(timezone.utc) - timedelta(hours=PRICE_COMPARISON_TTL_HOURS)
+        async for entry in db.price_comparisons.find(
+            {"product_id": {"$in": [p["id"] for p in products]}, "fetched_at": {"$gte": cutoff}},
+            {"_id": 0, "product_id": 1, "search_query": 1}
+        ):
+            fresh.add((entry["product_id"], entry["search_query"]))
+    pending = [p for p in products if (p["id"], price_search_query(p)) not in fresh]
+    
+    stats = {"total": len(products), "skipped": len(products) - len(pending),
+             "refreshed": 0, "no_results": 0, "failed": 0}
+    await db.price_refresh_runs.update_one({"id": run_id}, {"$set": {"stats": stats}})
+    
+    async def refresh(product):
+        try:
+            entry = await refresh_price_comparison(product, serpapi_key)
+            stats["refreshed" if entry else "no_results"] += 1
+        except Exception as e:
+            logging.warning(f"Price refresh error for {product['id']}: {e}")
+            stats["failed"] += 1
+        await db.price_refresh_runs.update_one({"id": run_id}, {"$set": {"stats": stats}})
+    
+    def circuit_open() -> bool:
+        return http_client.circuit_state("serpapi") == "open"
+    
+    try:
+        await run_bounded(pending, request.concurrency, refresh, should_stop=circuit_open)
+        processed = stats["skipped"] + stats["refreshed"] + stats["no_results"] + stats["failed"]
+        run_status = "completed" if processed == stats["total"] else "aborted"
+    except Exception as e:
+        logging.error(f"Price refresh run {run_id} failed: {e}")
+        run_status = "failed"
+    await db.price_refresh_runs.update_one({"id": run_id}, {"$set": {
+        "status": run_status,
+        "stats": stats,
+        "finished_at": datetime.now(timezone.utc),
+        "duration_seconds": round(time.perf_counter() - started, 1)
+    }})
+
+@api_router.post("/admin/price-comparisons/refresh")
+async def start_price_refresh(request: PriceRefreshRequest, current_user: User = Depends(get_current_user)):
+    """Katalog (veya marka/kategori alt kümesi) için fiyat karşılaştırmalarını arka planda yeniler"""
+    global price_refresh_task
+    if current_user.role != "yönetici":
+        raise HTTPException(status_code=403, detail="Sadece yöneticiler fiyat yenilemesi başlatabilir")
+    
+    serpapi_key = os.environ.get('SERPAPI_KEY')
+    if not serpapi_key:
+        raise HTTPException(status_code=500, detail="SerpAPI key bulunamadı")
+    if price_refresh_task is not None and not price_refresh_task.done():
+        raise HTTPException(status_code=409, detail="Devam eden bir fiyat yenilemesi var")
+    
+    run = {
+        "id": str(uuid.uuid4()),
+        "status": "running",
+        "filters": request.model_dump(),
+        "stats": None,
+        "started_at": datetime.now(timezone.utc),
+        "started_by": current_user.username
+    }
+    await db.price_refresh_runs.insert_one(run)
+    price_refresh_task = asyncio.create_task(run_price_refresh(run["id"], request, serpapi_key))
+    run.pop("_id", None)
+    return run
+
+@api_router.get("/admin/price-comparisons/refresh/{run_id}")
+async def get_price_refresh(run_id: str, current_user: User = Depends(get_current_user)):
+    """Fiyat yenileme çalıştırmasının durumunu ve istatistiklerini döndürür"""
+    if current_user.role != "yönetici":
+        raise HTTPException(status_code=403, detail="Sadece yöneticiler fiyat yenilemelerini görebilir")
+    
+    run = await db.price_refresh_runs.find_one({"id": run_id}, {"_id": 0})
+    if not run:
+        raise HTTPException(status_code=404, detail="Çalıştırma bulunamadı")
+    return run
+
 # Calendar endpoints
 @api_router.post("/calendar", response_model=CalendarEvent)
 async def create_calendar_event(event_data: CalendarEventCreate, current_user: User = Depends(get_current_user)):
@@ -908,8 +2701,6 @@ async def create_calendar_event(event_data: CalendarEventCreate, current_user: U
     
     event = CalendarEvent(**event_dict)
     doc = event.model_dump()
-    doc["date"] = doc["date"].isoformat()
-    doc["created_at"] = doc["created_at"].isoformat()
     
     await db.calendar_events.insert_one(doc)
     return event
@@ -923,16 +2714,11 @@ async def get_calendar_events(
     query = {"user_id": current_user.id}
     if start_date and end_date:
         query["date"] = {
-            "$gte": datetime.fromisoformat(start_date).isoformat(),
-            "$lte": datetime.fromisoformat(end_date).isoformat()
+            "$gte": parse_datetime_param(start_date),
+            "$lte": parse_datetime_param(end_date)
         }
     
     events = await db.calendar_events.find(query, {"_id": 0}).sort("date", 1).to_list(1000)
-    for e in events:
-        if isinstance(e["date"], str):
-            e["date"] = datetime.fromisoformat(e["date"])
-        if isinstance(e["created_at"], str):
-            e["created_at"] = datetime.fromisoformat(e["created_at"])
     return events
 
 @api_router.delete("/calendar/{event_id}")
@@ -1139,6 +2925,11 @@ async def seed_test_data(current_user: User = Depends(get_current_user)):
         }
     ]
     
+    for customer in customers:
+        customer.update(customer_search_fields(customer["name"], customer["phone"]))
+    for product in medical_products:
+        product["is_low_stock"] = is_low_stock(product["quantity"], product["min_quantity"])
+    
     # Insert data
     await db.products.insert_many(medical_products)
     await db.customers.insert_many(customers)
@@ -1151,9 +2942,512 @@ async def seed_test_data(current_user: User = Depends(get_current_user)):
         "events_added": len(events)
     }
 
+# Migrations
+SALE_COST_BACKFILL_BATCH_SIZE = 500
+
+async def backfill_sale_item_costs() -> dict:
+    """Maliyeti olmayan eski satış satırlarına ürünlerin alış fiyatını yazar.
+
+    Yalnızca en az bir satırı değişen satışlar yazılır. Rollup daha önce
+    oluşturulduysa eski günlerin kârı da görünsün diye yeniden hesaplanır.
+    """
+    query = {"items": {"$elemMatch": {"purchase_price": {"$exists": False}}}}
+    sales_updated = 0
+    items_updated = 0
+    
+    async def flush(batch: List[dict]):
+        nonlocal sales_updated, items_updated
+        missing = {sale["id"]: [item for item in sale["items"] if "purchase_price" not in item] for sale in batch}
+        # Ürünler her parti için tek bir $in sorgusuyla çekilir
+        items_updated += await snapshot_sale_item_costs([item for items in missing.values() for item in items])
+        operations = [
+            UpdateOne({"id": sale["id"]}, {"$set": {"items": sale["items"]}})
+            for sale in batch
+            if any("purchase_price" in item for item in missing[sale["id"]])
+        ]
+        if operations:
+            result = await db.sales.bulk_write(operations, ordered=False)
+            sales_updated += result.modified_count
+    
+    batch = []
+    async for sale in db.sales.find(query, {"_id": 0, "id": 1, "items": 1}).batch_size(SALE_COST_BACKFILL_BATCH_SIZE):
+        batch.append(sale)
+        if len(batch) >= SALE_COST_BACKFILL_BATCH_SIZE:
+            await flush(batch)
+            batch = []
+    if batch:
+        await flush(batch)
+    
+    if sales_updated and await sales_rollup_ready():
+        await rebuild_sales_daily_rollup()
+    
+    logger.info(f"Satış maliyeti backfill: {sales_updated} satış, {items_updated} satır güncellendi")
+    return {
+        "sales_updated": sales_updated,
+        "items_updated": items_updated
+    }
+
+@api_router.post("/admin/migrations/backfill-sale-costs")
+async def backfill_sale_costs(current_user: User = Depends(get_current_user)):
+    """Satış maliyeti backfill'ini elle yeniden çalıştırır (startup'ta migration 4 olarak da çalışır)"""
+    if current_user.role != "yönetici":
+        raise HTTPException(status_code=403, detail="Sadece yöneticiler migration çalıştırabilir")
+    return await backfill_sale_item_costs()
+
+@api_router.post("/admin/migrations/extract-product-images")
+async def extract_product_images(current_user: User = Depends(get_current_user)):
+    """Ürün dokümanlarındaki base64 görselleri görsel deposuna taşır (tek seferlik)"""
+    if current_user.role != "yönetici":
+        raise HTTPException(status_code=403, detail="Sadece yöneticiler migration çalıştırabilir")
+    
+    query = {
+        "image_url": {"$nin": [None, ""], "$not": re.compile(r"^(/api/images/|https?://)")}
+    }
+    migrated = 0
+    failed = []
+    # Görseller büyük olabileceği için küçük partilerle okunur
+    async for product in db.products.find(query, {"_id": 0, "id": 1, "image_url": 1}).batch_size(20):
+        try:
+            fields = image_urls(await store_product_image(product["image_url"]))
+        except HTTPException:
+            failed.append(product["id"])
+            continue
+        fields["updated_at"] = datetime.now(timezone.utc)
+        await db.products.update_one({"id": product["id"]}, {"$set": fields})
+        invalidate_cached_products([product["id"]])
+        migrated += 1
+    
+    logger.info(f"Görsel migration: {migrated} ürün taşındı, {len(failed)} hatalı")
+    return {
+        "migrated": migrated,
+        "failed": failed
+    }
+
+SALES_DAILY_REBUILD_BATCH_SIZE = 1000
+
+@api_router.post("/admin/reconcile-low-stock")
+async def reconcile_low_stock(current_user: User = Depends(get_current_user)):
+    """is_low_stock bayrağını quantity/min_quantity ile yeniden eşitler.
+
+    Uygulama dışından (script, elle düzeltme) yapılan stok değişikliklerinden sonra çalıştırılır.
+    """
+    if current_user.role != "yönetici":
+        raise HTTPException(status_code=403, detail="Sadece yöneticiler düşük stok bayraklarını eşitleyebilir")
+    return {"fixed": await reconcile_low_stock_flags()}
+
+async def rebuild_sales_daily_rollup() -> int:
+    """sales_daily'yi baştan hesaplar; yazılan satır sayısını döndürür"""
+    day = {"$dateToString": {"format": "%Y-%m-%d", "date": "$created_at"}}
+    day_totals = [
+        {"$group": {
+            "_id": {"date": day, "product_id": None},
+            "sale_count": {"$sum": 1},
+            "revenue": {"$sum": "$final_amount"}
+        }}
+    ]
+    product_rows = [
+        {"$unwind": "$items"},
+        {"$group": {
+            "_id": {"date": day, "product_id": "$items.product_id"},
+            "product_name": {"$last": "$items.name"},
+            "quantity": {"$sum": "$items.quantity"},
+            "revenue": {"$sum": "$items.total"},
+            "cost": {"$sum": {"$cond": [ITEM_HAS_COST, ITEM_COST, 0]}},
+            "profit": {"$sum": {"$cond": [ITEM_HAS_COST, {"$subtract": ["$items.total", ITEM_COST]}, 0]}},
+            "costed": {"$max": ITEM_HAS_COST},
+            "sale_count": {"$sum": 1}
+        }}
+    ]
+    
+    await db.rollup_state.delete_one({"_id": "sales_daily"})
+    await db.sales_daily.delete_many({})
+    
+    rows_written = 0
+    for pipeline in (day_totals, product_rows):
+        operations = []
+        async for row in db.sales.aggregate(pipeline, allowDiskUse=True):
+            key = row.pop("_id")
+            # Maliyeti olmayan ürün satırlarında cost/profit alanı tutulmaz
+            if not row.pop("costed", True):
+                row.pop("cost")
+                row.pop("profit")
+            operations.append(UpdateOne(key, {"$set": row}, upsert=True))
+            if len(operations) >= SALES_DAILY_REBUILD_BATCH_SIZE:
+                await db.sales_daily.bulk_write(operations, ordered=False)
+                rows_written += len(operations)
+                operations = []
+        if operations:
+            await db.sales_daily.bulk_write(operations, ordered=False)
+            rows_written += len(operations)
+    
+    await db.rollup_state.update_one(
+        {"_id": "sales_daily"},
+        {"$set": {"rebuilt_at": datetime.now(timezone.utc)}},
+        upsert=True
+    )
+    logger.info(f"sales_daily yeniden oluşturuldu: {rows_written} satır")
+    return rows_written
+
+@api_router.post("/admin/rebuild-sales-daily")
+async def rebuild_sales_daily(current_user: User = Depends(get_current_user)):
+    """sales_daily rollup'ını ham satışlardan baştan hesaplar.
+
+    Rebuild sürerken raporlar ham satışları kullanır. Eşzamanlı satışlar
+    sayımı bozabileceği için sakin saatlerde çalıştırılmalıdır.
+    """
+    if current_user.role != "yönetici":
+        raise HTTPException(status_code=403, detail="Sadece yöneticiler rollup'ı yeniden oluşturabilir")
+    return {"rows_written": await rebuild_sales_daily_rollup()}
+
+# Koleksiyon -> [(anahtarlar, seçenekler)]; startup'ta idempotent olarak oluşturulur
+INDEX_SPECS = {
+    "users": [
+        ([("id", ASCENDING)], {"unique": True}),
+        ([("username", ASCENDING)], {"unique": True}),
+    ],
+    "products": [
+        ([("id", ASCENDING)], {"unique": True}),
+        ([("barcode", ASCENDING)], {"unique": True}),
+        ([("name", ASCENDING), ("id", ASCENDING)], {}),
+        ([("updated_at", ASCENDING), ("id", ASCENDING)], {}),
+        ([("brand", ASCENDING)], {}),
+        ([("category", ASCENDING)], {}),
+        ([("is_low_stock", ASCENDING)], {"partialFilterExpression": {"is_low_stock": True}}),
+    ],
+    "product_tombstones": [
+        ([("id", ASCENDING)], {"unique": True}),
+        ([("deleted_at", ASCENDING)], {"expireAfterSeconds": PRODUCT_TOMBSTONE_TTL_DAYS * 86400}),
+    ],
+    "sales": [
+        ([("id", ASCENDING)], {"unique": True}),
+        ([("created_at", DESCENDING)], {}),
+        ([("customer_id", ASCENDING), ("created_at", DESCENDING)], {}),
+    ],
+    "sales_daily": [
+        ([("date", ASCENDING), ("product_id", ASCENDING)], {"unique": True}),
+    ],
+    "price_comparisons": [
+        ([("product_id", ASCENDING)], {"unique": True}),
+    ],
+    "price_refresh_runs": [
+        ([("id", ASCENDING)], {"unique": True}),
+    ],
+    "description_runs": [
+        ([("id", ASCENDING)], {"unique": True}),
+    ],
+    "import_runs": [
+        ([("id", ASCENDING)], {"unique": True}),
+    ],
+    "customers": [
+        ([("id", ASCENDING)], {"unique": True}),
+        ([("name_tokens", ASCENDING)], {}),
+        ([("phone_digits", ASCENDING)], {}),
+    ],
+    "calendar_events": [
+        ([("id", ASCENDING)], {"unique": True}),
+        ([("user_id", ASCENDING), ("date", ASCENDING)], {}),
+    ],
+    "product_images.files": [
+        ([("metadata.image_id", ASCENDING)], {}),
+    ],
+}
+
+# Sıcak sorgu şekilleri; index sağlık raporunda COLLSCAN kontrolü için explain edilir
+HOT_QUERIES = [
+    {"name": "login", "collection": "users", "filter": {"username": ""}},
+    {"name": "get_current_user", "collection": "users", "filter": {"id": ""}},
+    {"name": "get_product_by_barcode", "collection": "products", "filter": {"barcode": ""}},
+    {"name": "update_product", "collection": "products", "filter": {"id": ""}},
+    {"name": "get_low_stock_products", "collection": "products", "filter": {"is_low_stock": True}},
+    {"name": "get_sales", "collection": "sales", "filter": {"created_at": {"$gte": datetime(2000, 1, 1, tzinfo=timezone.utc)}}, "sort": {"created_at": -1}},
+    {"name": "search_customers", "collection": "customers", "filter": {"name_tokens": {"$regex": "^a"}}},
+    {"name": "get_customer_purchases", "collection": "sales", "filter": {"customer_id": ""}, "sort": {"created_at": -1}},
+    {"name": "get_calendar_events", "collection": "calendar_events", "filter": {"user_id": "", "date": {"$gte": datetime(2000, 1, 1, tzinfo=timezone.utc)}}, "sort": {"date": 1}},
+]
+
+def _plan_stages(plan: dict) -> List[str]:
+    """Explain çıktısındaki plan ağacının tüm stage adlarını toplar"""
+    stages = [plan.get("stage")] if plan.get("stage") else []
+    for child_key in ("inputStage", "queryPlan"):
+        if isinstance(plan.get(child_key), dict):
+            stages.extend(_plan_stages(plan[child_key]))
+    for child in plan.get("inputStages", []):
+        stages.extend(_plan_stages(child))
+    return stages
+
+@api_router.get("/admin/index-stats")
+async def get_index_stats(current_user: User = Depends(get_current_user)):
+    """Index kullanım istatistiklerini ve hâlâ koleksiyon taraması yapan sorguları döndürür"""
+    if current_user.role != "yönetici":
+        raise HTTPException(status_code=403, detail="Sadece yöneticiler index istatistiklerini görebilir")
+    
+    collections = {}
+    for collection_name in INDEX_SPECS:
+        indexes = []
+        async for stat in db[collection_name].aggregate([{"$indexStats": {}}]):
+            accesses = stat.get("accesses", {})
+            indexes.append({
+                "name": stat["name"],
+                "key": dict(stat.get("key", {})),
+                "ops": accesses.get("ops", 0),
+                "since": accesses.get("since"),
+                "unused": accesses.get("ops", 0) == 0
+            })
+        collections[collection_name] = indexes
+    
+    queries = []
+    for query in HOT_QUERIES:
+        find_command = {"find": query["collection"], "filter": query["filter"]}
+        if "sort" in query:
+            find_command["sort"] = query["sort"]
+        try:
+            explain = await db.command({"explain": find_command, "verbosity": "queryPlanner"})
+            stages = _plan_stages(explain.get("queryPlanner", {}).get("winningPlan", {}))
+            queries.append({
+                "name": query["name"],
+                "collection": query["collection"],
+                "stages": stages,
+                "collection_scan": "COLLSCAN" in stages
+            })
+        except Exception as e:
+            logger.warning(f"Explain hatası ({query['name']}): {e}")
+            queries.append({"name": query["name"], "collection": query["collection"], "error": str(e)})
+    
+    return {
+        "collections": collections,
+        "queries": queries,
+        "scanning_queries": [q["name"] for q in queries if q.get("collection_scan")]
+    }
+
+# Yavaş sorgu kaydı: eşiği aşan Mongo komutları route, filtre şekli, süre ve dönen
+# belge sayısıyla capped slow_queries koleksiyonuna yazılır; istenirse explain eklenir.
+SLOW_QUERY_COLLECTION = "slow_queries"
+EXPLAINABLE_COMMANDS = {"find", "aggregate", "count", "distinct", "update", "delete", "findAndModify"}
+EXPLAIN_STRIPPED_FIELDS = {"lsid", "txnNumber", "autocommit", "startTransaction", "readConcern", "writeConcern"}
+
+SHAPE_SPEC_STAGES = {"$sort", "$project"}
+
+def query_shape(value):
+    """Sorgudaki sabit değerleri "?" ile maskeler; alan adları, operatörler ve alan yolları kalır.
+
+    Sıralama ve projeksiyon aşamalarındaki -1/0/1 yön/dahil etme değerleri de kalır;
+    filtrelerde ise {"quantity": 0} gibi sabitler bir şekli ikiye bölmesin diye maskelenir.
+    """
+    if isinstance(value, dict):
+        return {key: spec_shape(item) if key in SHAPE_SPEC_STAGES else query_shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [query_shape(item) for item in value[:1]] + (["..."] if len(value) > 1 else [])
+    if isinstance(value, str) and value.startswith("$"):
+        return value
+    return "?"
+
+def spec_shape(spec):
+    """$sort/$project belgesi: alan başına yön veya 0/1 korunur, ifadeler maskelenir"""
+    if not isinstance(spec, dict):
+        return query_shape(spec)
+    return {
+        key: item if isinstance(item, int) and not isinstance(item, bool) and item in (-1, 0, 1) else query_shape(item)
+        for key, item in spec.items()
+    }
+
+def command_shape(command_name: str, command: dict):
+    if command_name == "find":
+        return {"filter": query_shape(command.get("filter", {})), "sort": command.get("sort")}
+    if command_name == "aggregate":
+        return {"pipeline": [query_shape(stage) for stage in command.get("pipeline", [])]}
+    if command_name in ("count", "distinct", "findAndModify"):
+        return {"query": query_shape(command.get("query", {}))}
+    if command_name in ("update", "delete"):
+        statements = command.get(f"{command_name}s", [])
+        return {"q": query_shape(statements[0].get("q", {})) if statements else None, "statements": len(statements)}
+    return None
+
+def reply_doc_count(reply: dict) -> Optional[int]:
+    cursor = reply.get("cursor")
+    if isinstance(cursor, dict):
+        return len(cursor.get("firstBatch", cursor.get("nextBatch", [])))
+    return reply.get("n")
+
+class SlowQueryRecorder:
+    """Komut izleme olaylarından yavaş komutları yakalar.
+
+    Listener Motor'un executor thread'lerinde çağrılır; kayıt ve explain işleri
+    call_soon_threadsafe ile event loop'a aktarılır. Aynı şekildeki sorgu için
+    explain en fazla 10 dakikada bir çalıştırılır.
+    """
+
+    def __init__(self):
+        self.loop = None
+        self.pending = {}
+        self.tasks = set()
+        self.plans = TTLCache(1000, 600)
+
+    def on_started(self, event, ops):
+        if SLOW_QUERY_MS <= 0 or self.loop is None or event.command_name == "explain":
+            return
+        if event.command.get(event.command_name) == SLOW_QUERY_COLLECTION:
+            return
+        self.pending[(event.connection_id, event.request_id)] = (event.command, ops.route if ops else None)
+
+    def on_finished(self, event, failed: bool):
+        started = self.pending.pop((event.connection_id, event.request_id), None)
+        if started is None:
+            return
+        duration_ms = event.duration_micros / 1000
+        if duration_ms < SLOW_QUERY_MS:
+            return
+        command, route = started
+        collection = command.get(event.command_name)
+        if event.command_name == "getMore":
+            collection = command.get("collection")
+        entry = {
+            "at": datetime.now(timezone.utc),
+            "route": route,
+            "command": event.command_name,
+            "collection": collection if isinstance(collection, str) else None,
+            # "$" ile başlayan anahtarlar belgede saklanamayacağı için şekil metin olarak tutulur
+            "shape": json_util.dumps(command_shape(event.command_name, command)),
+            "duration_ms": round(duration_ms, 1),
+            "docs_returned": None if failed else reply_doc_count(event.reply),
+            "failed": failed
+        }
+        self.loop.call_soon_threadsafe(self._schedule, entry, command)
+
+    def _schedule(self, entry: dict, command: dict):
+        task = asyncio.create_task(self.record(entry, command))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def record(self, entry: dict, command: dict):
+        if SLOW_QUERY_EXPLAIN and entry["command"] in EXPLAINABLE_COMMANDS:
+            entry["plan"] = await self.explain(entry, command)
+        try:
+            await db[SLOW_QUERY_COLLECTION].insert_one(entry)
+        except Exception as e:
+            logger.warning(f"Yavaş sorgu kaydedilemedi: {e}")
+
+    async def explain(self, entry: dict, command: dict) -> Optional[dict]:
+        key = (entry["collection"], entry["command"], entry["shape"])
+        plan = self.plans.get(key)
+        if plan is not None:
+            return plan
+        if entry["command"] in ("update", "delete") and len(command.get(f"{entry['command']}s", [])) != 1:
+            return None  # Birden çok ifadeli toplu yazmalar explain edilemez
+        
+        explain_command = {k: v for k, v in command.items() if not k.startswith("$") and k not in EXPLAIN_STRIPPED_FIELDS}
+        try:
+            result = await db.command({"explain": explain_command, "verbosity": "queryPlanner"})
+        except Exception as e:
+            return {"error": str(e)}
+        planner = result.get("queryPlanner")
+        if planner is None and result.get("stages"):
+            # aggregate explain'inde plan ilk stage'in $cursor'ı altındadır
+            planner = result["stages"][0].get("$cursor", {}).get("queryPlanner")
+        stages = _plan_stages((planner or {}).get("winningPlan", {}))
+        plan = {"stages": stages, "collection_scan": "COLLSCAN" in stages}
+        self.plans.set(key, plan)
+        return plan
+
+slow_query_recorder = SlowQueryRecorder()
+
+@api_router.get("/admin/slow-queries")
+async def get_slow_queries(
+    limit: int = Query(100, ge=1, le=1000),
+    route: Optional[str] = Query(None, description="Route şablonu, ör. /api/customers/search"),
+    collection: Optional[str] = Query(None),
+    collscan_only: bool = Query(False, description="Sadece COLLSCAN yapanlar (explain açıkken)"),
+    current_user: User = Depends(get_current_user)
+):
+    """Son yavaş Mongo komutlarını yeniden eskiye döndürür"""
+    if current_user.role != "yönetici":
+        raise HTTPException(status_code=403, detail="Sadece yöneticiler yavaş sorguları görebilir")
+    
+    query = {}
+    if route:
+        query["route"] = route
+    if collection:
+        query["collection"] = collection
+    if collscan_only:
+        query["plan.collection_scan"] = True
+    entries = await db[SLOW_QUERY_COLLECTION].find(query, {"_id": 0}).sort("$natural", -1).limit(limit).to_list(limit)
+    return {"threshold_ms": SLOW_QUERY_MS, "explain": SLOW_QUERY_EXPLAIN, "entries": entries}
+
+@api_router.get("/admin/cache-stats")
+async def get_cache_stats(current_user: User = Depends(get_current_user)):
+    """Süreç içi önbelleklerin isabet/ıska istatistiklerini döndürür"""
+    if current_user.role != "yönetici":
+        raise HTTPException(status_code=403, detail="Sadece yöneticiler önbellek istatistiklerini görebilir")
+    
+    return {
+        "users": user_cache.stats(),
+        "barcodes": barcode_cache.stats()
+    }
+
+@api_router.get("/admin/upstream-stats")
+async def get_upstream_stats(current_user: User = Depends(get_current_user)):
+    """Dış servis çağrılarının metriklerini ve devre kesici durumlarını döndürür"""
+    if current_user.role != "yönetici":
+        raise HTTPException(status_code=403, detail="Sadece yöneticiler dış servis istatistiklerini görebilir")
+    
+    return http_client.stats()
+
+@api_router.get("/metrics")
+async def get_metrics(request: Request):
+    """Prometheus metin formatında istek ve Mongo metrikleri.
+
+    "Authorization: Bearer <METRICS_TOKEN>" (scraper için) ya da yönetici JWT'si gerekir;
+    ikisi de yoksa erişim reddedilir.
+    """
+    scheme, _, credentials = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not credentials:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    token = os.environ.get('METRICS_TOKEN')
+    if not (token and hmac.compare_digest(credentials.encode(), token.encode())):
+        current_user = await get_current_user(HTTPAuthorizationCredentials(scheme=scheme, credentials=credentials))
+        if current_user.role != "yönetici":
+            raise HTTPException(status_code=403, detail="Sadece yöneticiler metrikleri görebilir")
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 # Include the router in the main app
 app.include_router(api_router)
 
+class MetricsMiddleware:
+    """İstek süresini (gövde akışı dahil), durum kodunu ve Mongo komut sayısını route şablonu bazında kaydeder"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        status_code = 500
+        
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+        
+        ops = RequestMongoOps(scope)
+        token = request_mongo_ops.set(ops)
+        with metrics.lock:
+            metrics.in_flight += 1
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            with metrics.lock:
+                metrics.in_flight -= 1
+            request_mongo_ops.reset(token)
+            # Eşleşmeyen yollar tek etikette toplanır (etiket sayısı patlamasın)
+            route = scope.get("route")
+            metrics.observe_request(scope["method"], getattr(route, "path", "unmatched"), status_code, elapsed, ops.count)
+
+app.add_middleware(MetricsMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -1200,6 +3494,148 @@ async def startup_create_admin():
     except Exception as e:
         logger.error(f"❌ Admin kullanıcı oluşturulurken hata: {e}")
 
+@app.on_event("startup")
+async def startup_ensure_indexes():
+    """Gerekli index'leri oluşturur (zaten varsa dokunmaz)"""
+    for collection_name, specs in INDEX_SPECS.items():
+        for keys, options in specs:
+            try:
+                await db[collection_name].create_index(keys, **options)
+            except Exception as e:
+                # Örn. mevcut verideki tekrar eden barkodlar unique index'i engeller
+                logger.error(f"❌ Index oluşturulamadı ({collection_name} {keys}): {e}")
+    logger.info("ℹ️  Index kontrolü tamamlandı")
+
+# Versiyonlu migration'lar: startup'ta sırayla çalışır, uygulananlar "migrations" koleksiyonuna yazılır
+TIMESTAMP_FIELDS = {
+    "users": ["created_at"],
+    "products": ["created_at", "updated_at"],
+    "sales": ["created_at"],
+    "customers": ["created_at"],
+    "calendar_events": ["date", "created_at"],
+}
+MIGRATION_BATCH_SIZE = 1000
+
+async def migrate_timestamps_to_dates() -> dict:
+    """String (ISO) olarak saklanan tarih alanlarını BSON date'e çevirir"""
+    converted = {}
+    for collection_name, fields in TIMESTAMP_FIELDS.items():
+        query = {"$or": [{field: {"$type": "string"}} for field in fields]}
+        operations = []
+        count = 0
+        async for doc in db[collection_name].find(query, {field: 1 for field in fields}):
+            updates = {}
+            for field in fields:
+                if isinstance(doc.get(field), str):
+                    try:
+                        updates[field] = parse_datetime_param(doc[field])
+                    except ValueError:
+                        logger.warning(f"Çevrilemeyen tarih: {collection_name}.{field} = {doc[field]!r}")
+            if updates:
+                operations.append(UpdateOne({"_id": doc["_id"]}, {"$set": updates}))
+            if len(operations) >= MIGRATION_BATCH_SIZE:
+                await db[collection_name].bulk_write(operations, ordered=False)
+                count += len(operations)
+                operations = []
+        if operations:
+            await db[collection_name].bulk_write(operations, ordered=False)
+            count += len(operations)
+        converted[collection_name] = count
+    return converted
+
+async def backfill_customer_search_fields() -> dict:
+    """Mevcut müşterilere name_tokens ve phone_digits alanlarını yazar"""
+    operations = []
+    count = 0
+    async for customer in db.customers.find({}, {"_id": 1, "name": 1, "phone": 1}):
+        fields = customer_search_fields(customer.get("name", ""), customer.get("phone", ""))
+        operations.append(UpdateOne({"_id": customer["_id"]}, {"$set": fields}))
+        if len(operations) >= MIGRATION_BATCH_SIZE:
+            await db.customers.bulk_write(operations, ordered=False)
+            count += len(operations)
+            operations = []
+    if operations:
+        await db.customers.bulk_write(operations, ordered=False)
+        count += len(operations)
+    return {"customers": count}
+
+async def reconcile_low_stock_flags() -> dict:
+    """is_low_stock bayrağı eksik ya da güncel olmayan ürünleri düzeltir"""
+    result = await db.products.update_many(
+        {"$expr": {"$ne": [{"$ifNull": ["$is_low_stock", None]}, {"$lte": ["$quantity", "$min_quantity"]}]}},
+        [LOW_STOCK_STAGE]
+    )
+    return {"products": result.modified_count}
+
+async def backfill_sale_item_totals() -> dict:
+    """total alanı olmayan eski satış satırlarına fiyat x miktarı yazar.
+
+    Raporlar, rollup ve rebuild satır cirosunu yalnızca items.total'dan okur.
+    """
+    result = await db.sales.update_many(
+        {"items": {"$elemMatch": {"total": {"$exists": False}}}},
+        [{"$set": {"items": {"$map": {
+            "input": "$items",
+            "in": {"$mergeObjects": ["$$this", {"total": {"$ifNull": [
+                "$$this.total",
+                {"$ifNull": [{"$round": [{"$multiply": ["$$this.price", "$$this.quantity"]}, 2]}, 0]}
+            ]}}]}
+        }}}}]
+    )
+    if result.modified_count and await sales_rollup_ready():
+        await rebuild_sales_daily_rollup()
+    return {"sales": result.modified_count}
+
+MIGRATIONS = [
+    (1, "Tarih alanlarını BSON date'e çevir", migrate_timestamps_to_dates),
+    (2, "Müşteri arama alanlarını doldur", backfill_customer_search_fields),
+    (3, "Düşük stok bayrağını doldur", reconcile_low_stock_flags),
+    (4, "Eski satış satırlarına maliyet yaz", backfill_sale_item_costs),
+    (5, "Eski satış satırlarına satır toplamı yaz", backfill_sale_item_totals),
+]
+
+@app.on_event("startup")
+async def startup_run_migrations():
+    """Henüz uygulanmamış migration'ları sırayla çalıştırır"""
+    applied = {m["_id"] async for m in db.migrations.find({}, {"_id": 1})}
+    for version, description, migration in MIGRATIONS:
+        if version in applied:
+            continue
+        try:
+            result = await migration()
+            await db.migrations.insert_one({
+                "_id": version,
+                "description": description,
+                "result": result,
+                "applied_at": datetime.now(timezone.utc)
+            })
+            logger.info(f"✅ Migration {version} uygulandı: {description} {result}")
+        except DuplicateKeyError:
+            # Başka bir worker aynı migration'ı bitirmiş
+            continue
+        except Exception as e:
+            logger.error(f"❌ Migration {version} başarısız: {e}")
+            break
+
+@app.on_event("startup")
+async def startup_slow_query_log():
+    """Yavaş sorgu kaydı için capped koleksiyonu oluşturur ve kaydediciyi event loop'a bağlar"""
+    if SLOW_QUERY_MS <= 0:
+        return
+    if SLOW_QUERY_COLLECTION not in await db.list_collection_names():
+        try:
+            await db.create_collection(SLOW_QUERY_COLLECTION, capped=True, size=SLOW_QUERY_LOG_SIZE_MB * 1024 * 1024)
+        except CollectionInvalid:
+            pass  # Başka bir worker oluşturdu
+    slow_query_recorder.loop = asyncio.get_running_loop()
+
+@app.on_event("startup")
+async def startup_http_client():
+    await http_client.start()
+    # Yeniden başlatmada kurlar soğuk başlamasın
+    await load_persisted_currency_rates()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await http_client.close()
     client.close()
\ No newline at end of file
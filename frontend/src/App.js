@@ -18,6 +18,9 @@ import PWAInstallBanner from './components/PWAInstallBanner';
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
 
+// Backend'in döndürdüğü göreli görsel yollarını (/api/images/...) tam adrese çevirir
+export const imageSrc = (url) => (url && url.startsWith('/api/') ? `${BACKEND_URL}${url}` : url);
+
 const AuthContext = createContext(null);
 
 export const useAuth = () => useContext(AuthContext);
@@ -210,7 +210,12 @@ function POS() {
       setDiscount(0);
       barcodeRef.current?.focus();
     } catch (error) {
-      toast.error('Satış işlemi başarısız!');
+      const shortages = error.response?.data?.detail?.items;
+      if (shortages?.length) {
+        toast.error(`Yetersiz stok: ${shortages.map(s => `${s.name} (${s.available})`).join(', ')}`);
+      } else {
+        toast.error('Satış işlemi başarısız!');
+      }
     } finally {
       setLoading(false);
     }
@@ -1,7 +1,7 @@
 import React, { useState, useEffect, useRef } from 'react';
 import { useLocation } from 'react-router-dom';
 import axios from 'axios';
-import { API, useAuth } from '../App';
+import { API, useAuth, imageSrc } from '../App';
 import { toast } from 'sonner';
 import { Button } from '../components/ui/button';
 import { Input } from '../components/ui/input';
@@ -12,11 +12,17 @@ import { Label } from '../components/ui/label';
 import { Plus, Edit, Trash2, Sparkles, Upload, Grid3x3, List, Search, Camera, X, Filter, AlertCircle } from 'lucide-react';
 import { Html5Qrcode } from 'html5-qrcode';
 
+const PAGE_SIZE = 50;
+
 function Stock() {
   const { user } = useAuth();
   const location = useLocation();
   const [products, setProducts] = useState([]);
-  const [filteredProducts, setFilteredProducts] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [total, setTotal] = useState(0);
+  const [loadingMore, setLoadingMore] = useState(false);
+  const [brands, setBrands] = useState([]);
+  const [categories, setCategories] = useState([]);
   const [loading, setLoading] = useState(true);
   const [dialogOpen, setDialogOpen] = useState(false);
   const [priceCompareDialogOpen, setPriceCompareDialogOpen] = useState(false);
@@ -39,6 +45,8 @@ function Stock() {
   const [capturedPhoto, setCapturedPhoto] = useState(null);
   const videoRef = useRef(null);
   const canvasRef = useRef(null);
+  const requestRef = useRef(0);
+  const watermarkRef = useRef(null);
   const [formData, setFormData] = useState({
     name: '',
     barcode: '',
@@ -61,7 +69,7 @@ function Stock() {
   });
 
   useEffect(() => {
-    fetchProducts();
+    fetchFilterOptions();
   }, []);
 
   useEffect(() => {
@@ -74,14 +82,36 @@ function Stock() {
   }, [location]);
 
   useEffect(() => {
-    applyFilters();
-  }, [products, filters]);
+    // Filtreler sunucuda uygulanır; yazarken her tuşta istek atılmasın
+    const timer = setTimeout(() => fetchProducts(), 300);
+    return () => clearTimeout(timer);
+  }, [filters, location.search]);
+
+  const hasFilters = () =>
+    Boolean(filters.name || filters.barcode || filters.brand || filters.category) ||
+    new URLSearchParams(location.search).get('filter') === 'low-stock';
+
+  const productQueryParams = () => {
+    const params = { limit: PAGE_SIZE, include_total: true };
+    if (filters.name) params.q = filters.name;
+    if (filters.barcode) params.barcode = filters.barcode;
+    if (filters.brand) params.brand = filters.brand;
+    if (filters.category) params.category = filters.category;
+    if (new URLSearchParams(location.search).get('filter') === 'low-stock') params.low_stock = true;
+    return params;
+  };
 
   const fetchProducts = async () => {
+    // Sayfalı yükleme: ilk sayfa ve toplam sayı gelir, devamı next_cursor ile
+    const requestId = ++requestRef.current;
     try {
-      const response = await axios.get(`${API}/products`);
-      setProducts(response.data);
-      setFilteredProducts(response.data);
+      const response = await axios.get(`${API}/products`, { params: productQueryParams() });
+      // Filtre değiştiyse eski isteğin yanıtı yeni listeyi ezmesin
+      if (requestId !== requestRef.current) return;
+      setProducts(response.data.items);
+      setNextCursor(response.data.next_cursor);
+      setTotal(response.data.total);
+      watermarkRef.current = response.data.watermark;
     } catch (error) {
       toast.error('Ürünler yüklenemedi');
     } finally {
@@ -89,40 +119,53 @@ function Stock() {
     }
   };
 
-  const applyFilters = () => {
-    let filtered = [...products];
-
-    // URL parametresinden düşük stok filtresi kontrolü
-    const params = new URLSearchParams(location.search);
-    if (params.get('filter') === 'low-stock') {
-      filtered = filtered.filter(p => p.quantity <= p.min_quantity);
-    }
-
-    if (filters.name) {
-      filtered = filtered.filter(p => 
-        p.name.toLowerCase().includes(filters.name.toLowerCase())
-      );
-    }
-
-    if (filters.barcode) {
-      filtered = filtered.filter(p => 
-        p.barcode.toLowerCase().includes(filters.barcode.toLowerCase())
-      );
+  const loadMoreProducts = async () => {
+    const requestId = requestRef.current;
+    setLoadingMore(true);
+    try {
+      const response = await axios.get(`${API}/products`, {
+        params: { ...productQueryParams(), cursor: nextCursor, include_total: false }
+      });
+      if (requestId !== requestRef.current) return;
+      setProducts(prev => [...prev, ...response.data.items]);
+      setNextCursor(response.data.next_cursor);
+    } catch (error) {
+      toast.error('Ürünler yüklenemedi');
+    } finally {
+      setLoadingMore(false);
     }
+  };
 
-    if (filters.brand) {
-      filtered = filtered.filter(p => 
-        p.brand.toLowerCase().includes(filters.brand.toLowerCase())
-      );
+  const syncLoadedProducts = async () => {
+    // Delta sync: yüklü sayfalardaki değişen satırlar yerinde güncellenir, silinenler çıkarılır
+    const requestId = requestRef.current;
+    if (!watermarkRef.current) return fetchProducts();
+    try {
+      const response = await axios.get(`${API}/products/sync`, {
+        params: { since: watermarkRef.current }
+      });
+      if (requestId !== requestRef.current) return;
+      const { items, deleted, watermark, full } = response.data;
+      if (full) return fetchProducts();
+      const changed = new Map(items.map(p => [p.id, p]));
+      const removed = new Set(deleted);
+      const removedCount = products.filter(p => removed.has(p.id)).length;
+      setProducts(prev => prev.filter(p => !removed.has(p.id)).map(p => changed.get(p.id) || p));
+      setTotal(t => t - removedCount);
+      watermarkRef.current = watermark;
+    } catch (error) {
+      fetchProducts();
     }
+  };
 
-    if (filters.category) {
-      filtered = filtered.filter(p => 
-        p.category.toLowerCase().includes(filters.category.toLowerCase())
-      );
+  const fetchFilterOptions = async () => {
+    try {
+      const response = await axios.get(`${API}/products/filters`);
+      setBrands(response.data.brands);
+      setCategories(response.data.categories);
+    } catch (error) {
+      console.error('Filtre seçenekleri yüklenemedi:', error);
     }
-
-    setFilteredProducts(filtered);
   };
 
   const clearFilters = () => {
@@ -411,11 +454,14 @@ function Stock() {
       if (editMode) {
         await axios.put(`${API}/products/${currentProduct.id}`, formData);
         toast.success('Ürün güncellendi');
+        syncLoadedProducts();
       } else {
         await axios.post(`${API}/products`, formData);
         toast.success('Ürün eklendi');
+        // Yeni ürünün sıralamada ve filtrelerde nereye düştüğü bilinmez; ilk sayfa yenilenir
+        fetchProducts();
       }
-      fetchProducts();
+      fetchFilterOptions();
       resetForm();
       setDialogOpen(false);
     } catch (error) {
@@ -451,7 +497,7 @@ function Stock() {
     try {
       await axios.delete(`${API}/products/${productId}`);
       toast.success('Ürün silindi');
-      fetchProducts();
+      syncLoadedProducts();
     } catch (error) {
       toast.error('Silme işlemi başarısız');
     }
@@ -701,7 +747,7 @@ function Stock() {
                     </Button>
                     {formData.image_base64 && (
                       <div className="relative">
-                        <img src={formData.image_base64} alt="Preview" className="w-20 h-20 object-cover rounded-md" />
+                        <img src={imageSrc(formData.image_base64)} alt="Preview" className="w-20 h-20 object-cover rounded-md" />
                         <Button
                           type="button"
                           variant="destructive"
@@ -764,19 +810,29 @@ function Stock() {
               </div>
               <div>
                 <Label>Marka</Label>
-                <Input
-                  placeholder="Marka ara..."
+                <select
+                  className="w-full border rounded-md px-3 py-2"
                   value={filters.brand}
                   onChange={(e) => setFilters({ ...filters, brand: e.target.value })}
-                />
+                >
+                  <option value="">Tümü</option>
+                  {brands.map(brand => (
+                    <option key={brand} value={brand}>{brand}</option>
+                  ))}
+                </select>
               </div>
               <div>
                 <Label>Kategori</Label>
-                <Input
-                  placeholder="Kategori ara..."
+                <select
+                  className="w-full border rounded-md px-3 py-2"
                   value={filters.category}
                   onChange={(e) => setFilters({ ...filters, category: e.target.value })}
-                />
+                >
+                  <option value="">Tümü</option>
+                  {categories.map(category => (
+                    <option key={category} value={category}>{category}</option>
+                  ))}
+                </select>
               </div>
               <div className="flex items-end">
                 <Button 
@@ -790,7 +846,7 @@ function Stock() {
               </div>
             </div>
             <div className="mt-4 text-sm text-gray-600">
-              {filteredProducts.length} ürün gösteriliyor {filteredProducts.length !== products.length && `(${products.length} toplam)`}
+              {products.length} ürün gösteriliyor {products.length !== total && `(${total} ürün filtreye uyuyor)`}
             </div>
           </CardContent>
         </Card>
@@ -799,12 +855,12 @@ function Stock() {
       {/* Grid Görünümü */}
       {viewMode === 'grid' && (
         <div className="grid grid-cols-1 sm:grid-cols-2 lg:grid-cols-3 xl:grid-cols-4 gap-3 sm:gap-4">
-          {filteredProducts.map((product) => (
+          {products.map((product) => (
             <Card key={product.id} className="card-hover" data-testid={`product-card-${product.id}`}>
               <CardContent className="pt-6">
                 {product.image_url && (
                   <img 
-                    src={product.image_url} 
+                    src={imageSrc(product.thumbnail_url || product.image_url)} 
                     alt={product.name} 
                     className="w-full h-40 object-cover rounded-md mb-3 cursor-pointer hover:opacity-80 transition-opacity" 
                     onClick={() => openProductDetail(product)}
@@ -887,12 +943,12 @@ function Stock() {
                   </tr>
                 </thead>
                 <tbody className="bg-white divide-y divide-gray-200">
-                  {filteredProducts.map((product) => (
+                  {products.map((product) => (
                     <tr key={product.id} className="hover:bg-gray-50" data-testid={`product-row-${product.id}`}>
                       <td className="px-6 py-4 whitespace-nowrap">
                         {product.image_url ? (
                           <img 
-                            src={product.image_url} 
+                            src={imageSrc(product.thumbnail_url || product.image_url)} 
                             alt={product.name} 
                             className="w-16 h-16 object-cover rounded cursor-pointer hover:opacity-80 transition-opacity" 
                             onClick={() => openProductDetail(product)}
@@ -971,7 +1027,15 @@ function Stock() {
         </Card>
       )}
 
-      {filteredProducts.length === 0 && products.length > 0 && (
+      {nextCursor && (
+        <div className="flex justify-center">
+          <Button variant="outline" onClick={loadMoreProducts} disabled={loadingMore}>
+            {loadingMore ? 'Yükleniyor...' : `Daha fazla yükle (${products.length} / ${total})`}
+          </Button>
+        </div>
+      )}
+
+      {products.length === 0 && hasFilters() && (
         <Card>
           <CardContent className="py-12 text-center">
             <p className="text-gray-500">Filtrelere uygun ürün bulunamadı</p>
@@ -982,7 +1046,7 @@ function Stock() {
         </Card>
       )}
 
-      {products.length === 0 && (
+      {products.length === 0 && !hasFilters() && (
         <Card>
           <CardContent className="py-12 text-center">
             <p className="text-gray-500">Henüz ürün eklenmemiş</p>
@@ -1101,7 +1165,7 @@ function Stock() {
               {selectedProductDetail.image_url && (
                 <div className="relative w-full rounded-lg overflow-hidden bg-gray-100">
                   <img 
-                    src={selectedProductDetail.image_url} 
+                    src={imageSrc(selectedProductDetail.image_url)} 
                     alt={selectedProductDetail.name} 
                     className="w-full h-auto max-h-[500px] object-contain"
                   />
@@ -0,0 +1,132 @@
+"""Backend testleri için ortak fixture'lar.
+
+Testler uygulamayı süreç içinde (httpx ASGI transport) çalıştırır ve MONGO_URL'deki
+MongoDB'de ayrı bir test veritabanı kullanır; MongoDB erişilemezse atlanır.
+"""
+import os
+import sys
+import uuid
+from pathlib import Path
+
+import httpx
+import pytest
+from aiohttp import web
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+# server import edilmeden önce
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ["DB_NAME"] = os.environ.get("TEST_DB_NAME", "stokcrm_test")
+os.environ.setdefault("JWT_SECRET", "test-secret-key-at-least-32-bytes-long")
+os.environ.setdefault("SLOW_QUERY_MS", "0")
+
+import server  # noqa: E402
+
+@pytest.fixture(scope="session")
+def anyio_backend():
+    return "asyncio"
+
+def mongo_available() -> bool:
+    probe = MongoClient(os.environ["MONGO_URL"], serverSelectionTimeoutMS=1000)
+    try:
+        probe.admin.command("ping")
+        return True
+    except PyMongoError:
+        return False
+    finally:
+        probe.close()
+
+@pytest.fixture(scope="session")
+async def app(anyio_backend):
+    """Startup hook'ları (admin, index, migration) çalışmış, boş test veritabanlı uygulama"""
+    if not mongo_available():
+        pytest.skip("MongoDB erişilemiyor")
+    await server.client.drop_database(server.db.name)
+    async with server.app.router.lifespan_context(server.app):
+        yield server.app
+        # Shutdown client'ı kapatır; temizlik ondan önce
+        await server.client.drop_database(server.db.name)
+
+@pytest.fixture
+async def http(app):
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        yield client
+
+@pytest.fixture
+async def admin(http):
+    """Varsayılan yönetici ile giriş yapmış client"""
+    response = await http.post("/api/auth/login", json={"username": "admin", "password": "Admin123!"})
+    assert response.status_code == 200, response.text
+    http.headers["Authorization"] = f"Bearer {response.json()['access_token']}"
+    return http
+
+@pytest.fixture
+async def make_user(app, admin):
+    """Verilen rolde kullanıcı oluşturur; (kullanıcı, o kullanıcıyla giriş yapmış client) döndürür"""
+    clients = []
+
+    async def create(role="depo"):
+        username = f"kullanici{uuid.uuid4().hex[:8]}"
+        password = "Parola123!"
+        response = await admin.post("/api/auth/register", json={"username": username, "password": password, "role": role})
+        assert response.status_code == 200, response.text
+        transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+        client = httpx.AsyncClient(transport=transport, base_url="http://test")
+        clients.append(client)
+        login = await client.post("/api/auth/login", json={"username": username, "password": password})
+        assert login.status_code == 200, login.text
+        client.headers["Authorization"] = f"Bearer {login.json()['access_token']}"
+        return response.json(), client
+
+    yield create
+    for client in clients:
+        await client.aclose()
+
+@pytest.fixture
+async def stub_upstream(anyio_backend):
+    """Dış servisleri taklit eden yerel aiohttp sunucusu.
+
+    routes: {path: handler}; handler aiohttp Request alır ve Response döndürür.
+    Sunucunun temel adresini döndürür.
+    """
+    runners = []
+
+    async def start(routes: dict) -> str:
+        stub = web.Application()
+        for path, handler in routes.items():
+            stub.router.add_get(path, handler)
+        runner = web.AppRunner(stub)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        runners.append(runner)
+        port = runner.addresses[0][1]
+        return f"http://127.0.0.1:{port}"
+
+    yield start
+    for runner in runners:
+        await runner.cleanup()
+
+@pytest.fixture
+def make_product(admin):
+    """API üzerinden benzersiz barkodlu ürün oluşturur"""
+    async def create(**fields):
+        product = {
+            "name": "Tansiyon Aleti",
+            "barcode": f"TEST{uuid.uuid4().hex[:10]}",
+            "quantity": 10,
+            "min_quantity": 2,
+            "brand": "Omron",
+            "category": "Medikal Cihaz",
+            "purchase_price": 50,
+            "sale_price": 100,
+            **fields
+        }
+        response = await admin.post("/api/products", json=product)
+        assert response.status_code == 200, response.text
+        return response.json()
+    return create
@@ -0,0 +1,45 @@
+import pytest
+
+import server
+from server import Product, TTLCache
+
+def make_product(product_id: str, barcode: str) -> Product:
+    return Product(
+        id=product_id, name="Termometre", barcode=barcode, quantity=5, min_quantity=1,
+        brand="Braun", category="Medikal Cihaz", purchase_price=10, sale_price=20
+    )
+
+@pytest.fixture
+def barcode_cache(monkeypatch):
+    keys = {}
+    monkeypatch.setattr(server, "barcode_cache_keys", keys)
+    monkeypatch.setattr(server, "barcode_cache", TTLCache(2, 60, on_evict=server.forget_barcode_key))
+    return keys
+
+def test_lru_eviction_prunes_key_map(barcode_cache):
+    for i in range(5):
+        server.cache_product_by_barcode(make_product(f"p{i}", f"b{i}"))
+    assert barcode_cache == {"p3": "b3", "p4": "b4"}
+
+def test_expired_entry_prunes_key_map(barcode_cache, monkeypatch):
+    monkeypatch.setattr(server, "barcode_cache", TTLCache(10, -1, on_evict=server.forget_barcode_key))
+    server.cache_product_by_barcode(make_product("p1", "b1"))
+    assert server.barcode_cache.get("b1") is None
+    assert barcode_cache == {}
+
+def test_invalidate_by_product_id(barcode_cache):
+    server.cache_product_by_barcode(make_product("p1", "b1"))
+    server.invalidate_cached_products(["p1"])
+    assert server.barcode_cache.get("b1") is None
+    assert barcode_cache == {}
+
+def test_read_started_before_invalidation_is_not_cached(barcode_cache):
+    # Okuma başlar, o sırada bir satış ürünü geçersiz kılar, okuma eski stokla biter
+    generation = server.barcode_cache.generation
+    server.invalidate_cached_products(["p1"])
+    server.cache_product_by_barcode(make_product("p1", "b1"), generation)
+    assert server.barcode_cache.get("b1") is None
+    assert barcode_cache == {}
+
+    server.cache_product_by_barcode(make_product("p1", "b1"), server.barcode_cache.generation)
+    assert server.barcode_cache.get("b1") is not None
@@ -0,0 +1,101 @@
+import uuid
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+async def insert_products(brand: str, prices):
+    await server.db.products.insert_many([
+        {
+            "id": str(uuid.uuid4()),
+            "name": f"Ürün {i}",
+            "barcode": f"BULK{uuid.uuid4().hex[:10]}",
+            "quantity": 10,
+            "min_quantity": 1,
+            "is_low_stock": False,
+            "brand": brand,
+            "category": "Medikal Sarf",
+            "purchase_price": 1,
+            "sale_price": price
+        }
+        for i, price in enumerate(prices)
+    ])
+
+async def bulk_price_change(admin, prices, percent, rounding):
+    """Fiyatları verilen ürünlere yüzde değişikliği uygular; {eski: yeni} döndürür"""
+    brand = f"Toplu{uuid.uuid4().hex[:6]}"
+    await insert_products(brand, prices)
+    response = await admin.post("/api/products/bulk-update", json={
+        "brand": brand,
+        "price_change": {"percent": percent, "rounding": rounding}
+    })
+    assert response.status_code == 200, response.text
+    products = await server.db.products.find({"brand": brand}).to_list(None)
+    old_by_name = {f"Ürün {i}": price for i, price in enumerate(prices)}
+    return {old_by_name[p["name"]]: p["sale_price"] for p in products}
+
+@pytest.mark.parametrize("rounding, price, percent, expected", [
+    ("none", 100, 10, pytest.approx(110)),
+    ("cent", 19.99, 7, 21.39),
+    ("cent", 10, -33, 6.7),
+    ("whole", 19.99, 7, 21),
+    ("whole", 10.4, 5, 11),
+    ("x.90", 18.00, 5, 18.90),
+    ("x.90", 1.81, 5, 1.90),
+    ("x.90", 19.90, 0, 19.90),
+    ("x.90", 19.95, 0, 20.90),
+    ("x.90", 12.00, 0, 12.90),
+])
+async def test_rounding_modes(admin, rounding, price, percent, expected):
+    assert await bulk_price_change(admin, [price], percent, rounding) == {price: expected}
+
+async def test_preview_does_not_write(admin):
+    brand = f"Toplu{uuid.uuid4().hex[:6]}"
+    prices = [18.00, 1.81, 19.99]
+    await insert_products(brand, prices)
+    response = await admin.post("/api/products/bulk-update", json={
+        "brand": brand,
+        "price_change": {"percent": 5, "rounding": "x.90"},
+        "preview": True
+    })
+    body = response.json()
+    assert body["matched"] == 3
+    assert {row["before"]["sale_price"]: row["sale_price"] for row in body["preview"]} == {18.00: 18.90, 1.81: 1.90, 19.99: 21.90}
+    assert sorted(await server.db.products.distinct("sale_price", {"brand": brand})) == sorted(prices)
+
+async def test_x90_never_skips_a_lira(admin):
+    # Kuruşa yuvarlanmış fiyata eşit ya da büyük en küçük ,90; bir liradan fazla yukarı gitmez
+    prices = [round(cents / 100, 2) for cents in range(100, 5000, 7)]
+    for old, new in (await bulk_price_change(admin, prices, 5, "x.90")).items():
+        target = round(old * 1.05, 2)
+        assert round(new * 100) % 100 == 90
+        assert target - 0.001 <= new < target + 1
+
+@pytest.mark.parametrize("fields", [
+    {"unit_type": "koli"},
+    {"unit_type": "kutu", "package_quantity": 0},
+    {"package_quantity": 10},
+    {"unit_type": "adet", "package_quantity": 10},
+])
+async def test_invalid_unit_fields_are_rejected(admin, fields):
+    brand = f"Toplu{uuid.uuid4().hex[:6]}"
+    await insert_products(brand, [10])
+    response = await admin.post("/api/products/bulk-update", json={"brand": brand, "set": fields})
+    assert response.status_code in (400, 422)
+    product = await server.db.products.find_one({"brand": brand})
+    assert "unit_type" not in product
+
+async def test_switch_to_box_and_back(admin):
+    brand = f"Toplu{uuid.uuid4().hex[:6]}"
+    await insert_products(brand, [10])
+    response = await admin.post("/api/products/bulk-update", json={"brand": brand, "set": {"unit_type": "kutu", "package_quantity": 50}})
+    assert response.status_code == 200
+    product = await server.db.products.find_one({"brand": brand})
+    assert (product["unit_type"], product["package_quantity"]) == ("kutu", 50)
+
+    response = await admin.post("/api/products/bulk-update", json={"brand": brand, "set": {"unit_type": "adet"}})
+    assert response.status_code == 200
+    product = await server.db.products.find_one({"brand": brand})
+    assert (product["unit_type"], product["package_quantity"]) == ("adet", None)
@@ -0,0 +1,95 @@
+import random
+import string
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+def unique_word(length=8):
+    """Aramalar önceki testlerin müşterilerine takılmasın diye yalnızca harflerden oluşan benzersiz kelime"""
+    return "".join(random.choices(string.ascii_lowercase, k=length))
+
+def unique_phone():
+    return "05" + "".join(random.choices(string.digits, k=9))
+
+async def create_customer(admin, name, phone=None):
+    response = await admin.post("/api/customers", json={"name": name, "phone": phone or unique_phone()})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+async def search(admin, q):
+    response = await admin.get("/api/customers/search", params={"q": q})
+    assert response.status_code == 200, response.text
+    return [c["id"] for c in response.json()]
+
+@pytest.mark.parametrize("text, expected", [
+    ("Şahin", "sahin"),
+    ("SAHIN", "sahin"),
+    ("sahin", "sahin"),
+    ("IŞIK", "isik"),
+    ("ışık", "isik"),
+    ("İSTANBUL", "istanbul"),
+    ("istanbul", "istanbul"),
+])
+def test_fold_turkish(text, expected):
+    assert server.fold_turkish(text) == expected
+
+@pytest.mark.parametrize("phone", [
+    "05321234567",
+    "0532 123 45 67",
+    "+90 532 123 45 67",
+    "0090 532 123 45 67",
+    "90 (532) 123-4567",
+])
+def test_normalize_phone(phone):
+    assert server.normalize_phone(phone) == "5321234567"
+
+@pytest.mark.parametrize("query", ["Şahin", "SAHIN", "sahin", "ŞAH"])
+async def test_search_folds_turkish_letters(admin, query):
+    word = unique_word()
+    customer = await create_customer(admin, f"Fatma Şahin {word}")
+    assert customer["id"] in await search(admin, f"{query} {word}")
+
+async def test_search_dotted_and_dotless_i(admin):
+    word = unique_word()
+    customer = await create_customer(admin, f"İlker Işık {word}")
+    for query in ("ilker isik", "İLKER IŞIK", "ılker ışık"):
+        assert customer["id"] in await search(admin, f"{query} {word}")
+
+async def test_search_by_phone_prefix(admin):
+    phone = unique_phone()
+    customer = await create_customer(admin, "Mehmet Demir", phone)
+    formatted = f"{phone[:4]} {phone[4:7]} {phone[7:]}"
+    assert customer["id"] in await search(admin, formatted)
+    assert customer["id"] in await search(admin, phone[:7])
+    assert customer["id"] in await search(admin, "+9" + phone)
+    assert customer["id"] in await search(admin, "009" + phone)
+
+async def test_exact_name_outranks_prefix_candidates(admin, monkeypatch):
+    monkeypatch.setattr(server, "CUSTOMER_SEARCH_LIMIT", 2)
+    word = unique_word()
+    # Önek eşleşmeleri önce yazılır; sırasız aday listesi tam eşleşmeyi dışarıda bırakırdı
+    for suffix in "abcdef":
+        await create_customer(admin, f"{word}{suffix} Yılmaz")
+    exact = await create_customer(admin, f"{word} Yılmaz")
+
+    assert (await search(admin, word))[0] == exact["id"]
+
+async def test_exact_phone_outranks_prefix_candidates(admin, monkeypatch):
+    monkeypatch.setattr(server, "CUSTOMER_SEARCH_LIMIT", 2)
+    phone = unique_phone()
+    for last_digit in "0123456789":
+        await create_customer(admin, "Ali Kara", phone + last_digit)
+    exact = await create_customer(admin, "Ali Kara", phone)
+
+    assert (await search(admin, phone))[0] == exact["id"]
+
+async def test_search_skips_deleted_customers(admin):
+    word = unique_word()
+    customer = await create_customer(admin, f"Zeynep Arslan {word}")
+    assert customer["id"] in await search(admin, word)
+
+    assert (await admin.delete(f"/api/customers/{customer['id']}")).status_code == 200
+    assert customer["id"] not in await search(admin, word)
@@ -0,0 +1,88 @@
+import asyncio
+import uuid
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+class FakeLlm:
+    """llm_complete yerine geçer; çağrıları sayar, isteğe bağlı gecikir veya hata verir"""
+
+    def __init__(self, delay: float = 0):
+        self.prompts = []
+        self.delay = delay
+        self.fail = False
+
+    async def complete(self, prompt: str) -> str:
+        self.prompts.append(prompt)
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("model kullanılamıyor")
+        return f"Açıklama {len(self.prompts)}"
+
+@pytest.fixture
+def llm(app, monkeypatch):
+    fake = FakeLlm()
+    monkeypatch.setattr(server, "llm_complete", fake.complete)
+    return fake
+
+def unique_product(**fields):
+    return {"name": f"Nebulizatör {uuid.uuid4().hex[:6]}", "brand": "Philips", "category": "Medikal Cihaz", **fields}
+
+async def test_description_is_cached_across_formatting(admin, llm):
+    product = unique_product()
+    first = (await admin.post("/api/products/generate-description", json=product)).json()
+    assert first == {"description": "Açıklama 1", "cached": False}
+
+    reformatted = {**product, "name": f"  {product['name'].upper()} ", "brand": "philips"}
+    second = (await admin.post("/api/products/generate-description", json=reformatted)).json()
+    assert second == {"description": "Açıklama 1", "cached": True}
+    assert len(llm.prompts) == 1
+
+    third = (await admin.post("/api/products/generate-description", params={"regenerate": True}, json=product)).json()
+    assert third == {"description": "Açıklama 2", "cached": False}
+
+async def test_concurrent_requests_share_one_call(admin, llm):
+    llm.delay = 0.1
+    product = unique_product()
+    responses = await asyncio.gather(*[
+        admin.post("/api/products/generate-description", json=product) for _ in range(5)
+    ])
+    assert {r.json()["description"] for r in responses} == {"Açıklama 1"}
+    assert len(llm.prompts) == 1
+
+async def test_failure_returns_template_and_is_not_cached(admin, llm):
+    llm.fail = True
+    product = unique_product()
+    response = (await admin.post("/api/products/generate-description", json=product)).json()
+    assert response == {
+        "description": f"{product['name']} - {product['category']} kategorisinde kaliteli bir üründür.",
+        "cached": False
+    }
+
+    llm.fail = False
+    response = (await admin.post("/api/products/generate-description", json=product)).json()
+    assert response == {"description": "Açıklama 2", "cached": False}
+
+async def test_batch_fills_empty_descriptions(admin, llm, make_product):
+    brand = f"Marka{uuid.uuid4().hex[:6]}"
+    empty = [await make_product(brand=brand, name="Aynı Ürün") for _ in range(2)]
+    described = await make_product(brand=brand, name="Dolu", description="Elle yazıldı")
+
+    run = (await admin.post("/api/admin/descriptions/generate", json={"brand": brand})).json()
+    for _ in range(100):
+        run = (await admin.get(f"/api/admin/descriptions/generate/{run['id']}")).json()
+        if run["status"] != "running":
+            break
+        await asyncio.sleep(0.05)
+
+    assert run["status"] == "completed"
+    assert run["stats"]["total"] == 2
+    assert run["stats"]["generated"] + run["stats"]["cached"] == 2
+    assert len(llm.prompts) == 1
+    for product in empty:
+        assert (await server.db.products.find_one({"id": product["id"]}))["description"] == "Açıklama 1"
+    assert (await server.db.products.find_one({"id": described["id"]}))["description"] == "Elle yazıldı"
@@ -0,0 +1,133 @@
+import asyncio
+
+import pytest
+from aiohttp import web
+
+import server
+from server import HttpClient, UpstreamError
+
+pytestmark = pytest.mark.anyio
+
+@pytest.fixture
+async def upstream_client(monkeypatch):
+    monkeypatch.setattr(server, "HTTP_RETRY_BACKOFF", 0)
+    monkeypatch.setattr(server, "CIRCUIT_FAILURE_THRESHOLD", 2)
+    monkeypatch.setattr(server, "CIRCUIT_RESET_SECONDS", 0.05)
+    client = HttpClient()
+    yield client
+    await client.close()
+
+class Upstream:
+    """Sıradaki yanıtları sırayla veren, çağrıları sayan stub"""
+
+    def __init__(self, *statuses, delay: float = 0):
+        self.statuses = list(statuses)
+        self.delay = delay
+        self.calls = 0
+
+    async def handle(self, request):
+        self.calls += 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        status = self.statuses.pop(0) if len(self.statuses) > 1 else self.statuses[0]
+        return web.json_response({"ok": status == 200}, status=status)
+
+async def test_retries_server_errors(upstream_client, stub_upstream):
+    upstream = Upstream(503, 429, 200)
+    base_url = await stub_upstream({"/rates": upstream.handle})
+
+    assert await upstream_client.get_json("stub", f"{base_url}/rates", retries=2) == {"ok": True}
+    assert upstream.calls == 3
+    assert upstream_client.stats()["stub"]["retries"] == 2
+    assert upstream_client.circuit_state("stub") == "closed"
+
+async def test_client_errors_are_not_retried(upstream_client, stub_upstream):
+    upstream = Upstream(404)
+    base_url = await stub_upstream({"/rates": upstream.handle})
+
+    with pytest.raises(UpstreamError):
+        await upstream_client.get_json("stub", f"{base_url}/rates", retries=2)
+    assert upstream.calls == 1
+    assert upstream_client.circuit_state("stub") == "closed"
+
+async def test_circuit_opens_and_recovers(upstream_client, stub_upstream):
+    upstream = Upstream(500)
+    base_url = await stub_upstream({"/rates": upstream.handle})
+
+    for _ in range(2):
+        with pytest.raises(UpstreamError):
+            await upstream_client.get_json("stub", f"{base_url}/rates", retries=0)
+    assert upstream_client.circuit_state("stub") == "open"
+
+    with pytest.raises(UpstreamError, match="devre açık"):
+        await upstream_client.get_json("stub", f"{base_url}/rates", retries=0)
+    assert upstream.calls == 2
+
+    await asyncio.sleep(0.06)
+    upstream.statuses = [200]
+    assert await upstream_client.get_json("stub", f"{base_url}/rates", retries=0) == {"ok": True}
+    assert upstream_client.circuit_state("stub") == "closed"
+
+async def test_cancelled_trial_does_not_keep_circuit_open(upstream_client, stub_upstream):
+    upstream = Upstream(500)
+    base_url = await stub_upstream({"/rates": upstream.handle})
+    for _ in range(2):
+        with pytest.raises(UpstreamError):
+            await upstream_client.get_json("stub", f"{base_url}/rates", retries=0)
+    await asyncio.sleep(0.06)
+
+    # Half-open deneme isteği yanıt beklerken iptal edilir
+    upstream.statuses, upstream.delay = [200], 0.5
+    trial = asyncio.create_task(upstream_client.get_json("stub", f"{base_url}/rates", retries=0))
+    await asyncio.sleep(0.05)
+    trial.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await trial
+
+    upstream.delay = 0
+    assert await upstream_client.get_json("stub", f"{base_url}/rates", retries=0) == {"ok": True}
+    assert upstream_client.circuit_state("stub") == "closed"
+
+@pytest.fixture
+async def currency_upstream(app, monkeypatch, stub_upstream):
+    """Boş kur önbelleği ve verilen gövdeleri döndüren stub kur servisleri"""
+    monkeypatch.setattr(server, "currency_cache", {"data": None, "fetched_at": None})
+    await server.db.currency_rates.delete_many({})
+
+    async def start(exchange_body, metal_body):
+        async def exchange(request):
+            return web.json_response(exchange_body)
+
+        async def metal(request):
+            return web.json_response(metal_body)
+
+        base_url = await stub_upstream({"/exchange": exchange, "/metal": metal})
+        monkeypatch.setattr(server, "EXCHANGE_RATE_API_URL", f"{base_url}/exchange")
+        monkeypatch.setattr(server, "METAL_PRICE_API_URL", f"{base_url}/metal")
+    return start
+
+@pytest.mark.parametrize("exchange_body", [{"rates": None}, [1, 2], "oops"])
+async def test_malformed_exchange_payload_returns_fallback(http, currency_upstream, exchange_body):
+    await currency_upstream(exchange_body, {"success": True, "rates": {"XAU": 0.0004}})
+
+    response = await http.get("/api/currency")
+    assert response.status_code == 200
+    body = response.json()
+    assert body["usd_try"] == server.CURRENCY_FALLBACK["usd_try"]
+    assert body["stale"] is True
+
+@pytest.mark.parametrize("metal_body", [
+    {"success": True, "rates": {"XAU": 0, "XAG": None}},
+    {"success": True, "rates": None},
+    ["unexpected"],
+])
+async def test_malformed_metal_payload_keeps_currency_rates(http, currency_upstream, metal_body):
+    await currency_upstream({"rates": {"USD": 0.025, "EUR": "x"}}, metal_body)
+
+    response = await http.get("/api/currency")
+    assert response.status_code == 200
+    body = response.json()
+    assert body["usd_try"] == 40.0
+    assert body["eur_try"] == 38.20
+    assert body["gold_try"] == 5400.00
+    assert body["stale"] is False
@@ -0,0 +1,100 @@
+import base64
+import os
+import random
+import uuid
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+def image_base64(width=2000, height=1000, noise=False):
+    """Testler arası içerik tekrarı olmasın diye rastgele renkli (ya da sıkışmayan gürültü) PNG"""
+    if noise:
+        image = Image.frombytes("RGB", (width, height), os.urandom(width * height * 3))
+    else:
+        image = Image.new("RGB", (width, height), tuple(random.randrange(256) for _ in range(3)))
+    buffer = BytesIO()
+    image.save(buffer, format="PNG")
+    return "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode()
+
+async def fetch_image(http, url, **headers):
+    return await http.get(url, headers=headers)
+
+async def test_upload_stores_resized_variants(admin, make_product):
+    product = await make_product(image_base64=image_base64(2000, 1000))
+    assert product["image_url"].startswith(server.IMAGE_URL_PREFIX)
+    assert product["thumbnail_url"] == product["image_url"] + "?variant=thumb"
+
+    full = await fetch_image(admin, product["image_url"])
+    thumb = await fetch_image(admin, product["thumbnail_url"])
+    assert full.headers["content-type"] == "image/jpeg"
+    assert Image.open(BytesIO(full.content)).size == (1280, 640)
+    assert Image.open(BytesIO(thumb.content)).size == (256, 128)
+
+async def test_same_image_is_stored_once(admin, make_product):
+    image = image_base64(400, 300)
+    first = await make_product(image_base64=image)
+    second = await make_product(image_base64=image)
+    assert first["image_url"] == second["image_url"]
+
+    image_id = first["image_url"][len(server.IMAGE_URL_PREFIX):]
+    files = await server.db["product_images.files"].count_documents({"metadata.image_id": image_id})
+    assert files == len(server.IMAGE_VARIANTS)
+
+async def test_etag_returns_not_modified(admin, make_product):
+    product = await make_product(image_base64=image_base64(300, 300))
+    first = await fetch_image(admin, product["thumbnail_url"])
+    assert first.status_code == 200
+    assert "immutable" in first.headers["cache-control"]
+
+    again = await fetch_image(admin, product["thumbnail_url"], **{"If-None-Match": first.headers["etag"]})
+    assert again.status_code == 304
+    assert again.content == b""
+
+async def test_missing_image_is_404(admin):
+    assert (await fetch_image(admin, f"{server.IMAGE_URL_PREFIX}{'0' * 64}")).status_code == 404
+
+async def test_oversized_upload_is_rejected(admin, monkeypatch):
+    monkeypatch.setattr(server, "IMAGE_MAX_BYTES", 1024)
+    response = await admin.post("/api/products", json={
+        "name": "Büyük Görsel", "barcode": f"IMG{uuid.uuid4().hex[:10]}", "quantity": 1, "min_quantity": 0,
+        "brand": "Omron", "category": "Medikal Cihaz", "purchase_price": 1, "sale_price": 2,
+        "image_base64": image_base64(100, 100, noise=True)
+    })
+    assert response.status_code == 413
+
+async def test_decompression_bomb_is_rejected(admin, monkeypatch):
+    monkeypatch.setattr(server, "IMAGE_MAX_PIXELS", 100 * 100)
+    response = await admin.post("/api/products", json={
+        "name": "Bomba", "barcode": f"IMG{uuid.uuid4().hex[:10]}", "quantity": 1, "min_quantity": 0,
+        "brand": "Omron", "category": "Medikal Cihaz", "purchase_price": 1, "sale_price": 2,
+        "image_base64": image_base64(200, 200)
+    })
+    assert response.status_code == 413
+
+async def test_migration_extracts_inline_images(admin):
+    product_id = str(uuid.uuid4())
+    await server.db.products.insert_one({
+        "id": product_id,
+        "name": "Eski Görselli Ürün",
+        "barcode": f"IMG{uuid.uuid4().hex[:10]}",
+        "quantity": 5,
+        "min_quantity": 1,
+        "brand": "Braun",
+        "category": "Medikal Cihaz",
+        "purchase_price": 10,
+        "sale_price": 20,
+        "image_url": image_base64(600, 400)
+    })
+
+    response = await admin.post("/api/admin/migrations/extract-product-images")
+    assert response.status_code == 200
+    assert product_id not in response.json()["failed"]
+    product = await server.db.products.find_one({"id": product_id})
+    assert product["image_url"].startswith(server.IMAGE_URL_PREFIX)
+    assert product["thumbnail_url"].endswith("?variant=thumb")
+    assert (await fetch_image(admin, product["image_url"])).status_code == 200
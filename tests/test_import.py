@@ -0,0 +1,96 @@
+import asyncio
+import uuid
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+TURKISH_HEADER = ["Ürün Adı", "Barkod", "Stok", "Min Stok", "Marka", "Kategori", "Alış Fiyatı", "Satış Fiyatı"]
+
+def unique_barcode():
+    return f"IMP{uuid.uuid4().hex[:10]}"
+
+def csv_bytes(rows, delimiter=";", encoding="utf-8"):
+    return "\r\n".join(delimiter.join(str(v) for v in row) for row in [TURKISH_HEADER] + rows).encode(encoding)
+
+def product_row(barcode, name="Şırınga 5 ml", quantity=100, purchase="1,25", sale="2,50"):
+    return [name, barcode, quantity, 10, "Medline", "Medikal Sarf", purchase, sale]
+
+async def run_import(admin, content: bytes, filename="urunler.csv", dry_run=False):
+    """Dosyayı yükler, arka plan işinin bitmesini bekler ve çalıştırma kaydını döndürür"""
+    response = await admin.post(
+        "/api/products/import",
+        params={"dry_run": dry_run},
+        files={"file": (filename, content, "text/csv")}
+    )
+    assert response.status_code == 200, response.text
+    await asyncio.gather(*server.import_tasks)
+    run = (await admin.get(f"/api/products/import/{response.json()['id']}")).json()
+    assert run["status"] == "completed", run
+    return run
+
+async def find_product(barcode):
+    return await server.db.products.find_one({"barcode": barcode})
+
+@pytest.mark.parametrize("delimiter", [";", ",", "\t"])
+async def test_delimiter_is_sniffed(admin, delimiter):
+    barcode = unique_barcode()
+    row = product_row(barcode, purchase="1.25", sale="2.5") if delimiter == "," else product_row(barcode)
+    run = await run_import(admin, csv_bytes([row], delimiter=delimiter))
+    assert run["stats"]["inserted"] == 1
+    product = await find_product(barcode)
+    assert product["sale_price"] == 2.5
+    assert product["brand"] == "Medline"
+
+@pytest.mark.parametrize("encoding", ["utf-8", "utf-8-sig", "cp1254"])
+async def test_turkish_headers_and_encodings(admin, encoding):
+    barcode = unique_barcode()
+    run = await run_import(admin, csv_bytes([product_row(barcode, name="Göğüs Pompası İğne")], encoding=encoding))
+    assert run["stats"] == {"rows": 1, "valid": 1, "invalid": 0, "inserted": 1, "updated": 0}
+    product = await find_product(barcode)
+    assert product["name"] == "Göğüs Pompası İğne"
+    assert product["quantity"] == 100
+    assert product["min_quantity"] == 10
+
+@pytest.mark.parametrize("value, expected", [("1.234,50", 1234.5), ("12,9", 12.9), ("12.9", 12.9)])
+async def test_decimal_commas(admin, value, expected):
+    barcode = unique_barcode()
+    await run_import(admin, csv_bytes([product_row(barcode, sale=value)]))
+    assert (await find_product(barcode))["sale_price"] == expected
+
+async def test_duplicate_barcode_is_reported(admin):
+    barcode = unique_barcode()
+    run = await run_import(admin, csv_bytes([product_row(barcode, quantity=5), product_row(barcode, quantity=7)]))
+    assert run["stats"]["inserted"] == 1
+    assert run["stats"]["invalid"] == 1
+    assert run["errors"][0]["row"] == 3
+    assert run["errors"][0]["barcode"] == barcode
+    assert (await find_product(barcode))["quantity"] == 5
+
+async def test_insert_update_split(admin, make_product):
+    existing = await make_product(quantity=3, description="Eski açıklama")
+    new_barcode = unique_barcode()
+    run = await run_import(admin, csv_bytes([product_row(existing["barcode"], quantity=40), product_row(new_barcode)]))
+    assert run["stats"]["inserted"] == 1
+    assert run["stats"]["updated"] == 1
+
+    updated = await find_product(existing["barcode"])
+    assert updated["id"] == existing["id"]
+    assert updated["quantity"] == 40
+    # Dosyada olmayan alanlar korunur
+    assert updated["description"] == "Eski açıklama"
+    assert (await find_product(new_barcode))["id"]
+
+async def test_dry_run_does_not_write(admin, make_product):
+    existing = await make_product(quantity=3)
+    new_barcode = unique_barcode()
+    run = await run_import(
+        admin,
+        csv_bytes([product_row(existing["barcode"], quantity=40), product_row(new_barcode), ["", "", "x"]]),
+        dry_run=True
+    )
+    assert run["stats"] == {"rows": 3, "valid": 2, "invalid": 1, "inserted": 1, "updated": 1}
+    assert (await find_product(existing["barcode"]))["quantity"] == 3
+    assert await find_product(new_barcode) is None
@@ -0,0 +1,52 @@
+import httpx
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+def route_ops(route):
+    """(istek sayısı, toplam Mongo komutu) — route şablonu bazında"""
+    histogram = server.metrics.request_mongo_ops.get(("GET", route))
+    return (histogram.total, histogram.sum) if histogram else (0, 0)
+
+async def test_metrics_require_authentication(http, monkeypatch):
+    monkeypatch.delenv("METRICS_TOKEN", raising=False)
+    response = await http.get("/api/metrics")
+    assert response.status_code == 401
+
+async def test_metrics_reject_non_admin(make_user):
+    _, client = await make_user(role="depo")
+    assert (await client.get("/api/metrics")).status_code == 403
+
+async def test_metrics_for_admin(admin):
+    response = await admin.get("/api/metrics")
+    assert response.status_code == 200
+    assert "http_request_duration_seconds_bucket" in response.text
+
+async def test_metrics_token(app, monkeypatch):
+    monkeypatch.setenv("METRICS_TOKEN", "scrape-token")
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as scraper:
+        assert (await scraper.get("/api/metrics", headers={"Authorization": "Bearer scrape-token"})).status_code == 200
+        assert (await scraper.get("/api/metrics", headers={"Authorization": "Bearer yanlis"})).status_code == 401
+
+async def test_mongo_operations_are_attributed_to_route(admin):
+    # Kimlik doğrulama önbelleğe alınsın; sayılan komutlar yalnızca aramanınkiler olsun
+    await admin.get("/api/customers")
+    search_before = route_ops("/api/customers/search")
+    filters_before = route_ops("/api/products/filters")
+
+    response = await admin.get("/api/customers/search", params={"q": "ayşe"})
+    assert response.status_code == 200
+
+    requests, commands = route_ops("/api/customers/search")
+    assert requests == search_before[0] + 1
+    # Tam eşleşme ve önek sorguları (Motor executor'ında çalışsalar da isteğe sayılır)
+    assert commands - search_before[1] == 2
+    assert route_ops("/api/products/filters") == filters_before
+
+async def test_status_and_unmatched_routes_are_counted(admin):
+    before = server.metrics.responses.get(("GET", "unmatched", 404), 0)
+    assert (await admin.get("/api/yok-boyle-bir-yol")).status_code == 404
+    assert server.metrics.responses[("GET", "unmatched", 404)] == before + 1
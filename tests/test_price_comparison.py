@@ -0,0 +1,103 @@
+import asyncio
+from datetime import datetime, timezone, timedelta
+
+import pytest
+from aiohttp import web
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+class FakeSerpApi:
+    """SerpAPI Google Shopping yanıtlarını taklit eder; gelen sorguları kaydeder"""
+
+    def __init__(self):
+        self.queries = []
+        self.status = 200
+        self.body = {"shopping_results": [
+            {"price": "₺1.299,90", "source": "Trendyol", "link": "https://example.com/a", "title": "A"},
+            {"price": "₺1.150,00", "source": "Hepsiburada", "link": "https://example.com/b", "title": "B"},
+            {"price": "fiyat yok", "source": "N11"},
+        ]}
+
+    async def handle(self, request):
+        self.queries.append(request.query["q"])
+        return web.json_response(self.body, status=self.status)
+
+@pytest.fixture
+async def serpapi(app, monkeypatch, stub_upstream):
+    fake = FakeSerpApi()
+    base_url = await stub_upstream({"/search.json": fake.handle})
+    monkeypatch.setattr(server, "SERPAPI_URL", f"{base_url}/search.json")
+    monkeypatch.setattr(server, "HTTP_RETRY_BACKOFF", 0)
+    monkeypatch.setenv("SERPAPI_KEY", "test-key")
+    # Önceki testlerin hataları devreyi açık bırakmasın
+    server.http_client.breakers.pop("serpapi", None)
+    server.http_client.metrics.pop("serpapi", None)
+    return fake
+
+async def test_fetches_and_caches_results(admin, make_product, serpapi):
+    product = await make_product()
+
+    first = (await admin.get(f"/api/products/{product['id']}/price-comparison")).json()
+    assert [r["price"] for r in first["price_results"]] == [1150.0, 1299.9]
+    assert first["source"] == "SerpAPI Google Shopping"
+
+    second = (await admin.get(f"/api/products/{product['id']}/price-comparison")).json()
+    assert second["price_results"] == first["price_results"]
+    assert serpapi.queries == [f"{product['brand']} {product['name']}"]
+
+    await admin.get(f"/api/products/{product['id']}/price-comparison", params={"refresh": True})
+    assert len(serpapi.queries) == 2
+
+async def insert_stale_comparison(product):
+    await server.db.price_comparisons.insert_one({
+        "product_id": product["id"],
+        "search_query": server.price_search_query(product),
+        "price_results": [{"site": "Eski", "price": 99.0, "url": "#", "available": True, "title": ""}],
+        "fetched_at": datetime.now(timezone.utc) - timedelta(hours=server.PRICE_COMPARISON_TTL_HOURS + 1)
+    })
+
+async def test_stale_result_served_without_api_key(admin, make_product, serpapi, monkeypatch):
+    product = await make_product()
+    await insert_stale_comparison(product)
+    monkeypatch.delenv("SERPAPI_KEY")
+
+    response = await admin.get(f"/api/products/{product['id']}/price-comparison")
+    assert response.status_code == 200
+    assert response.json()["stale"] is True
+    assert response.json()["price_results"][0]["site"] == "Eski"
+    assert serpapi.queries == []
+
+async def test_stale_result_served_when_upstream_fails(admin, make_product, serpapi):
+    product = await make_product()
+    await insert_stale_comparison(product)
+    serpapi.status = 503
+
+    response = await admin.get(f"/api/products/{product['id']}/price-comparison")
+    assert response.status_code == 200
+    assert response.json()["price_results"][0]["site"] == "Eski"
+
+@pytest.mark.parametrize("body", [{"shopping_results": "oops"}, ["oops"], {"shopping_results": [None, 5]}])
+async def test_malformed_payload_falls_back_to_manual_links(admin, make_product, serpapi, body):
+    product = await make_product()
+    serpapi.body = body
+
+    response = await admin.get(f"/api/products/{product['id']}/price-comparison")
+    assert response.status_code == 200
+    assert response.json()["source"].startswith("Manuel Arama")
+
+async def test_batch_refresh_run(admin, make_product, serpapi):
+    brand = "FiyatTest"
+    products = [await make_product(brand=brand, name=f"Ürün {i}") for i in range(3)]
+
+    run = (await admin.post("/api/admin/price-comparisons/refresh", json={"brand": brand, "concurrency": 2})).json()
+    for _ in range(100):
+        run = (await admin.get(f"/api/admin/price-comparisons/refresh/{run['id']}")).json()
+        if run["status"] != "running":
+            break
+        await asyncio.sleep(0.05)
+
+    assert run["status"] == "completed"
+    assert run["stats"]["refreshed"] == 3
+    assert sorted(serpapi.queries) == sorted(f"{brand} {p['name']}" for p in products)
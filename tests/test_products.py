@@ -0,0 +1,201 @@
+import base64
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+async def insert_legacy_product():
+    """Yeni alanlardan (unit_type, thumbnail_url, description, ...) önce yazılmış ürün"""
+    product_id = str(uuid.uuid4())
+    await server.db.products.insert_one({
+        "id": product_id,
+        "name": "Eski Ürün",
+        "barcode": f"LEGACY{uuid.uuid4().hex[:8]}",
+        "quantity": 5,
+        "min_quantity": 1,
+        "brand": "Braun",
+        "category": "Medikal Cihaz",
+        "purchase_price": 10,
+        "sale_price": 20,
+        "created_at": datetime.now(timezone.utc)
+    })
+    return product_id
+
+@pytest.mark.parametrize("fast", [False, True])
+async def test_product_list_fills_model_defaults(admin, monkeypatch, fast):
+    monkeypatch.setattr(server, "FAST_LIST_RESPONSES", fast)
+    product_id = await insert_legacy_product()
+
+    response = await admin.get("/api/products")
+    assert response.status_code == 200
+    product = next(p for p in response.json() if p["id"] == product_id)
+    assert product["unit_type"] == "adet"
+    assert product["thumbnail_url"] is None
+    assert product["description"] is None
+    assert product["updated_at"]
+
+async def insert_brand_products(count, **fields):
+    """Sayfalama testleri için benzersiz markalı ürünler; markayı döndürür"""
+    brand = f"Sayfa{uuid.uuid4().hex[:6]}"
+    await server.db.products.insert_many([
+        {
+            "id": str(uuid.uuid4()),
+            "name": f"Ürün {i:02d}",
+            "barcode": f"PAGE{uuid.uuid4().hex[:10]}",
+            "quantity": 10,
+            "min_quantity": 1,
+            "is_low_stock": False,
+            "brand": brand,
+            "category": "Medikal Sarf",
+            "purchase_price": 1,
+            "sale_price": 2,
+            **fields
+        }
+        for i in range(count)
+    ])
+    return brand
+
+async def collect_pages(admin, **params):
+    """Tüm sayfaları next_cursor ile dolaşır; (id'ler, sayfa sayısı) döndürür"""
+    ids, pages, cursor = [], 0, None
+    while True:
+        response = await admin.get("/api/products", params={**params, **({"cursor": cursor} if cursor else {})})
+        assert response.status_code == 200, response.text
+        body = response.json()
+        ids += [p["id"] for p in body["items"]]
+        pages += 1
+        cursor = body["next_cursor"]
+        if cursor is None:
+            return ids, pages
+
+async def test_pages_cover_every_product_once(admin):
+    brand = await insert_brand_products(5)
+    expected = [p["id"] for p in await server.db.products.find({"brand": brand}).sort([("name", 1), ("id", 1)]).to_list(None)]
+
+    ids, pages = await collect_pages(admin, brand=brand, limit=2)
+    assert ids == expected
+    assert pages == 3
+
+async def test_exact_last_page_has_no_cursor(admin):
+    brand = await insert_brand_products(4)
+    response = await admin.get("/api/products", params={"brand": brand, "limit": 4, "include_total": True})
+    body = response.json()
+    assert len(body["items"]) == 4
+    assert body["next_cursor"] is None
+    assert body["total"] == 4
+
+async def test_updated_at_pages_include_missing_values(admin):
+    brand = await insert_brand_products(3)
+    # Sadece biri updated_at taşır; diğerleri eski kayıtlar gibi null sıralama anahtarlıdır
+    await server.db.products.update_one({"brand": brand, "name": "Ürün 00"}, {"$set": {"updated_at": datetime.now(timezone.utc)}})
+
+    ids, _ = await collect_pages(admin, brand=brand, sort="updated_at", limit=1)
+    assert sorted(ids) == sorted(p["id"] for p in await server.db.products.find({"brand": brand}).to_list(None))
+
+@pytest.mark.parametrize("raw", [
+    b"not json",
+    b'[{"$oid": "zz"}, "x"]',
+    b'[{"$date": "zz"}, "x"]',
+    b'[{"$regex": "."}, "x"]',
+    b'["x", {"$gt": ""}]',
+    b'["x"]',
+])
+async def test_bad_cursor_is_rejected(admin, raw):
+    cursor = base64.urlsafe_b64encode(raw).decode()
+    response = await admin.get("/api/products", params={"limit": 2, "cursor": cursor})
+    assert response.status_code == 400
+
+@pytest.mark.parametrize("params, expected_names", [
+    ({"category": "Ortopedi"}, ["Ürün 01"]),
+    ({"low_stock": True}, ["Ürün 02"]),
+    ({"q": "Ürün 03"}, ["Ürün 03"]),
+    ({"q": "FILTER03"}, ["Ürün 03"]),
+    ({"barcode": "FILTER03"}, ["Ürün 03"]),
+])
+async def test_page_filters(admin, params, expected_names):
+    brand = await insert_brand_products(4)
+    await server.db.products.update_one({"brand": brand, "name": "Ürün 01"}, {"$set": {"category": "Ortopedi"}})
+    await server.db.products.update_one({"brand": brand, "name": "Ürün 02"}, {"$set": {"is_low_stock": True}})
+    await server.db.products.update_one({"brand": brand, "name": "Ürün 03"}, {"$set": {"barcode": f"FILTER03{uuid.uuid4().hex[:6]}"}})
+
+    response = await admin.get("/api/products", params={"brand": brand, "limit": 10, **params})
+    assert response.status_code == 200
+    assert [p["name"] for p in response.json()["items"]] == expected_names
+
+@pytest.mark.parametrize("fast", [False, True])
+async def test_unpaged_list_is_capped_with_next_cursor(admin, monkeypatch, fast):
+    monkeypatch.setattr(server, "FAST_LIST_RESPONSES", fast)
+    monkeypatch.setattr(server, "PRODUCT_LIST_MAX", 3)
+    brand = await insert_brand_products(5)
+
+    response = await admin.get("/api/products", params={"brand": brand})
+    assert [p["name"] for p in response.json()] == ["Ürün 00", "Ürün 01", "Ürün 02"]
+    rest = await admin.get("/api/products", params={"brand": brand, "limit": 10, "cursor": response.headers["X-Next-Cursor"]})
+    assert [p["name"] for p in rest.json()["items"]] == ["Ürün 03", "Ürün 04"]
+
+async def test_unpaged_list_under_cap_has_no_cursor(admin):
+    brand = await insert_brand_products(2)
+    response = await admin.get("/api/products", params={"brand": brand})
+    assert len(response.json()) == 2
+    assert "X-Next-Cursor" not in response.headers
+
+async def sync(admin, since):
+    response = await admin.get("/api/products/sync", params={"since": since.isoformat() if isinstance(since, datetime) else since})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+async def test_sync_returns_changed_products(admin, make_product):
+    since = datetime.now(timezone.utc) - timedelta(seconds=1)
+    product = await make_product()
+    body = await sync(admin, since)
+    assert body["full"] is False
+    assert product["id"] in [p["id"] for p in body["items"]]
+
+    update = await admin.put(f"/api/products/{product['id']}", json={"quantity": 42})
+    assert update.status_code == 200
+    changed = next(p for p in (await sync(admin, since))["items"] if p["id"] == product["id"])
+    assert changed["quantity"] == 42
+
+async def test_sync_reports_deleted_products(admin, make_product):
+    product = await make_product()
+    since = datetime.now(timezone.utc) - timedelta(seconds=1)
+    assert (await admin.delete(f"/api/products/{product['id']}")).status_code == 200
+
+    body = await sync(admin, since)
+    assert product["id"] in body["deleted"]
+    assert product["id"] not in [p["id"] for p in body["items"]]
+    assert await server.db.product_tombstones.find_one({"id": product["id"]}) is not None
+
+async def test_sync_watermark_lags_so_racing_writes_are_resent(admin, make_product, monkeypatch):
+    monkeypatch.setattr(server, "SYNC_WATERMARK_LAG_SECONDS", 60)
+    before = datetime.now(timezone.utc)
+    product = await make_product()
+    first = await sync(admin, before - timedelta(seconds=1))
+    watermark = datetime.fromisoformat(first["watermark"])
+    assert watermark <= before - timedelta(seconds=59)
+
+    # Watermark'tan sonra yazılan ürün bir sonraki senkronda tekrar gelir
+    assert product["id"] in [p["id"] for p in (await sync(admin, first["watermark"]))["items"]]
+
+async def test_sync_older_than_tombstone_ttl_is_full(admin, make_product):
+    product = await make_product()
+    since = datetime.now(timezone.utc) - timedelta(days=server.PRODUCT_TOMBSTONE_TTL_DAYS + 1)
+    body = await sync(admin, since)
+    assert body["full"] is True
+    assert body["deleted"] == []
+    assert product["id"] in [p["id"] for p in body["items"]]
+
+async def test_sync_rejects_bad_since(admin):
+    response = await admin.get("/api/products/sync", params={"since": "dün"})
+    assert response.status_code == 400
+
+async def test_page_watermark_starts_a_sync(admin, make_product):
+    brand = await insert_brand_products(1)
+    page = (await admin.get("/api/products", params={"brand": brand, "limit": 10})).json()
+    assert page["watermark"]
+    product = await make_product()
+    assert product["id"] in [p["id"] for p in (await sync(admin, page["watermark"]))["items"]]
@@ -0,0 +1,152 @@
+import types
+import uuid
+from datetime import datetime
+
+import pytest
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo.errors import AutoReconnect
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+def sale_payload(product, quantity=2, customer_id=None):
+    total = product["sale_price"] * quantity
+    return {
+        "items": [{
+            "product_id": product["id"],
+            "name": product["name"],
+            "quantity": quantity,
+            "price": product["sale_price"],
+            "total": total
+        }],
+        "total_amount": total,
+        "payment_method": "nakit",
+        "customer_id": customer_id
+    }
+
+async def product_quantity(product_id):
+    return (await server.db.products.find_one({"id": product_id}))["quantity"]
+
+async def test_sale_decrements_stock(admin, make_product):
+    product = await make_product(quantity=10)
+    response = await admin.post("/api/sales", json=sale_payload(product, quantity=3))
+    assert response.status_code == 200
+    assert await product_quantity(product["id"]) == 7
+
+async def test_sale_shortage_leaves_stock(admin, make_product):
+    product = await make_product(quantity=1)
+    response = await admin.post("/api/sales", json=sale_payload(product, quantity=2))
+    assert response.status_code == 409
+    assert await product_quantity(product["id"]) == 1
+
+async def test_failed_insert_restores_stock_without_transactions(admin, make_product, monkeypatch):
+    product = await make_product(quantity=10)
+    customer = (await admin.post("/api/customers", json={"name": "Ayşe Yılmaz", "phone": "05321234567"})).json()
+
+    # Satış id'si mevcut bir satışla çakışsın: insert_one DuplicateKeyError verir
+    sale_id = str(uuid.uuid4())
+    await server.db.sales.insert_one({"id": sale_id, "items": []})
+    monkeypatch.setattr(server, "uuid", types.SimpleNamespace(uuid4=lambda: sale_id))
+    monkeypatch.setattr(server, "transactions_supported", False)
+
+    response = await admin.post("/api/sales", json=sale_payload(product, quantity=4, customer_id=customer["id"]))
+    assert response.status_code == 500
+    assert await product_quantity(product["id"]) == 10
+    assert (await server.db.customers.find_one({"id": customer["id"]}))["total_spent"] == 0
+
+async def test_failed_decrement_restores_applied_lines_without_transactions(admin, make_product, monkeypatch):
+    applied = await make_product(quantity=10)
+    broken = await make_product(quantity=10)
+    original_update_one = AsyncIOMotorCollection.update_one
+
+    async def update_one(self, filter, *args, **kwargs):
+        # Eksik stok değil, ağ hatası: diğer satırın düşümü uygulanmış olur
+        if filter.get("id") == broken["id"] and "quantity" in filter:
+            raise AutoReconnect("bağlantı koptu")
+        return await original_update_one(self, filter, *args, **kwargs)
+
+    monkeypatch.setattr(AsyncIOMotorCollection, "update_one", update_one)
+    monkeypatch.setattr(server, "transactions_supported", False)
+    payload = sale_payload(applied, quantity=3)
+    payload["items"] += sale_payload(broken, quantity=2)["items"]
+    payload["total_amount"] += broken["sale_price"] * 2
+
+    response = await admin.post("/api/sales", json=payload)
+    assert response.status_code == 500
+    assert await product_quantity(applied["id"]) == 10
+    assert await product_quantity(broken["id"]) == 10
+
+@pytest.mark.parametrize("transactions", [True, False])
+async def test_shortage_reports_only_short_lines(admin, make_product, monkeypatch, transactions):
+    if transactions and not await server.supports_transactions():
+        pytest.skip("transaction yolu için replica set gerekli")
+    monkeypatch.setattr(server, "transactions_supported", transactions)
+    enough = await make_product(quantity=5)
+    short = await make_product(quantity=1)
+    payload = sale_payload(enough, quantity=3)
+    payload["items"] += sale_payload(short, quantity=2)["items"]
+    payload["total_amount"] += short["sale_price"] * 2
+
+    response = await admin.post("/api/sales", json=payload)
+    assert response.status_code == 409
+    assert response.json()["detail"]["items"] == [
+        {"product_id": short["id"], "name": short["name"], "requested": 2, "available": 1}
+    ]
+    assert await product_quantity(enough["id"]) == 5
+    assert await product_quantity(short["id"]) == 1
+
+async def test_failed_sale_invalidates_barcode_cache(admin, make_product, monkeypatch):
+    product = await make_product(quantity=1)
+    monkeypatch.setattr(server, "transactions_supported", False)
+    assert (await admin.get(f"/api/products/barcode/{product['barcode']}")).status_code == 200
+    assert server.barcode_cache.get(product["barcode"]) is not None
+
+    # Satıştan önce başlayan bir okuma, geri alınan düşümü önbelleğe yazamamalı
+    generation = server.barcode_cache.generation
+    response = await admin.post("/api/sales", json=sale_payload(product, quantity=2))
+    assert response.status_code == 409
+    assert server.barcode_cache.get(product["barcode"]) is None
+    assert server.barcode_cache.generation > generation
+
+async def test_sale_updates_daily_rollup(admin, make_product):
+    product = await make_product(quantity=10)
+    response = await admin.post("/api/sales", json=sale_payload(product, quantity=3))
+    assert response.status_code == 200
+    row = await server.db.sales_daily.find_one({"product_id": product["id"]})
+    assert row["quantity"] == 3
+    assert row["date"] == server.sale_day_key(datetime.fromisoformat(response.json()["created_at"]))
+
+async def test_rollup_failure_keeps_sale(admin, make_product, monkeypatch):
+    def broken(sale):
+        raise RuntimeError("sales_daily yazılamadı")
+    monkeypatch.setattr(server, "sales_daily_operations", broken)
+    product = await make_product(quantity=10)
+
+    response = await admin.post("/api/sales", json=sale_payload(product, quantity=3))
+    assert response.status_code == 200
+    assert await server.db.sales.find_one({"id": response.json()["id"]}) is not None
+    assert await product_quantity(product["id"]) == 7
+
+async def test_missing_item_total_is_stored_for_reports(admin, make_product):
+    product = await make_product(quantity=10, sale_price=12.5)
+    payload = sale_payload(product, quantity=3)
+    del payload["items"][0]["total"]
+
+    response = await admin.post("/api/sales", json=payload)
+    assert response.status_code == 200
+    sale = await server.db.sales.find_one({"id": response.json()["id"]})
+    assert sale["items"][0]["total"] == 37.5
+    row = await server.db.sales_daily.find_one({"product_id": product["id"]})
+    assert row["revenue"] == 37.5
+
+@pytest.mark.parametrize("item_fields", [{"total": "12"}, {"total": -1}, {"price": None}])
+async def test_invalid_item_total_is_rejected(admin, make_product, item_fields):
+    product = await make_product(quantity=10)
+    payload = sale_payload(product, quantity=1)
+    payload["items"][0].pop("total")
+    payload["items"][0].update(item_fields)
+
+    response = await admin.post("/api/sales", json=payload)
+    assert response.status_code == 400
+    assert await product_quantity(product["id"]) == 10
@@ -0,0 +1,22 @@
+import server
+
+def test_filter_literals_are_masked():
+    shape = server.command_shape("find", {"filter": {"quantity": 0, "deleted": {"$ne": 1}}, "sort": {"name": 1}})
+    assert shape == {"filter": {"quantity": "?", "deleted": {"$ne": "?"}}, "sort": {"name": 1}}
+
+def test_pipeline_keeps_sort_and_projection_specs():
+    shape = server.command_shape("aggregate", {"pipeline": [
+        {"$match": {"is_low_stock": True, "quantity": {"$gt": 0}}},
+        {"$project": {"_id": 0, "name": 1, "total": {"$multiply": ["$price", 1]}}},
+        {"$sort": {"created_at": -1}},
+        {"$limit": 1}
+    ]})
+    assert shape == {"pipeline": [
+        {"$match": {"is_low_stock": "?", "quantity": {"$gt": "?"}}},
+        {"$project": {"_id": 0, "name": 1, "total": {"$multiply": ["$price", "..."]}}},
+        {"$sort": {"created_at": -1}},
+        {"$limit": "?"}
+    ]}
+
+def test_same_shape_for_different_literals():
+    assert server.query_shape({"deleted": 1}) == server.query_shape({"deleted": 7})
@@ -0,0 +1,32 @@
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+async def test_demoted_user_loses_admin_access(admin, make_user):
+    user, client = await make_user(role="yönetici")
+    assert (await client.get("/api/admin/cache-stats")).status_code == 200
+    assert server.user_cache.get(user["id"]) is not None
+
+    response = await admin.put(f"/api/users/{user['id']}", json={"role": "depo"})
+    assert response.status_code == 200
+    assert (await client.get("/api/admin/cache-stats")).status_code == 403
+
+async def test_promoted_user_gains_admin_access(admin, make_user):
+    user, client = await make_user(role="satış")
+    assert (await client.get("/api/admin/cache-stats")).status_code == 403
+
+    response = await admin.put(f"/api/users/{user['id']}", json={"role": "yönetici"})
+    assert response.status_code == 200
+    assert (await client.get("/api/admin/cache-stats")).status_code == 200
+
+async def test_deleted_user_is_rejected(admin, make_user):
+    user, client = await make_user(role="depo")
+    assert (await client.get("/api/customers")).status_code == 200
+    assert server.user_cache.get(user["id"]) is not None
+
+    assert (await admin.delete(f"/api/users/{user['id']}")).status_code == 200
+    response = await client.get("/api/customers")
+    assert response.status_code == 401
+    assert server.user_cache.get(user["id"]) is None